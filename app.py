@@ -1,20 +1,59 @@
 import os
+import secrets
 
 import logfire
 from dotenv import load_dotenv
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+from telegram.ext import (
+    Application,
+    ApplicationBuilder,
+    CommandHandler,
+    MessageHandler,
+    filters,
+)
 
-from config import environment, logfire_api_key
+from attachments import AttachmentStore
+from config import (
+    environment,
+    logfire_api_key,
+    max_concurrent_updates,
+    max_pending_updates,
+    outbound_chat_burst,
+    outbound_chat_rate,
+    outbound_global_rate,
+    outbound_group_rate,
+    outbound_max_retries,
+    persistence_update_interval,
+    response_cache_enabled,
+    retrieval_enabled,
+    telegram_base_url,
+    webhook_listen,
+    webhook_path,
+    webhook_port,
+    webhook_secret_token,
+    webhook_url,
+)
+from database import LogsDatabase
+from llm_executor import llm_executor
+from persistence import SQLitePersistence
+from rate_limiter import OutboundRateLimiter
+from response_cache import ResponseCache
+from retrieval import TurnRetriever
+from scraper import ScrapeCache
+from summaries import HistorySummariser
+from update_processor import ChatOrderedUpdateProcessor
 from handlers import (
     attachment_types,
+    aux_model,
     chat_id,
     conversation_id,
     error_handler,
     help,
     list_models,
+    list_system_prompts,
     model,
     process_message,
     process_private_message,
+    set_aux_model,
     set_model,
     set_system_prompt,
     system_prompt,
@@ -27,8 +66,72 @@ load_dotenv()
 BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 
 
+def webhook_options(
+    url: str,
+    listen: str = webhook_listen,
+    port: int = webhook_port,
+    path: str = webhook_path,
+    secret_token: str | None = webhook_secret_token,
+) -> dict:
+    """The arguments for serving updates through a webhook at `url`."""
+    path = path.strip("/")
+    return {
+        "listen": listen,
+        "port": port,
+        "url_path": path,
+        "webhook_url": f"{url.rstrip('/')}/{path}",
+        # Requests without this token in their headers are rejected
+        "secret_token": secret_token or secrets.token_urlsafe(32),
+        "max_connections": max_concurrent_updates,
+    }
+
+
+async def post_shutdown(app: Application) -> None:
+    """Lets background summaries and indexing finish before the process exits."""
+    await app.bot_data["history_summariser"].wait()
+    if "turn_retriever" in app.bot_data:
+        await app.bot_data["turn_retriever"].wait()
+    llm_executor.shutdown()
+
+
 def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    builder = ApplicationBuilder().token(BOT_TOKEN)
+    if telegram_base_url:
+        builder = builder.base_url(telegram_base_url)
+
+    # Opened, migrated and set up once, then shared by every handler
+    logs_db = LogsDatabase()
+
+    # Chats are handled in parallel, but the messages of one chat in order
+    app = (
+        builder.concurrent_updates(
+            ChatOrderedUpdateProcessor(max_concurrent_updates, max_pending_updates)
+        )
+        .persistence(
+            SQLitePersistence(logs_db, update_interval=persistence_update_interval)
+        )
+        # Every request to Telegram is paced to stay within its flood limits
+        .rate_limiter(
+            OutboundRateLimiter(
+                global_rate=outbound_global_rate,
+                chat_rate=outbound_chat_rate,
+                group_rate=outbound_group_rate,
+                chat_burst=outbound_chat_burst,
+                max_retries=outbound_max_retries,
+            )
+        )
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    app.bot_data["logs_db"] = logs_db
+    app.bot_data["scrape_cache"] = ScrapeCache()
+    app.bot_data["attachment_store"] = AttachmentStore()
+    app.bot_data["history_summariser"] = HistorySummariser(logs_db)
+    if retrieval_enabled:
+        app.bot_data["turn_retriever"] = TurnRetriever(logs_db)
+    if response_cache_enabled:
+        app.bot_data["response_cache"] = ResponseCache()
 
     app.add_handler(CommandHandler("_user_id", user_id))
     app.add_handler(CommandHandler("_chat_id", chat_id))
@@ -36,9 +139,12 @@ def main():
     app.add_handler(CommandHandler("private", process_private_message))
     app.add_handler(CommandHandler("system_prompt", system_prompt))
     app.add_handler(CommandHandler("set_system_prompt", set_system_prompt))
+    app.add_handler(CommandHandler("system_prompts", list_system_prompts))
     app.add_handler(CommandHandler("models", list_models))
     app.add_handler(CommandHandler("model", model))
     app.add_handler(CommandHandler("set_model", set_model))
+    app.add_handler(CommandHandler("aux_model", aux_model))
+    app.add_handler(CommandHandler("set_aux_model", set_aux_model))
     app.add_handler(CommandHandler("attachment_types", attachment_types))
     app.add_handler(CommandHandler("help", help))
 
@@ -61,4 +167,8 @@ def main():
     # Add error handler
     app.add_error_handler(error_handler)
 
-    app.run_polling()
+    if webhook_url:
+        # Served with tornado, from the webhooks extra of python-telegram-bot
+        app.run_webhook(**webhook_options(webhook_url))
+    else:
+        app.run_polling()
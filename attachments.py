@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import io
+import mimetypes
+import os
+import tempfile
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+import httpx
+import llm
+import logfire
+
+from config import (
+    attachment_cache_max_bytes,
+    attachment_max_bytes,
+    attachment_spool_bytes,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class AttachmentStore:
+    """
+    Downloads Telegram files for use as `llm` attachments without holding them in
+    memory. Files are streamed in chunks, kept in memory only up to `spool_bytes`
+    and otherwise written to a file in `directory` named by their SHA-256, which
+    is handed to `llm` by path. `llm` logs these attachments by path alone, so
+    the files are kept for as long as the logs, and replaying a conversation's
+    history still finds them after a restart.
+
+    Prepared attachments are cached by Telegram's `file_unique_id`, so a file
+    that is sent or forwarded again is neither looked up nor downloaded, and by
+    content hash, so identical files share one attachment. Once the cached
+    attachments add up to more than `cache_max_bytes`, the least recently used
+    are evicted. Eviction only forgets them: their files stay, since logs.db
+    points at them and a request in flight may still be sending one. So
+    `cache_max_bytes` bounds the in-memory index, not disk use, which grows
+    with every new file until the directory is cleared along with the logs.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        max_bytes: int = attachment_max_bytes,
+        spool_bytes: int = attachment_spool_bytes,
+        cache_max_bytes: int = attachment_cache_max_bytes,
+    ):
+        self.directory = Path(directory or llm.user_dir() / "attachments")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.cache_max_bytes = cache_max_bytes
+
+        # file_unique_id -> content hash, in least recently used order
+        self._unique_ids: OrderedDict[str, str] = OrderedDict()
+        # content hash -> (attachment, size), and how many unique ids point at it
+        self._contents: dict[str, tuple[llm.Attachment, int]] = {}
+        self._references: Counter[str] = Counter()
+        self.cached_bytes = 0
+
+        # Spooled files are logged to logs.db by path, so only downloads that were
+        # cut short by a previous run are removed
+        for path in self.directory.glob("*.part"):
+            path.unlink(missing_ok=True)
+
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(60), follow_redirects=True
+        )
+
+    def is_too_large(self, file_size: int | None) -> bool:
+        """Checks a file's size as reported by Telegram, before downloading it."""
+        return file_size is not None and file_size > self.max_bytes
+
+    async def download(self, telegram_file, mime_type: str) -> llm.Attachment:
+        """Downloads a photo, document, video, audio or voice file from Telegram."""
+        unique_id = telegram_file.file_unique_id
+        cached = self.get(unique_id)
+        if cached is not None:
+            logfire.info(f"Attachment cache hit: {unique_id}")
+            return cached
+
+        if self.is_too_large(telegram_file.file_size):
+            raise AttachmentTooLarge(f"{telegram_file.file_size} bytes")
+
+        file = await telegram_file.get_file()
+
+        # A local Bot API server gives a path to the file instead of a URL
+        if os.path.isfile(file.file_path):
+            digest = await asyncio.to_thread(_hash_file, file.file_path)
+            attachment = llm.Attachment(type=mime_type, path=file.file_path, _id=digest)
+            return self._add(unique_id, attachment, os.path.getsize(file.file_path))
+
+        async with self._client.stream("GET", file.file_path) as response:
+            response.raise_for_status()
+            attachment, size = await self._spool(
+                response.aiter_bytes(CHUNK_SIZE), mime_type
+            )
+        return self._add(unique_id, attachment, size)
+
+    def get(self, unique_id: str) -> llm.Attachment | None:
+        digest = self._unique_ids.get(unique_id)
+        if digest is None:
+            return None
+        attachment = self._contents[digest][0]
+        # A file removed from under us is downloaded again
+        if attachment.path and not os.path.isfile(attachment.path):
+            self._forget(unique_id)
+            return None
+        self._unique_ids.move_to_end(unique_id)
+        return attachment
+
+    def _add(self, unique_id: str, attachment: llm.Attachment, size: int):
+        digest = attachment.id()
+        if digest in self._contents:
+            # Identical content is already cached, and shares its file by name
+            attachment = self._contents[digest][0]
+        else:
+            self._contents[digest] = (attachment, size)
+            self.cached_bytes += size
+
+        if unique_id not in self._unique_ids:
+            self._unique_ids[unique_id] = digest
+            self._references[digest] += 1
+        self._unique_ids.move_to_end(unique_id)
+
+        # The newest attachment is kept even if it is larger than the budget
+        while self.cached_bytes > self.cache_max_bytes and len(self._unique_ids) > 1:
+            self._evict_oldest()
+        return attachment
+
+    def _evict_oldest(self) -> None:
+        self._forget(next(iter(self._unique_ids)))
+
+    def _forget(self, unique_id: str) -> None:
+        digest = self._unique_ids.pop(unique_id)
+        self._references[digest] -= 1
+        if self._references[digest]:
+            return
+
+        del self._references[digest]
+        _, size = self._contents.pop(digest)
+        self.cached_bytes -= size
+
+    async def _spool(self, chunks, mime_type: str) -> tuple[llm.Attachment, int]:
+        digest = hashlib.sha256()
+        size = 0
+        buffer = io.BytesIO()
+        spooled = None
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise AttachmentTooLarge(f"more than {self.max_bytes} bytes")
+                digest.update(chunk)
+
+                if spooled is None and size > self.spool_bytes:
+                    spooled = tempfile.NamedTemporaryFile(
+                        dir=self.directory, suffix=".part", delete=False
+                    )
+                    spooled.write(buffer.getvalue())
+                    buffer = None
+                if spooled is not None:
+                    spooled.write(chunk)
+                else:
+                    buffer.write(chunk)
+        except BaseException:
+            if spooled is not None:
+                spooled.close()
+                os.unlink(spooled.name)
+            raise
+
+        logfire.info(f"Attachment length: {size}")
+        if spooled is None:
+            attachment = llm.Attachment(
+                type=mime_type, content=buffer.getvalue(), _id=digest.hexdigest()
+            )
+            return attachment, size
+
+        spooled.close()
+        path = self.directory / f"{digest.hexdigest()}{_extension(mime_type)}"
+        os.replace(spooled.name, path)
+        attachment = llm.Attachment(
+            type=mime_type, path=str(path), _id=digest.hexdigest()
+        )
+        return attachment, size
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _extension(mime_type: str) -> str:
+    return mimetypes.guess_extension(mime_type) or ""
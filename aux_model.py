@@ -0,0 +1,45 @@
+import llm
+import logfire
+
+from cache import TTLCache
+from config import (
+    default_aux_model_id,
+    query_rewrite_cache_size,
+    query_rewrite_cache_ttl,
+)
+from llm_executor import llm_executor
+from model_catalog import model_catalog
+from web_search import normalise_query
+
+SEARCH_QUERY_PROMPT = "Based on this message: '{message}', create a specific web search query that will help answer the user's question. Make it concise but specific."
+
+query_rewrite_cache = TTLCache(
+    max_size=query_rewrite_cache_size, ttl=query_rewrite_cache_ttl
+)
+
+
+def get_aux_model(chat_data: dict, fallback: llm.Model) -> llm.Model:
+    """
+    The fast model used for helper prompts in a chat. Falls back to the chat's
+    main model if the configured one isn't installed.
+    """
+    aux_model_id = chat_data.get("aux_model_id", default_aux_model_id)
+    try:
+        return model_catalog.get_model(aux_model_id)
+    except llm.UnknownModelError:
+        logfire.warn(f"Auxiliary model {aux_model_id} is not available")
+        return fallback
+
+
+async def rewrite_search_query(model: llm.Model, message: str) -> str:
+    """Asks the model for a web search query answering the message, memoised per model."""
+    cache_key = (model.model_id, normalise_query(message))
+    cached = query_rewrite_cache.get(cache_key)
+    if cached is not None:
+        logfire.info(f"Query rewrite cache hit for: {message}")
+        return cached
+
+    response = model.prompt(SEARCH_QUERY_PROMPT.format(message=message))
+    search_query = (await llm_executor.run(response.text)).strip()
+    query_rewrite_cache.set(cache_key, search_query)
+    return search_query
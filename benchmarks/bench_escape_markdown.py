@@ -0,0 +1,128 @@
+"""
+Compares escape_markdown_v2 against the character-by-character version it
+replaced, on 100 KB model outputs, after checking both give the same output.
+
+    poetry run python benchmarks/bench_escape_markdown.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram_utils import (  # noqa: E402
+    code_block_start_at,
+    escape_markdown_v2,
+    format_symbol_at,
+    has_closing_symbol_in_line,
+    inline_code_at,
+    special_symbol_at,
+)
+
+TARGET_SIZE = 100_000
+REPEATS = 3
+
+PARAGRAPHS = [
+    "Here's a **short answer** first, then the _details_ (with a [link](https://example.com)).\n",
+    "1. Install the package with `pip install llm` and check `llm --version`.\n",
+    "- The function returns `None` if the key isn't found; otherwise it's a **dict**!\n",
+    "```python\ndef mean(values: list[float]) -> float:\n    return sum(values) / len(values)  # O(n)\n```\n",
+    "> Note: snake_case_names and 2 * 3 = 6 aren't formatting, but __this__ is.\n",
+]
+
+
+def reference_escape_markdown_v2(input, add_closing_code_block=True):
+    """The previous implementation, kept to check the output is unchanged."""
+    if add_closing_code_block and len(input.split("```")) % 2 == 0:
+        input += "\n```"
+
+    inside_code_block = False
+    inside_inline_code = False
+    inside_blocks = {"*": False, "**": False, "_": False, "__": False}
+    sb = []
+
+    i = 0
+    while i < len(input):
+        if code_block_start_at(input, i):
+            inside_code_block = not inside_code_block
+            sb.append("```")
+            i += 3
+            continue
+
+        if inside_code_block:
+            sb.append("\\`" if inline_code_at(input, i) else input[i])
+        elif inside_inline_code:
+            if special_symbol_at(input, i) or format_symbol_at(input, i):
+                sb.append("\\" + input[i])
+            elif inline_code_at(input, i):
+                inside_inline_code = False
+                sb.append("`")
+            else:
+                sb.append(input[i])
+        elif input[i : i + 2] in ("**", "__") or input[i] in "*_":
+            symbol = input[i : i + 2] if input[i : i + 2] in ("**", "__") else input[i]
+            if inside_blocks[symbol]:
+                sb.append(symbol)
+                inside_blocks[symbol] = False
+            elif has_closing_symbol_in_line(input, i, symbol):
+                sb.append(symbol)
+                inside_blocks[symbol] = True
+            else:
+                sb.append("\\" + symbol)
+            i += len(symbol) - 1
+        elif special_symbol_at(input, i) or format_symbol_at(input, i):
+            sb.append("\\" + input[i])
+        elif inline_code_at(input, i):
+            if has_closing_symbol_in_line(input, i, "`"):
+                inside_inline_code = True
+                sb.append("`")
+            else:
+                sb.append("\\`")
+        else:
+            sb.append(input[i])
+
+        i += 1
+
+    return "".join(sb)
+
+
+def model_output() -> str:
+    rng = random.Random(0)
+    parts, size = [], 0
+    while size < TARGET_SIZE:
+        part = rng.choice(PARAGRAPHS)
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def symbol_heavy_line() -> str:
+    """One long line full of markers, where every lookup used to scan to its end."""
+    return "a*b_c~d(e)f. " * (TARGET_SIZE // 13)
+
+
+def bench(name: str, escape, text: str) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        escape(text)
+    elapsed = (time.perf_counter() - started) / REPEATS
+    print(f"  {name:<12} {elapsed * 1000:9.1f} ms")
+    return elapsed
+
+
+def main() -> None:
+    for name, text in [
+        ("model output", model_output()),
+        ("symbol-heavy line", symbol_heavy_line()),
+    ]:
+        assert escape_markdown_v2(text) == reference_escape_markdown_v2(text)
+        print(f"{name} ({len(text) // 1000} KB, output identical):")
+        before = bench("before", reference_escape_markdown_v2, text)
+        after = bench("after", escape_markdown_v2, text)
+        print(f"  {before / after:.1f}x faster\n")
+
+
+if __name__ == "__main__":
+    main()
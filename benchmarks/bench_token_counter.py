@@ -0,0 +1,96 @@
+"""
+Compares the throughput of the token counter against the old word count
+heuristic, on a synthetic chat history mixing prose, code and CJK text.
+Cold cache numbers, the cost of counting history for the first time, are
+reported per tokenizer, with how many times slower than the word count each
+one is. OpenAI models use tiktoken if it is installed (the "tokenizers" extra)
+and its encodings can be downloaded, and the heuristic otherwise.
+
+    poetry install --extras tokenizers
+    poetry run python benchmarks/bench_token_counter.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from token_counter import HeuristicTokenizer, TokenCounter  # noqa: E402
+
+WORD_TOKEN_MULTIPLE_ESTIMATE = 1.5
+HISTORY_SIZE = 2_000
+REPEATS = 5
+# A model per tokenizer family: Anthropic (heuristic), GPT-4o and GPT-4
+MODEL_IDS = ("anthropic/claude-3-5-haiku", "gpt-4o", "gpt-4")
+
+PROSE = (
+    "The bot keeps a running conversation per chat and trims the oldest turns "
+    "once the history no longer fits in the context window of the model. "
+)
+CODE = (
+    "def fibonacci(n: int) -> list[int]:\n"
+    "    values = [0, 1]\n"
+    "    for i in range(2, n):\n"
+    "        values.append(values[i - 1] + values[i - 2])\n"
+    "    return values[:n]\n"
+)
+CJK = "这是一个关于上下文窗口和令牌预算的测试句子。日本語のテキストも含まれています。"
+
+
+def word_heuristic(text: str) -> int:
+    """The estimate the bot used before the token counter."""
+    if not text:
+        return 0
+    return int(len(text.split()) * WORD_TOKEN_MULTIPLE_ESTIMATE)
+
+
+def build_history(size: int) -> list[str]:
+    rng = random.Random(0)
+    return [
+        rng.choice([PROSE, CODE, CJK]) * rng.randint(1, 20) + f" turn {i}"
+        for i in range(size)
+    ]
+
+
+def bench(name: str, count, history: list[str], baseline: float | None = None) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        total = sum(count(text) for text in history)
+    elapsed = (time.perf_counter() - started) / REPEATS
+    megabytes = sum(len(text.encode("utf-8")) for text in history) / 1_000_000
+    slowdown = f" {elapsed / baseline:6.1f}x" if baseline else ""
+    print(
+        f"{name:<50} {elapsed * 1000:8.1f} ms/pass {megabytes / elapsed:8.1f} MB/s"
+        f" {total:>10} tokens{slowdown}"
+    )
+    return elapsed
+
+
+def main() -> None:
+    history = build_history(HISTORY_SIZE)
+    print(f"{len(history)} responses, {REPEATS} passes each\n")
+
+    baseline = bench("word count x 1.5", word_heuristic, history)
+    bench("heuristic tokenizer", HeuristicTokenizer().count, history, baseline)
+
+    # Without a cache every pass counts the history as if for the first time
+    for model_id in MODEL_IDS:
+        cold = TokenCounter(cache_size=0)
+        tokenizer = cold.tokenizer_for(model_id).name
+        bench(
+            f"{model_id} cold cache ({tokenizer})",
+            lambda text: cold.count(text, model_id),
+            history,
+            baseline,
+        )
+
+    warm = TokenCounter(cache_size=HISTORY_SIZE)
+    for text in history:
+        warm.count(text)
+    bench("warm cache", warm.count, history, baseline)
+
+
+if __name__ == "__main__":
+    main()
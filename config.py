@@ -14,3 +14,93 @@ brave_search_api_key = os.getenv("BRAVE_SEARCH_API_KEY")
 environment = os.getenv("ENVIRONMENT", "production")
 
 default_model_id = "anthropic/claude-3-7-sonnet-latest"
+
+# Bounds for the thread pool that runs blocking LLM calls off the event loop
+llm_max_workers = int(os.getenv("LLM_MAX_WORKERS", "8"))
+llm_max_queue_depth = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "32"))
+llm_call_timeout = float(os.getenv("LLM_CALL_TIMEOUT", "300"))
+
+# Stream replies into the placeholder message, editing it at most once per interval
+stream_responses = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+stream_edit_interval = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Timeout in seconds for web searches, and how many results are cached and for how long
+web_search_timeout = float(os.getenv("WEB_SEARCH_TIMEOUT", "10"))
+web_search_cache_size = int(os.getenv("WEB_SEARCH_CACHE_SIZE", "256"))
+web_search_cache_ttl = float(os.getenv("WEB_SEARCH_CACHE_TTL", "900"))
+
+# How many @url links of one message are scraped at once, and how large and fresh
+# the on-disk cache of scraped pages is kept (bytes and seconds)
+scrape_concurrency = int(os.getenv("SCRAPE_CONCURRENCY", "3"))
+scrape_cache_max_bytes = int(os.getenv("SCRAPE_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+scrape_cache_ttl = float(os.getenv("SCRAPE_CACHE_TTL", str(24 * 60 * 60)))
+
+# A fast model for helper prompts like rewriting @web queries, overridable per
+# chat with /set_aux_model, and how many rewritten queries are remembered for how long
+default_aux_model_id = os.getenv("AUX_MODEL_ID", "anthropic/claude-3-5-haiku-latest")
+query_rewrite_cache_size = int(os.getenv("QUERY_REWRITE_CACHE_SIZE", "512"))
+query_rewrite_cache_ttl = float(os.getenv("QUERY_REWRITE_CACHE_TTL", "3600"))
+
+# How many updates are handled at once across all chats (each chat is still handled
+# in order), and how many may be waiting or running in total
+max_concurrent_updates = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+max_pending_updates = int(os.getenv("MAX_PENDING_UPDATES", "256"))
+
+# Receive updates through a webhook served on WEBHOOK_LISTEN:WEBHOOK_PORT instead of
+# long polling when a public URL is set. Telegram signs its requests with the secret
+# token, which is generated on each start if not set
+webhook_url = os.getenv("WEBHOOK_URL")
+webhook_listen = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+webhook_port = int(os.getenv("WEBHOOK_PORT", "8443"))
+webhook_path = os.getenv("WEBHOOK_PATH", "telegram")
+webhook_secret_token = os.getenv("WEBHOOK_SECRET_TOKEN")
+
+# Talk to a different Bot API server, like a self-hosted or fake one, e.g. http://localhost:8081/bot
+telegram_base_url = os.getenv("TELEGRAM_BASE_URL")
+
+# How often in seconds changed user and chat settings are written to the logs database
+persistence_update_interval = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "30"))
+
+# Outbound requests per second to Telegram overall, per private chat and per group,
+# how many requests a chat may burst, and how often a RetryAfter is retried
+outbound_global_rate = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+outbound_chat_rate = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+outbound_group_rate = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+outbound_chat_burst = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+outbound_max_retries = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Largest attachment downloaded from Telegram in bytes (the Bot API serves at most
+# 20 MB), up to what size it is kept in memory rather than written to a file, and
+# how many bytes of downloaded attachments are remembered for files sent again.
+# The cache limit doesn't apply to disk: files written to the attachments
+# directory are kept for as long as the logs and are never deleted
+attachment_max_bytes = int(os.getenv("ATTACHMENT_MAX_BYTES", str(20 * 1024 * 1024)))
+attachment_spool_bytes = int(os.getenv("ATTACHMENT_SPOOL_BYTES", str(1024 * 1024)))
+attachment_cache_max_bytes = int(
+    os.getenv("ATTACHMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+# Mark the system prompt and conversation history as cacheable for models whose
+# plugin supports prompt caching, like Anthropic's
+prompt_cache_enabled = os.getenv("PROMPT_CACHE", "false").lower() == "true"
+
+# Roll turns that no longer fit in the history into a running summary in the
+# background, and how many words the summary may be
+history_summary_enabled = os.getenv("HISTORY_SUMMARY", "false").lower() == "true"
+history_summary_max_words = int(os.getenv("HISTORY_SUMMARY_MAX_WORDS", "300"))
+
+# Look up older turns relevant to each message by embedding every turn (needs
+# numpy), with an llm embedding model or "hashing" for an offline one, how many
+# turns are added at most, and how similar they must be
+retrieval_enabled = os.getenv("RETRIEVAL", "false").lower() == "true"
+retrieval_embedding_model_id = os.getenv(
+    "RETRIEVAL_EMBEDDING_MODEL", "text-embedding-3-small"
+)
+retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+retrieval_min_score = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))
+
+# Answer repeated /private messages (same model, system prompt and text) from an
+# on-disk cache, how many answers are kept, and for how many seconds
+response_cache_enabled = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+response_cache_max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 60 * 60)))
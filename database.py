@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+import logfire
+import sqlite_utils
+from llm.cli import logs_db_path
+from llm.migrations import migrate
+
+from history import (
+    backfill_response_attachment_types,
+    backfill_response_tokens,
+    get_response_attachment_types_table,
+    get_response_tokens_table,
+)
+
+
+class LogsDatabase:
+    """
+    A long-lived connection to llm's `logs.db`, shared by all handlers.
+
+    The database is migrated and the bot's own tables are created once when the
+    connection is opened, rather than on every message. The connection may be
+    used from worker threads as long as they hold `lock`.
+    """
+
+    def __init__(self, path=None):
+        self.path = str(path or logs_db_path())
+        self.lock = threading.RLock()
+
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.db = sqlite_utils.Database(connection)
+        # Lets readers like datasette run while the bot is writing
+        self.db.enable_wal()
+
+        # `log_to_db` doesn't migrate the DB, so it has to happen before first use
+        migrate(self.db)
+        # llm doesn't index responses by conversation, which history lookups rely on
+        self.db["responses"].create_index(["conversation_id"], if_not_exists=True)
+        self.chat_conversations = get_chat_conversations_table(self.db)
+        self.response_tokens = get_response_tokens_table(self.db)
+        self.response_attachment_types = get_response_attachment_types_table(self.db)
+        backfill_response_tokens(self.db)
+        backfill_response_attachment_types(self.db)
+
+        logfire.info(f"Opened logs database at {self.path}")
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.conn.close()
+
+
+def get_chat_conversations_table(db) -> sqlite_utils.db.Table:
+    chat_conversations = db.table("chat_conversations", pk=("chat_id",))
+    if not chat_conversations.exists():
+        chat_conversations.create(
+            {
+                "chat_id": int,
+                "conversation_id": str,
+                "last_used": str,
+            },
+            if_not_exists=True,
+        )
+
+    return chat_conversations
+
+
+def get_chat_conversation_id(
+    chat_conversations_table, current_chat_id: int
+) -> str | None:
+    results = list(
+        chat_conversations_table.rows_where("chat_id = ?", [current_chat_id], limit=1)
+    )
+    return results[0]["conversation_id"] if results else None
+
+
+def set_chat_conversation_id(
+    chat_conversations_table, conversation_id: str, current_chat_id: int
+) -> None:
+    chat_conversations_table.upsert(
+        {
+            "chat_id": current_chat_id,
+            "conversation_id": conversation_id,
+            "last_used": datetime.now().isoformat(),
+        },
+        pk="chat_id",
+    )
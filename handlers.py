@@ -1,54 +1,46 @@
-import os
+import asyncio
+import html
 import re
-from datetime import datetime
 from inspect import cleandoc
 
-import llm
 import logfire
-import requests
-import sqlite_utils
-from firecrawl import FirecrawlApp
-from llm.cli import load_conversation, logs_db_path
-from llm.migrations import migrate
 from llm.models import Tool, ToolCall, ToolResult
 from telegram import Update
-from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
-from config import brave_search_api_key, default_model_id, firecrawl_api_key
-from telegram_utils import restricted, send_long_message
-
-# Get all available model IDs
-model_ids = [
-    model_with_alias.model.model_id
-    for model_with_alias in llm.get_models_with_aliases()
-]
-
-# Dictionary mapping model IDs to their knowledge cutoff dates
-# Fill in the accurate cutoff dates from provider documentation
-model_cutoffs = {
-    # OpenAI models
-    "gpt-4o": "Oct 23",
-    "gpt-3.5-turbo": "Sep 21",
-    "chatgpt-4o": "Oct 23",
-    "gpt-4": "Dec 23",
-    "o1": "Oct 23",
-    "o3": "Oct 23",
-    # Google models
-    "gemini-2.0-flash": "Aug 24",
-    # Anthropic models
-    "anthropic/claude-3-7-sonnet": "Nov 24",
-    "anthropic/claude-3-5-sonnet": "Apr 24",
-    "anthropic/claude-3-5-haiku": "Jul 24",
-    "anthropic/claude-3-opus-latest": "Aug 23",
-    "anthropic/claude-3-haiku": "Aug 23",
-    # Add more models and their cutoff dates here
-}
-
-firecrawl_app = FirecrawlApp(api_key=firecrawl_api_key)
-
-MAX_TOKEN_LIMIT = 10_000
-WORD_TOKEN_MULTIPLE_ESTIMATE = 1.5
+from attachments import AttachmentStore
+from aux_model import get_aux_model, rewrite_search_query
+from config import (
+    default_aux_model_id,
+    default_model_id,
+    history_summary_enabled,
+    response_cache_enabled,
+    retrieval_enabled,
+    stream_responses,
+)
+from database import LogsDatabase, get_chat_conversation_id, set_chat_conversation_id
+from history import (
+    executed_responses,
+    load_conversation_tail,
+    record_response_tokens,
+)
+from llm_executor import llm_executor
+from model_catalog import model_catalog
+from pipeline import Pipeline
+from prompt_cache import prompt_cache_options, prompt_cache_stats
+from prompt_presets import get_system_prompt, prompt_presets
+from response_cache import ResponseCache, response_cache_key
+from retrieval import TurnRetriever, relevant_history_fragment
+from scraper import scrape_urls
+from summaries import HistorySummariser, get_summary, summary_fragment
+from telegram_utils import (
+    restricted,
+    send_long_message,
+    send_markdown_message,
+    stream_message,
+)
+from web_search import web_search_client
+
 AGENTIC_LOOP_LIMIT = 10
 
 
@@ -63,14 +55,15 @@ async def chat_id(update: Update, context: CallbackContext) -> None:
 
 @restricted
 async def conversation_id(update: Update, context: CallbackContext) -> None:
-    db = sqlite_utils.Database(logs_db_path())
-    migrate(db)  # Migrate the DB before using it, as `log_to_db` doesn't do a migration
+    logs_db: LogsDatabase = context.bot_data["logs_db"]
 
-    chat_conversations_table = _get_chat_conversations_table(db)
+    def load():
+        with logs_db.lock:
+            return get_chat_conversation_id(
+                logs_db.chat_conversations, update.effective_chat.id
+            )
 
-    conversation_id = _get_chat_conversation_id(
-        chat_conversations_table, update.effective_chat.id
-    )
+    conversation_id = await asyncio.to_thread(load)
     await update.message.reply_text(f"Your conversation id is: {conversation_id}")
 
 
@@ -96,7 +89,7 @@ async def set_model(update: Update, context: CallbackContext) -> None:
 
     model_id = context.args[0]
 
-    if model_id not in model_ids:
+    if model_id not in model_catalog:
         return await send_long_message(
             update,
             context,
@@ -116,9 +109,54 @@ async def set_model(update: Update, context: CallbackContext) -> None:
     )
 
 
+@restricted
+async def aux_model(update: Update, context: CallbackContext) -> None:
+    current_aux_model_id = context.chat_data.get("aux_model_id", default_aux_model_id)
+
+    return await send_long_message(
+        update,
+        context,
+        f"The current auxiliary model id is: `{current_aux_model_id}`",
+        parse_mode="Markdown",
+    )
+
+
+@restricted
+async def set_aux_model(update: Update, context: CallbackContext) -> None:
+    if not context.args or len(context.args) == 0:
+        context.chat_data.pop("aux_model_id", None)
+        return await send_long_message(
+            update,
+            context,
+            f"The auxiliary model has been reset to: `{default_aux_model_id}`",
+            parse_mode="Markdown",
+        )
+
+    aux_model_id = context.args[0]
+
+    if aux_model_id not in model_catalog:
+        return await send_long_message(
+            update,
+            context,
+            f"Your chosen model id: {aux_model_id} is invalid. Please choose a valid model id.\n"
+            "To find a list of valid model ids, use: /list_models",
+            parse_mode="Markdown",
+        )
+
+    # The auxiliary model is shared by everyone in the chat
+    context.chat_data["aux_model_id"] = aux_model_id
+
+    await send_long_message(
+        update,
+        context,
+        f"The auxiliary model id has been changed to: `{aux_model_id}`\n",
+        parse_mode="Markdown",
+    )
+
+
 @restricted
 async def system_prompt(update: Update, context: CallbackContext) -> None:
-    system_prompt = context.chat_data.get("system_prompt", "")
+    system_prompt = get_system_prompt(context.chat_data)
 
     if system_prompt:
         return await send_long_message(
@@ -137,6 +175,7 @@ async def system_prompt(update: Update, context: CallbackContext) -> None:
 async def set_system_prompt(update: Update, context: CallbackContext) -> None:
     if not context.args or len(context.args) == 0:
         context.chat_data["system_prompt"] = ""
+        context.chat_data.pop("system_prompt_preset", None)
         return await send_long_message(
             update,
             context,
@@ -148,40 +187,31 @@ async def set_system_prompt(update: Update, context: CallbackContext) -> None:
     first_arg = context.args[0]
     if first_arg.startswith("@"):
         prompt_name = first_arg[1:]  # Remove the @ prefix
-        system_prompts_dir = os.path.join(os.path.dirname(__file__), "system_prompts")
-        prompt_file_path = os.path.join(system_prompts_dir, f"{prompt_name}.md")
 
-        if os.path.exists(prompt_file_path):
-            try:
-                with open(prompt_file_path, "r", encoding="utf-8") as f:
-                    system_prompt = f.read().strip()
+        if prompt_name in prompt_presets:
+            # Chats share the preset's text instead of keeping their own copy
+            context.chat_data["system_prompt_preset"] = prompt_name
+            context.chat_data.pop("system_prompt", None)
 
-                context.chat_data["system_prompt"] = system_prompt
-
-                await send_long_message(
-                    update,
-                    context,
-                    f"System prompt has been set to pre-defined prompt: `{prompt_name}`\n",
-                    parse_mode="Markdown",
-                )
-            except Exception as e:
-                await send_long_message(
-                    update,
-                    context,
-                    f"Error loading pre-defined prompt '{prompt_name}': {str(e)}",
-                    parse_mode="Markdown",
-                )
+            await send_long_message(
+                update,
+                context,
+                f"System prompt has been set to pre-defined prompt: `{prompt_name}`\n",
+                parse_mode="Markdown",
+            )
         else:
             await send_long_message(
                 update,
                 context,
-                f"Pre-defined prompt '{prompt_name}' not found. Available prompts are in the system_prompts/ directory.",
+                f"Pre-defined prompt '{prompt_name}' not found. "
+                "To find a list of pre-defined prompts, use: /system_prompts",
                 parse_mode="Markdown",
             )
     else:
         # Fall back to current behavior - join all arguments as custom system prompt
         system_prompt = " ".join(context.args)
         context.chat_data["system_prompt"] = system_prompt
+        context.chat_data.pop("system_prompt_preset", None)
 
         await send_long_message(
             update,
@@ -192,28 +222,36 @@ async def set_system_prompt(update: Update, context: CallbackContext) -> None:
 
 
 @restricted
-async def list_models(update: Update, context: CallbackContext) -> None:
-    model_details = []
-    for model_id in model_ids:
-        # Finds the most specific model cutoff date
-        cutoff = next(
-            (
-                cutoff
-                for key, cutoff in sorted(
-                    model_cutoffs.items(),
-                    key=lambda x: len(os.path.commonprefix([model_id, x[0]])),
-                    reverse=True,
-                )
-                if model_id.startswith(key)
-            ),
-            "Unknown",
+async def list_system_prompts(update: Update, context: CallbackContext) -> None:
+    # `/system_prompts reload` reads every preset file again
+    if context.args and context.args[0] == "reload":
+        prompt_presets.reload()
+
+    names = prompt_presets.names()
+    if not names:
+        return await update.message.reply_text(
+            "There are no pre-defined system prompts",
         )
-        model_details.append(f"• `{model_id}`")
 
     await send_long_message(
         update,
         context,
-        "\n".join(model_details),
+        "Pre-defined system prompts, set one with `/set_system_prompt @name`:\n\n"
+        + "\n".join(f"• `{name}`" for name in names),
+        parse_mode="Markdown",
+    )
+
+
+@restricted
+async def list_models(update: Update, context: CallbackContext) -> None:
+    # `/models refresh` picks up models from newly installed plugins or keys
+    if context.args and context.args[0] == "refresh":
+        model_catalog.refresh()
+
+    await send_long_message(
+        update,
+        context,
+        model_catalog.models_text(),
         parse_mode="Markdown",
     )
 
@@ -221,7 +259,7 @@ async def list_models(update: Update, context: CallbackContext) -> None:
 @restricted
 async def attachment_types(update: Update, context: CallbackContext) -> None:
     model_id = context.user_data.get("model_id", default_model_id)
-    model = llm.get_model(model_id)
+    model = model_catalog.get_model(model_id)
     attachment_types = "\n".join("- " + type for type in model.attachment_types)
     await update.message.reply_text(
         f"Supported attachment types are:\n{attachment_types}",
@@ -234,11 +272,14 @@ async def help(update: Update, context: CallbackContext) -> None:
     Available commands:
     `/private` - Send a message in isolation of the chat conversation
         - Example: `/private What is integer interning in python?`
-    `/models` - Get a list of available models with their knowledge cutoff dates
+    `/models` - Get a list of available models with their knowledge cutoff dates (`/models refresh` reloads it)
     `/model` - Get the current model being used
     `/set_model` - Set the model being used
+    `/aux_model` - Get the fast model used for helper prompts like @web queries
+    `/set_aux_model` - Set the auxiliary model for this chat (blank to reset)
     `/system_prompt` - Get the current system prompt being used
     `/set_system_prompt` - Set the system prompt (use @name for pre-defined prompts)
+    `/system_prompts` - Get a list of pre-defined system prompts (`/system_prompts reload` reloads them)
     `/attachment_types` - Get the attachment types supported by the current model
     `/help` - Show this help message
     
@@ -263,33 +304,37 @@ async def process_private_message(update: Update, context: CallbackContext) -> N
             parse_mode="MARKDOWN",
         )
 
+    message_text = " ".join(context.args)
+    model_id = context.user_data.get("model_id", default_model_id)
+    system_prompt = get_system_prompt(context.chat_data)
+
+    # Private messages don't depend on the history, so repeated ones can be answered
+    # from the cache straight away
+    if response_cache_enabled:
+        response_cache: ResponseCache = context.bot_data["response_cache"]
+        cache_key = response_cache_key(model_id, system_prompt, message_text)
+        cached_text = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached_text is not None:
+            return await send_markdown_message(update, cached_text)
+
     # Send a "Thinking..." message first
     thinking_message = await update.message.reply_text("...")
 
-    message_text = " ".join(context.args)
-    model = llm.get_model(context.user_data.get("model_id", default_model_id))
-    system_prompt = context.chat_data.get("system_prompt", "")
-    response = model.prompt(message_text, system=system_prompt)
+    model = model_catalog.get_model(model_id)
+    response = model.prompt(
+        message_text, system=system_prompt, **prompt_cache_options(model)
+    )
 
     try:
-        response_text = response.text()
-        # First try to edit with markdown
-        try:
-            await thinking_message.edit_text(response_text, parse_mode="Markdown")
-            return
-        except BadRequest:
-            pass
-
-        # Then try without markdown
-        try:
-            await thinking_message.edit_text(response_text)
-            return
-        except BadRequest:
-            pass
-
-        # Finally, delete thinking message and use send_long_message
-        await thinking_message.delete()
-        await send_long_message(update, context, response_text)
+        if stream_responses:
+            response_text = await stream_message(
+                update, thinking_message, llm_executor.stream(response)
+            )
+        else:
+            response_text = await llm_executor.run(response.text)
+            await send_markdown_message(
+                update, response_text, placeholder=thinking_message
+            )
 
     except Exception as e:
         await update.message.reply_text(
@@ -299,137 +344,10 @@ async def process_private_message(update: Update, context: CallbackContext) -> N
         return
 
     logfire.info(f"Message: {response_text} Usage: {response.usage()}")
+    prompt_cache_stats.record(response)
 
-
-def _get_chat_conversations_table(db) -> None:
-    chat_conversations = db.table("chat_conversations", pk=("chat_id",))
-    if not chat_conversations.exists():
-        chat_conversations.create(
-            {
-                "chat_id": int,
-                "conversation_id": str,
-                "last_used": str,
-            },
-            if_not_exists=True,
-        )
-
-    return chat_conversations
-
-
-def _get_chat_conversation_id(
-    chat_conversations_table, current_chat_id: int
-) -> str | None:
-    results = list(
-        chat_conversations_table.rows_where("chat_id = ?", [current_chat_id], limit=1)
-    )
-    return results[0]["conversation_id"] if results else None
-
-
-def _set_chat_conversation_id(
-    chat_conversations_table, conversation_id: str, current_chat_id: int
-) -> None:
-    chat_conversations_table.upsert(
-        {
-            "chat_id": current_chat_id,
-            "conversation_id": conversation_id,
-            "last_used": datetime.now().isoformat(),
-        },
-        pk="chat_id",
-    )
-
-
-def _estimate_tokens_from_text(text: str) -> int:
-    # Estimate token count from text using word count * 1.5 heuristic
-    if not text:
-        return 0
-    word_count = len(text.split())
-    return int(word_count * WORD_TOKEN_MULTIPLE_ESTIMATE)
-
-
-def _get_responses_compatible_with_model(
-    conversation: llm.Conversation, model: llm.Model, max_messages: int = None
-) -> list[llm.Response]:
-    """
-    We need to remove any responses from the conversation history that have incompatible attachments.
-    Initially I thought we could just filter the attachments out, but that doesn't seem to work because
-    the underlying model calls generated are not compatible with the input messages that have the attachments.
-    """
-    filtered_responses = []
-    total_estimated_tokens = 0
-
-    # If max_messages is specified, limit the responses to that number
-    responses_to_process = conversation.responses
-    if max_messages is not None:
-        responses_to_process = (
-            conversation.responses[-max_messages:] if max_messages > 0 else []
-        )
-
-    for response in reversed(responses_to_process):
-        # For responses with attachments, we need to handle them carefully
-        if hasattr(response, "attachments") and response.attachments:
-            # Check if any attachments are incompatible
-            has_incompatible_attachments = any(
-                getattr(attachment, "mime_type", None) not in model.attachment_types
-                for attachment in response.attachments
-            )
-
-            if has_incompatible_attachments:
-                continue
-
-        # Estimate tokens based on text content instead of relying on cumulative DB counts
-        input_tokens = _estimate_tokens_from_text(response.prompt.prompt)
-        output_tokens = _estimate_tokens_from_text(response.text_or_raise())
-        response_estimated_tokens = input_tokens + output_tokens
-
-        if total_estimated_tokens + response_estimated_tokens > MAX_TOKEN_LIMIT:
-            break
-
-        total_estimated_tokens += response_estimated_tokens
-        filtered_responses.append(response)
-
-    logfire.info(f"Estimated context tokens: {total_estimated_tokens}")
-    logfire.info(f"Number of responses: {len(filtered_responses)}")
-
-    # Return in chronological order (oldest to newest)
-    return list(reversed(filtered_responses))
-
-
-def _perform_web_search(query: str) -> str:
-    """Perform a web search using the Brave Search API and return the formatted results."""
-    headers = {
-        "Accept": "application/json",
-        "Accept-Encoding": "gzip",
-        "X-Subscription-Token": brave_search_api_key,
-    }
-
-    params = {
-        "q": query,
-        "count": 10,  # Number of results to return
-    }
-
-    try:
-        response = requests.get(
-            "https://api.search.brave.com/res/v1/web/search",
-            headers=headers,
-            params=params,
-        )
-        response.raise_for_status()
-        results = response.json()
-
-        # Format the results as markdown
-        if "web" in results and "results" in results["web"]:
-            formatted_results = "### Web Search Results\n\n"
-            for result in results["web"]["results"]:
-                title = result.get("title", "No title")
-                url = result.get("url", "")
-                description = result.get("description", "No description available")
-                formatted_results += f"**[{title}]({url})**\n{description}\n\n"
-            return formatted_results
-        else:
-            return "No search results found."
-    except Exception as e:
-        logfire.error(f"Error performing web search: {e}")
-        return f"Error performing web search: {str(e)}"
+    if response_cache_enabled:
+        await asyncio.to_thread(response_cache.set, cache_key, model_id, response_text)
 
 
 @restricted
@@ -439,16 +357,10 @@ async def process_message(update: Update, context: CallbackContext) -> None:
     # Send a "Thinking..." message first
     thinking_message = await update.message.reply_text("...")
 
-    db = sqlite_utils.Database(logs_db_path())
-    migrate(db)  # Migrate the DB before using it, as `log_to_db` doesn't do a migration
-
-    chat_conversations_table = _get_chat_conversations_table(db)
-
-    conversation_id = _get_chat_conversation_id(
-        chat_conversations_table, update.effective_chat.id
-    )
+    logs_db: LogsDatabase = context.bot_data["logs_db"]
     model_id = context.user_data.get("model_id", default_model_id)
-    model = llm.get_model(model_id)
+    model = model_catalog.get_model(model_id)
+    system_prompt = get_system_prompt(context.chat_data)
 
     message_text: str | None = (
         update.message.text if update.message.text else update.message.caption
@@ -463,108 +375,14 @@ async def process_message(update: Update, context: CallbackContext) -> None:
         max_messages = int(last_matches[0])
         logfire.info(f"Getting the {max_messages} last messages")
 
-    if not conversation_id:
-        conversation = model.conversation()
-    else:
-        conversation = load_conversation(conversation_id)
-        conversation.model = model
-        conversation.responses = _get_responses_compatible_with_model(
-            conversation, model, max_messages
-        )
-
-    attachments = []
     # Remove the @last[x] part from the message text for processing
     if last_matches:
         message_text = re.sub(last_pattern, "", message_text).strip()
     logfire.info(f"Prompt: {message_text}")
 
-    # Find links in the message text
-    fragments = []
-    url_pattern = r"@(https?://[^\s]+|[^\s]+\.[^\s]+/[^\s]*)"
-    urls = re.findall(url_pattern, message_text) if message_text else []
-
-    if urls:
-        for url in urls:
-            scrape_result = firecrawl_app.scrape_url(
-                url, params={"formats": ["markdown"]}
-            )
-            source_context = cleandoc(f"""
-            <source_context url={url}>
-            {scrape_result["markdown"]}
-            </source_context>
-            """)
-            fragments.append(source_context)
-
-    # Check if this is a thinking request
-    thinking_requested = "@think" in message_text if message_text else False
-    thinking_output = ""
-
-    if thinking_requested:
-        # Remove the @think command from the message
-        clean_message = message_text.replace("@think", "").strip()
-
-        # Create a thinking prompt with instructions
-        thinking_prompt = cleandoc(f"""
-        This is a message from the user: "{clean_message}"
-        
-        Think step-by-step about your answer. Consider multiple different paths.
-        Critique your thinking and backtrack if necessary.
-        Explain your reasoning process thoroughly.
-
-        Do not include any tags in your response like <thinking> or <thinking_output>.
-        """)
-
-        # Make the initial "thinking" call to the model
-        system_prompt = context.chat_data.get("system_prompt", "")
-        thinking_response = conversation.prompt(thinking_prompt, system=system_prompt)
-        thinking_output = thinking_response.text()
-
-        # Log the thinking output
-        logfire.info(f"Thinking output: {thinking_output}...")
-
-        # Send the thinking output to the user in an expandable blockquote
-        await thinking_message.edit_text(
-            f"<blockquote expandable>\n{thinking_output}\n</blockquote>",
-            parse_mode="HTML",
-        )
-
-        # Create a new thinking message for the final response
-        thinking_message = await update.message.reply_text("...")
-
-        # Add the thinking output to the context for the final response
-        fragments.append(f"\n\n<thinking>\n{thinking_output}\n</thinking>\n\n")
-
-        # Use the clean message (without @think) for the final prompt
-        message_text = clean_message
-
-    # Check for @web search commands
-    web_search_pattern = r"@web"
-    web_searches = re.findall(web_search_pattern, message_text) if message_text else []
-
-    if web_searches:
-        search_prompt = f"Based on this message: '{message_text}', create a specific web search query that will help answer the user's question. Make it concise but specific."
-        search_response = model.prompt(search_prompt)
-        search_query = search_response.text().strip()
-
-        logfire.info(f"Web search query: {search_query}")
-
-        # Perform the web search
-        search_results = _perform_web_search(search_query)
-
-        logfire.info(f"Web search results: {search_results}")
-
-        # Add the search results to the context
-        web_context = cleandoc(f"""
-        <web_search_results query="{search_query}">
-        {search_results}
-        </web_search_results>
-        """)
-        fragments.append("\n\n" + web_context)
-
-        # Remove the @web part from the message
-        message_text = message_text.replace("@web", "").strip()
-
-    # Handle different types of attachments
+    # Check the attachment is supported before doing any other work
+    attachment_file = None
+    attachment_type = None
     if update.message.photo:
         if "image/jpeg" not in model.attachment_types:
             await thinking_message.edit_text(
@@ -572,9 +390,8 @@ async def process_message(update: Update, context: CallbackContext) -> None:
                 "Please switch to a model type that supports images."
             )
             return
-        photo_file = await update.message.photo[-1].get_file()
-        photo_content = await photo_file.download_as_bytearray()
-        attachments.append(llm.Attachment(content=photo_content))
+        attachment_file = update.message.photo[-1]
+        attachment_type = "image/jpeg"
 
     elif update.message.document:
         if update.message.document.mime_type != "application/pdf":
@@ -589,9 +406,8 @@ async def process_message(update: Update, context: CallbackContext) -> None:
                 "The current model doesn't support document attachments. "
                 "Please switch to a model type that supports documents."
             )
-        doc_file = await update.message.document.get_file()
-        doc_content = await doc_file.download_as_bytearray()
-        attachments.append(llm.Attachment(content=doc_content))
+        attachment_file = update.message.document
+        attachment_type = "application/pdf"
 
     elif update.message.video:
         if "video/mp4" not in model.attachment_types:
@@ -600,9 +416,8 @@ async def process_message(update: Update, context: CallbackContext) -> None:
                 "Please switch to a model type that supports videos."
             )
             return
-        video_file = await update.message.video.get_file()
-        video_content = await video_file.download_as_bytearray()
-        attachments.append(llm.Attachment(content=video_content))
+        attachment_file = update.message.video
+        attachment_type = update.message.video.mime_type or "video/mp4"
 
     elif update.message.audio:
         if "audio/mpeg" not in model.attachment_types:
@@ -611,13 +426,9 @@ async def process_message(update: Update, context: CallbackContext) -> None:
                 "Please switch to a model type that supports audio."
             )
             return
-        audio_file = await update.message.audio.get_file()
-        audio_content = await audio_file.download_as_bytearray()
         logfire.info(f"Audio file mime type: {update.message.audio.mime_type}")
-        logfire.info(
-            f"Audio content type: {type(audio_content)}, length: {len(audio_content) if audio_content is not None else 'None'}"
-        )
-        attachments.append(llm.Attachment(content=audio_content))
+        attachment_file = update.message.audio
+        attachment_type = update.message.audio.mime_type or "audio/mpeg"
 
     elif update.message.voice:
         if "audio/ogg" not in model.attachment_types:
@@ -626,33 +437,211 @@ async def process_message(update: Update, context: CallbackContext) -> None:
                 "Please switch to a model type that supports voice messages."
             )
             return
-        voice_file = await update.message.voice.get_file()
-        voice_content = await voice_file.download_as_bytearray()
         logfire.info(f"Voice file mime type: {update.message.voice.mime_type}")
-        logfire.info(
-            f"Voice content type: {type(voice_content)}, length: {len(voice_content) if voice_content is not None else 'None'}"
+        attachment_file = update.message.voice
+        attachment_type = update.message.voice.mime_type or "audio/ogg"
+
+    attachment_store: AttachmentStore = context.bot_data["attachment_store"]
+    if attachment_file and attachment_store.is_too_large(attachment_file.file_size):
+        return await thinking_message.edit_text(
+            "The attachment is too large. Files of up to "
+            f"{attachment_store.max_bytes // (1024 * 1024)} MB are supported."
         )
-        attachments.append(llm.Attachment(content=voice_content))
+
+    # Find links in the message text
+    url_pattern = r"@(https?://[^\s]+|[^\s]+\.[^\s]+/[^\s]*)"
+    urls = re.findall(url_pattern, message_text) if message_text else []
+
+    # Check if this is a thinking request
+    thinking_requested = "@think" in message_text if message_text else False
+    if thinking_requested:
+        # Remove the @think command from the message
+        message_text = message_text.replace("@think", "").strip()
+
+    # Check for @web search commands
+    web_search_pattern = r"@web"
+    web_searches = re.findall(web_search_pattern, message_text) if message_text else []
+    search_message_text = message_text
+    if web_searches:
+        # Remove the @web part from the message
+        message_text = message_text.replace("@web", "").strip()
+
+    # Everything before the main LLM call runs as a graph of stages, so that
+    # independent steps like scraping, searching and downloading overlap
+    pipeline = Pipeline()
+
+    async def load_conversation():
+        def load():
+            with logs_db.lock:
+                conversation_id = get_chat_conversation_id(
+                    logs_db.chat_conversations, update.effective_chat.id
+                )
+                if not conversation_id:
+                    return conversation_id, model.conversation()
+                return conversation_id, load_conversation_tail(
+                    logs_db.db, conversation_id, model, max_messages
+                )
+
+        return await asyncio.to_thread(load)
+
+    pipeline.add("conversation", load_conversation)
+
+    # Older turns that no longer fit in the history are kept as a running summary,
+    # unless the history was limited on purpose with @last
+    if history_summary_enabled and max_messages is None:
+
+        async def load_summary(conversation):
+            conversation_id, _ = conversation
+            if not conversation_id:
+                return None
+
+            def load():
+                with logs_db.lock:
+                    return get_summary(logs_db.db, conversation_id)
+
+            summary = await asyncio.to_thread(load)
+            return summary_fragment(summary["summary"]) if summary else None
+
+        pipeline.add("summary", load_summary, after=("conversation",))
+
+    # Older turns relevant to the message are looked up beyond the history window
+    if retrieval_enabled and max_messages is None and search_message_text:
+        retriever: TurnRetriever = context.bot_data["turn_retriever"]
+
+        async def retrieve(conversation):
+            conversation_id, conversation = conversation
+            if not conversation_id:
+                return None
+
+            turns = await asyncio.to_thread(
+                retriever.search,
+                conversation_id,
+                search_message_text,
+                {response.id for response in conversation.responses},
+            )
+            logfire.info(f"Retrieved {len(turns)} older turns")
+            return relevant_history_fragment(turns) if turns else None
+
+        pipeline.add("retrieval", retrieve, after=("conversation",))
+
+    if urls:
+
+        async def scrape():
+            scraped_pages = await scrape_urls(urls, context.bot_data["scrape_cache"])
+            return [
+                cleandoc(f"""
+                <source_context url={url}>
+                {markdown}
+                </source_context>
+                """)
+                for url, markdown in zip(urls, scraped_pages)
+            ]
+
+        pipeline.add("scrape", scrape)
+
+    if thinking_requested:
+
+        async def think(conversation):
+            nonlocal thinking_message
+            _, conversation = conversation
+
+            # Create a thinking prompt with instructions
+            thinking_prompt = cleandoc(f"""
+            This is a message from the user: "{search_message_text}"
+            
+            Think step-by-step about your answer. Consider multiple different paths.
+            Critique your thinking and backtrack if necessary.
+            Explain your reasoning process thoroughly.
+
+            Do not include any tags in your response like <thinking> or <thinking_output>.
+            """)
+
+            # Make the initial "thinking" call to the model
+            thinking_response = conversation.prompt(
+                thinking_prompt, system=system_prompt
+            )
+            thinking_output = await llm_executor.run(thinking_response.text)
+
+            # Log the thinking output
+            logfire.info(f"Thinking output: {thinking_output}...")
+
+            # Send the thinking output to the user in an expandable blockquote
+            await thinking_message.edit_text(
+                f"<blockquote expandable>\n{html.escape(thinking_output)}\n</blockquote>",
+                parse_mode="HTML",
+            )
+
+            # Create a new thinking message for the final response
+            thinking_message = await update.message.reply_text("...")
+
+            # Add the thinking output to the context for the final response
+            return f"\n\n<thinking>\n{thinking_output}\n</thinking>\n\n"
+
+        pipeline.add("think", think, after=("conversation",))
+
+    if web_searches:
+
+        async def web_search():
+            aux_model = get_aux_model(context.chat_data, fallback=model)
+            search_query = await rewrite_search_query(aux_model, search_message_text)
+
+            logfire.info(f"Web search query: {search_query}")
+
+            # Perform the web search
+            search_results = await web_search_client.search(search_query)
+
+            logfire.info(f"Web search results: {search_results}")
+
+            # Add the search results to the context
+            web_context = cleandoc(f"""
+            <web_search_results query="{search_query}">
+            {search_results}
+            </web_search_results>
+            """)
+            return "\n\n" + web_context
+
+        pipeline.add("web_search", web_search)
+
+    if attachment_file:
+
+        async def download_attachment():
+            return [await attachment_store.download(attachment_file, attachment_type)]
+
+        pipeline.add("attachments", download_attachment)
+
+    results = await pipeline.run()
+
+    conversation_id, conversation = results["conversation"]
+    fragments = [
+        *results.get("scrape", []),
+        *([results["think"]] if "think" in results else []),
+        *([results["web_search"]] if "web_search" in results else []),
+    ]
+    attachments = results.get("attachments", [])
+    system_fragments = [
+        fragment
+        for fragment in (results.get("summary"), results.get("retrieval"))
+        if fragment
+    ]
 
     pretty_print_tool_calls = []
 
     # A hacky way of collecting info about tool calls for now. Ideally, this function
     # would also print it out to the telegram chat. This doesn't work for now because
-    # we don't make LLM calls using asyncio.
+    # the chain runs on a worker thread rather than the event loop.
     def after_call(tool: Tool, tool_call: ToolCall, tool_result: ToolResult) -> None:
         nonlocal pretty_print_tool_calls
         pretty_print_tool_calls.append(
             cleandoc(f"""
         <blockquote expandable>
         <b>🪛Tool Call</b>
-        <i>Name:</i> {tool.name}
-        <i>Args</i>: <code>{tool_call.arguments}</code>
-        <i>Result:</i> <code>{tool_result.output}</code>
+        <i>Name:</i> {html.escape(tool.name)}
+        <i>Args</i>: <code>{html.escape(str(tool_call.arguments))}</code>
+        <i>Result:</i> <code>{html.escape(str(tool_result.output))}</code>
         </blockquote>""")
         )
         logfire.info(f"Tool call: {tool}, {tool_call}, {tool_result}")
 
-    system_prompt = context.chat_data.get("system_prompt", "")
     response = conversation.chain(
         message_text,
         fragments=fragments,
@@ -660,23 +649,25 @@ async def process_message(update: Update, context: CallbackContext) -> None:
         after_call=after_call,
         chain_limit=AGENTIC_LOOP_LIMIT,
         system=system_prompt,
+        system_fragments=system_fragments,
+        options=prompt_cache_options(model),
     )
 
     try:
-        response_text = response.text()
-        await thinking_message.delete()
-        if pretty_print_tool_calls:
+        if stream_responses:
+            response_text = await stream_message(
+                update, thinking_message, llm_executor.stream(response)
+            )
+            # Tool calls are only known once the chain has finished streaming
             for tool_call in pretty_print_tool_calls:
                 await update.message.reply_text(tool_call, parse_mode="HTML")
-        # First try to reply with markdown
-        try:
-            await update.message.reply_text(response_text, parse_mode="Markdown")
-        except BadRequest:
-            # Then try without markdown
-            try:
-                await update.message.reply_text(response_text)
-            except BadRequest:
-                await send_long_message(update, context, response_text)
+        else:
+            response_text = await llm_executor.run(response.text)
+            await thinking_message.delete()
+            if pretty_print_tool_calls:
+                for tool_call in pretty_print_tool_calls:
+                    await update.message.reply_text(tool_call, parse_mode="HTML")
+            await send_markdown_message(update, response_text)
 
     except Exception as e:
         await update.message.reply_text(
@@ -685,20 +676,31 @@ async def process_message(update: Update, context: CallbackContext) -> None:
         logfire.error(e)
         return
 
-    # Persisting the response to the SQLite DB to keep the conversation
-    response.log_to_db(db)
+    def persist():
+        with logs_db.lock:
+            # Persisting the response to the SQLite DB to keep the conversation
+            response.log_to_db(logs_db.db)
+            record_response_tokens(logs_db.db, conversation.id, response)
+
+            # Only persist the conversation after logging to the DB
+            if not conversation_id:
+                set_chat_conversation_id(
+                    logs_db.chat_conversations, conversation.id, update.effective_chat.id
+                )
+
+    await asyncio.to_thread(persist)
 
-    # Only persist the conversation after logging to the DB
-    if not conversation_id:
-        _set_chat_conversation_id(
-            chat_conversations_table, conversation.id, update.effective_chat.id
+    if history_summary_enabled:
+        summariser: HistorySummariser = context.bot_data["history_summariser"]
+        summariser.schedule(
+            conversation.id, get_aux_model(context.chat_data, fallback=model)
         )
+    if retrieval_enabled:
+        context.bot_data["turn_retriever"].schedule_indexing(conversation.id)
 
-    if hasattr(response, "usage"):
-        logfire.info(f"Message: {response_text} Usage: {response.usage()}")
-    else:
-        for r in response.responses():
-            logfire.info(f"Message: {r.text()} Usage: {r.usage()}")
+    for r in executed_responses(response):
+        logfire.info(f"Message: {r.text()} Usage: {r.usage()}")
+        prompt_cache_stats.record(r)
 
 
 async def error_handler(update: Update, context: CallbackContext) -> None:
@@ -0,0 +1,298 @@
+import llm
+import logfire
+import sqlite_utils
+from llm.models import ChainResponse
+
+from token_counter import token_counter
+
+MAX_TOKEN_LIMIT = 10_000
+
+
+def executed_responses(response) -> list[llm.Response]:
+    """
+    The responses a prompt or chain has already executed, without running them
+    again like `ChainResponse.responses()` would.
+    """
+    if isinstance(response, ChainResponse):
+        # Private to llm, written against llm 0.26
+        return list(response._responses)
+    return [response]
+
+
+def estimate_tokens_from_text(text: str, model_id: str | None = None) -> int:
+    return token_counter.count(text, model_id)
+
+
+def get_response_attachment_types_table(
+    db: sqlite_utils.Database,
+) -> sqlite_utils.db.Table:
+    """
+    A side table holding the MIME type of every attachment sent with a logged
+    response, once per type. Responses with attachments the current model can't
+    take are then filtered out by the history query itself.
+
+    We need to remove those responses from the conversation history rather than
+    just their attachments, because the underlying model calls generated are not
+    compatible with the input messages that had the attachments.
+    """
+    attachment_types = db.table(
+        "response_attachment_types", pk=("response_id", "mime_type")
+    )
+    if not attachment_types.exists():
+        attachment_types.create(
+            {"response_id": str, "mime_type": str},
+            pk=("response_id", "mime_type"),
+            if_not_exists=True,
+        )
+
+    return attachment_types
+
+
+def get_response_tokens_table(db: sqlite_utils.Database) -> sqlite_utils.db.Table:
+    """
+    A side table holding the estimated token count of every logged response,
+    along with its position in its conversation and a running total of tokens
+    up to and including it. Choosing the newest responses that fit a token
+    budget then becomes a range query on `cumulative_tokens`.
+    """
+    response_tokens = db.table("response_tokens", pk="response_id")
+    if not response_tokens.exists():
+        response_tokens.create(
+            {
+                "response_id": str,
+                "conversation_id": str,
+                "seq": int,
+                "tokens": int,
+                "cumulative_tokens": int,
+            },
+            pk="response_id",
+            if_not_exists=True,
+        )
+        response_tokens.create_index(
+            ["conversation_id", "seq"], unique=True, if_not_exists=True
+        )
+        response_tokens.create_index(
+            ["conversation_id", "cumulative_tokens"], if_not_exists=True
+        )
+
+    return response_tokens
+
+
+def _estimate_response_tokens(
+    prompt: str | None, response_text: str | None, model_id: str | None
+) -> int:
+    return estimate_tokens_from_text(prompt, model_id) + estimate_tokens_from_text(
+        response_text, model_id
+    )
+
+
+def _latest_response_tokens(db: sqlite_utils.Database, conversation_id: str):
+    rows = list(
+        db.query(
+            "select seq, cumulative_tokens from response_tokens "
+            "where conversation_id = ? order by seq desc limit 1",
+            [conversation_id],
+        )
+    )
+    return rows[0] if rows else None
+
+
+def _append_response_tokens(
+    db: sqlite_utils.Database, conversation_id: str, responses: list[tuple[str, int]]
+) -> None:
+    latest = _latest_response_tokens(db, conversation_id)
+    seq = latest["seq"] if latest else 0
+    cumulative_tokens = latest["cumulative_tokens"] if latest else 0
+
+    rows = []
+    for response_id, tokens in responses:
+        seq += 1
+        cumulative_tokens += tokens
+        rows.append(
+            {
+                "response_id": response_id,
+                "conversation_id": conversation_id,
+                "seq": seq,
+                "tokens": tokens,
+                "cumulative_tokens": cumulative_tokens,
+            }
+        )
+    db["response_tokens"].insert_all(rows, ignore=True)
+
+
+def record_response_tokens(
+    db: sqlite_utils.Database, conversation_id: str, response
+) -> None:
+    """
+    Records the token estimates and attachment types of a response that has just
+    been logged to the DB.
+    """
+    responses = executed_responses(response)
+    db["response_attachment_types"].insert_all(
+        (
+            {"response_id": r.id, "mime_type": attachment.resolve_type()}
+            for r in responses
+            for attachment in r.prompt.attachments
+        ),
+        ignore=True,
+    )
+    _append_response_tokens(
+        db,
+        conversation_id,
+        [
+            (
+                r.id,
+                _estimate_response_tokens(
+                    r.prompt.prompt, r.text_or_raise(), r.model.model_id
+                ),
+            )
+            for r in responses
+        ],
+    )
+
+
+def backfill_response_tokens(db: sqlite_utils.Database) -> None:
+    """Estimates tokens for any responses logged before the side table existed."""
+    missing = list(
+        db.query(
+            """
+            select responses.id, responses.conversation_id, responses.model,
+                responses.prompt, responses.response
+            from responses
+            left join response_tokens on response_tokens.response_id = responses.id
+            where response_tokens.response_id is null
+            and responses.conversation_id is not null
+            order by responses.rowid
+            """
+        )
+    )
+    if not missing:
+        return
+
+    # Prompts are counted with their fragments, like `Prompt.prompt` does when a
+    # response is recorded live, since scraped pages and search results are sent
+    # as fragments
+    fragments = {}
+    for row in db.query(
+        """
+        select prompt_fragments.response_id, fragments.content
+        from prompt_fragments
+        join fragments on fragments.id = prompt_fragments.fragment_id
+        left join response_tokens
+            on response_tokens.response_id = prompt_fragments.response_id
+        where response_tokens.response_id is null
+        order by prompt_fragments.response_id, prompt_fragments."order"
+        """
+    ):
+        fragments.setdefault(row["response_id"], []).append(row["content"])
+
+    by_conversation = {}
+    for row in missing:
+        prompt = "\n".join(
+            fragments.get(row["id"], []) + ([row["prompt"]] if row["prompt"] else [])
+        )
+        by_conversation.setdefault(row["conversation_id"], []).append(
+            (
+                row["id"],
+                _estimate_response_tokens(prompt, row["response"], row["model"]),
+            )
+        )
+
+    with db.conn:
+        for conversation_id, responses in by_conversation.items():
+            _append_response_tokens(db, conversation_id, responses)
+
+    logfire.info(f"Backfilled token estimates for {len(missing)} responses")
+
+
+def backfill_response_attachment_types(db: sqlite_utils.Database) -> None:
+    """Copies the attachment types of responses logged before the side table existed."""
+    with db.conn:
+        cursor = db.execute(
+            """
+            insert or ignore into response_attachment_types (response_id, mime_type)
+            select prompt_attachments.response_id, attachments.type
+            from prompt_attachments
+            join attachments on attachments.id = prompt_attachments.attachment_id
+            where attachments.type is not null
+            """
+        )
+    if cursor.rowcount > 0:
+        logfire.info(f"Backfilled {cursor.rowcount} response attachment types")
+
+
+def load_conversation_tail(
+    db: sqlite_utils.Database,
+    conversation_id: str,
+    model: llm.Model,
+    max_messages: int | None = None,
+    token_limit: int = MAX_TOKEN_LIMIT,
+) -> llm.Conversation:
+    """
+    Loads a conversation with only its newest responses that fit in `token_limit`,
+    limited to the last `max_messages` responses if given.
+
+    The window is read with a range query on the running token totals. Responses
+    with attachments the model doesn't support are flagged by the same query and
+    never loaded. They free up budget, so the window is then extended further
+    back until it's full.
+    """
+    conversation = llm.Conversation.from_row(db["conversations"].get(conversation_id))
+    conversation.model = model
+
+    filtered_responses = []
+    total_estimated_tokens = 0
+
+    supported_types = sorted(model.attachment_types)
+    latest = _latest_response_tokens(db, conversation_id)
+    if latest and (max_messages is None or max_messages > 0):
+        min_seq = latest["seq"] - max_messages if max_messages is not None else 0
+        upper = latest["cumulative_tokens"]
+
+        while total_estimated_tokens < token_limit:
+            floor = upper - (token_limit - total_estimated_tokens)
+            rows = list(
+                db.query(
+                    f"""
+                    select responses.*, response_tokens.tokens,
+                        response_tokens.cumulative_tokens - response_tokens.tokens as start_tokens,
+                        exists (
+                            select 1 from response_attachment_types
+                            where response_attachment_types.response_id = responses.id
+                            and response_attachment_types.mime_type
+                                not in ({", ".join("?" for _ in supported_types)})
+                        ) as incompatible
+                    from response_tokens
+                    join responses on responses.id = response_tokens.response_id
+                    where response_tokens.conversation_id = ?
+                    and response_tokens.seq > ?
+                    and response_tokens.cumulative_tokens <= ?
+                    and response_tokens.cumulative_tokens >= ?
+                    and response_tokens.cumulative_tokens - response_tokens.tokens >= ?
+                    order by response_tokens.seq desc
+                    """,
+                    [*supported_types, conversation_id, min_seq, upper, floor, floor],
+                )
+            )
+            if not rows:
+                break
+
+            skipped = False
+            for row in rows:
+                if row["incompatible"]:
+                    skipped = True
+                    continue
+                total_estimated_tokens += row["tokens"]
+                filtered_responses.append(llm.Response.from_row(db, row))
+
+            # Without skipped responses the window is already as full as it can be
+            if not skipped:
+                break
+            upper = rows[-1]["start_tokens"]
+
+    logfire.info(f"Estimated context tokens: {total_estimated_tokens}")
+    logfire.info(f"Number of responses: {len(filtered_responses)}")
+
+    # Return in chronological order (oldest to newest)
+    conversation.responses = list(reversed(filtered_responses))
+    return conversation
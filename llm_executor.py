@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import logfire
+
+from config import llm_call_timeout, llm_max_queue_depth, llm_max_workers
+
+# Marks the end of a stream produced on a worker thread
+_END = object()
+
+
+class LLMExecutorBusy(Exception):
+    """Raised when too many LLM calls are already running or queued."""
+
+
+class LLMCallTimeout(Exception):
+    """Raised when an LLM call takes longer than the configured timeout."""
+
+
+class LLMExecutor:
+    """
+    Runs blocking `llm` calls on a bounded thread pool so that a slow completion
+    doesn't freeze the event loop for every other chat.
+
+    Calls beyond `max_workers` wait in the pool's queue, and once `max_queue_depth`
+    calls are waiting new calls are rejected with `LLMExecutorBusy`.
+    A timed out call keeps its worker slot until the underlying thread finishes,
+    as there's no way to interrupt a blocking HTTP request from the outside.
+    """
+
+    def __init__(self, max_workers: int, max_queue_depth: int, timeout: float):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm"
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """The number of calls that are running or waiting for a worker."""
+        return self._pending
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue_depth:
+                raise LLMExecutorBusy(
+                    "Too many requests are being processed right now, please try again shortly"
+                )
+            self._pending += 1
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args, timeout: float | None = None):
+        """Runs `func(*args)` on the pool and waits for its result."""
+        self._acquire()
+        try:
+            future = self._pool.submit(func, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            logfire.error(f"LLM call timed out after {timeout} seconds")
+            raise LLMCallTimeout(f"The model took longer than {timeout:g} seconds")
+
+    async def stream(self, iterable, timeout: float | None = None):
+        """
+        Iterates a blocking iterable, such as an `llm.Response`, on the pool and
+        yields its items on the event loop as soon as they are produced.
+        """
+        self._acquire()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for item in iterable:
+                    if stopped.is_set():
+                        return
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (_END, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (_END, None))
+
+        try:
+            future = self._pool.submit(produce)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        timeout = timeout if timeout is not None else self.timeout
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                try:
+                    item, error = await asyncio.wait_for(
+                        queue.get(), max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    logfire.error(f"LLM stream timed out after {timeout} seconds")
+                    raise LLMCallTimeout(
+                        f"The model took longer than {timeout:g} seconds"
+                    )
+                if error:
+                    raise error
+                if item is _END:
+                    return
+                yield item
+        finally:
+            # Tells the worker to stop if the consumer gave up early
+            stopped.set()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+llm_executor = LLMExecutor(
+    max_workers=llm_max_workers,
+    max_queue_depth=llm_max_queue_depth,
+    timeout=llm_call_timeout,
+)
@@ -0,0 +1,127 @@
+import threading
+
+import llm
+import logfire
+from llm.plugins import pm
+
+# Knowledge cutoff dates by model id prefix, the most specific prefix wins
+# Fill in the accurate cutoff dates from provider documentation
+MODEL_CUTOFFS = {
+    # OpenAI models
+    "gpt-4o": "Oct 23",
+    "gpt-3.5-turbo": "Sep 21",
+    "chatgpt-4o": "Oct 23",
+    "gpt-4": "Dec 23",
+    "o1": "Oct 23",
+    "o3": "Oct 23",
+    # Google models
+    "gemini-2.0-flash": "Aug 24",
+    # Anthropic models
+    "anthropic/claude-3-7-sonnet": "Nov 24",
+    "anthropic/claude-3-5-sonnet": "Apr 24",
+    "anthropic/claude-3-5-haiku": "Jul 24",
+    "anthropic/claude-3-opus-latest": "Aug 23",
+    "anthropic/claude-3-haiku": "Aug 23",
+    # Add more models and their cutoff dates here
+}
+
+_VALUE = object()
+
+
+class PrefixTrie:
+    """Maps string prefixes to values, looked up by the longest prefix of a key."""
+
+    def __init__(self, items: dict[str, str] | None = None):
+        self._root = {}
+        for prefix, value in (items or {}).items():
+            self[prefix] = value
+
+    def __setitem__(self, prefix: str, value) -> None:
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_VALUE] = value
+
+    def longest_prefix_value(self, key: str, default=None):
+        node = self._root
+        value = node.get(_VALUE, default)
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                break
+            value = node.get(_VALUE, value)
+        return value
+
+
+class ModelCatalog:
+    """
+    The models installed through llm plugins, read once instead of on every
+    message. Model objects are resolved on first use and then reused, and the
+    rendered `/models` list is kept until the catalog changes. The catalog is
+    read again whenever the registered plugins change, or on `refresh()`.
+    """
+
+    def __init__(self, cutoffs: dict[str, str] = MODEL_CUTOFFS):
+        self._cutoffs = PrefixTrie(cutoffs)
+        self._lock = threading.Lock()
+        self._plugins = None
+        self.refresh()
+
+    def _plugin_names(self) -> frozenset:
+        return frozenset(name for name, _ in pm.list_name_plugin())
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._plugins = self._plugin_names()
+            models_with_aliases = llm.get_models_with_aliases()
+            self._model_ids = [
+                model_with_alias.model.model_id
+                for model_with_alias in models_with_aliases
+            ]
+            self._models = {}
+            for model_with_alias in models_with_aliases:
+                model = model_with_alias.model
+                self._models[model.model_id] = model
+                for alias in model_with_alias.aliases:
+                    self._models.setdefault(alias, model)
+            self._models_text = None
+        logfire.info(f"Loaded {len(self._model_ids)} models")
+
+    def _refresh_if_plugins_changed(self) -> None:
+        if self._plugin_names() != self._plugins:
+            self.refresh()
+
+    @property
+    def model_ids(self) -> list[str]:
+        self._refresh_if_plugins_changed()
+        return self._model_ids
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self.model_ids
+
+    def get_model(self, model_id: str) -> llm.Model:
+        """Like `llm.get_model`, but returns the same model object every time."""
+        self._refresh_if_plugins_changed()
+        model = self._models.get(model_id)
+        if model is None:
+            raise llm.UnknownModelError(f"Unknown model: {model_id}")
+        return model
+
+    def cutoff(self, model_id: str) -> str | None:
+        """The knowledge cutoff date of a model, from its most specific prefix."""
+        return self._cutoffs.longest_prefix_value(model_id)
+
+    def models_text(self) -> str:
+        """The list of models shown by `/models`."""
+        self._refresh_if_plugins_changed()
+        if self._models_text is None:
+            lines = []
+            for model_id in self._model_ids:
+                cutoff = self.cutoff(model_id)
+                suffix = f" (knowledge cutoff: {cutoff})" if cutoff else ""
+                lines.append(f"• `{model_id}`{suffix}")
+            self._models_text = "\n".join(lines)
+        return self._models_text
+
+
+model_catalog = ModelCatalog()
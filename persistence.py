@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+import logfire
+import sqlite_utils
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import LogsDatabase
+
+# Marks a staged entry whose data should be deleted rather than written
+_DROPPED = None
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Keeps `user_data` and `chat_data`, like the chosen model and system prompt,
+    in the logs database so they survive restarts.
+
+    All entries are read in one query per kind at startup. Afterwards, data is
+    only compared and staged when the application updates the persistence (every
+    `update_interval` seconds), and the entries that actually changed are written
+    behind the handlers in a single transaction.
+    """
+
+    def __init__(self, logs_db: LogsDatabase, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=True, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.logs_db = logs_db
+        # The JSON last written for each (table, id), to skip unchanged entries
+        self._persisted: dict[tuple[str, int], str] = {}
+        self._pending: dict[tuple[str, int], str | None] = {}
+        self._flush_task: asyncio.Task | None = None
+
+        with logs_db.lock:
+            for table in ("bot_user_data", "bot_chat_data"):
+                get_data_table(logs_db.db, table)
+
+    def _load(self, table: str) -> dict[int, dict]:
+        with self.logs_db.lock:
+            rows = list(self.logs_db.db.query(f"select id, data from {table}"))
+
+        data = {}
+        for row in rows:
+            self._persisted[(table, row["id"])] = row["data"]
+            data[row["id"]] = json.loads(row["data"])
+        logfire.info(f"Loaded {len(data)} entries from {table}")
+        return data
+
+    async def get_user_data(self) -> dict[int, dict]:
+        return await asyncio.to_thread(self._load, "bot_user_data")
+
+    async def get_chat_data(self) -> dict[int, dict]:
+        return await asyncio.to_thread(self._load, "bot_chat_data")
+
+    def _stage(self, table: str, id: int, data: dict | None) -> None:
+        key = (table, id)
+        if data is _DROPPED:
+            serialised = _DROPPED
+        else:
+            try:
+                serialised = json.dumps(data, sort_keys=True)
+            except (TypeError, ValueError) as e:
+                logfire.error(f"Can't persist {table} for {id}: {e}")
+                return
+
+        if serialised == self._persisted.get(key, _DROPPED) and key not in self._pending:
+            return
+        self._pending[key] = serialised
+
+        # Every entry staged by one persistence update goes into the same write
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    def _write(self, pending: dict[tuple[str, int], str | None]) -> None:
+        with self.logs_db.lock, self.logs_db.db.conn:
+            for (table, id), serialised in pending.items():
+                if serialised is _DROPPED:
+                    self.logs_db.db[table].delete_where("id = ?", [id])
+                else:
+                    self.logs_db.db[table].upsert(
+                        {"id": id, "data": serialised}, pk="id"
+                    )
+
+    async def _write_pending(self) -> None:
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            await asyncio.to_thread(self._write, pending)
+            for key, serialised in pending.items():
+                if serialised is _DROPPED:
+                    self._persisted.pop(key, None)
+                else:
+                    self._persisted[key] = serialised
+            logfire.info(f"Persisted {len(pending)} user and chat data entries")
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage("bot_user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage("bot_chat_data", chat_id, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("bot_user_data", user_id, _DROPPED)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage("bot_chat_data", chat_id, _DROPPED)
+
+    async def flush(self) -> None:
+        """Writes anything still staged, called when the application stops."""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write_pending()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    # Bot data holds the shared services, and the bot uses neither callback data
+    # nor conversation handlers, so none of these are stored
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+
+def get_data_table(db: sqlite_utils.Database, name: str) -> sqlite_utils.db.Table:
+    table = db.table(name, pk="id")
+    if not table.exists():
+        table.create({"id": int, "data": str}, pk="id", if_not_exists=True)
+
+    return table
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import logfire
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    after: tuple[str, ...] = field(default_factory=tuple)
+
+
+class Pipeline:
+    """
+    Runs a small graph of async stages, starting each one as soon as the stages
+    it depends on have finished, so independent stages run at the same time.
+
+    Each stage is called with the results of its dependencies as keyword
+    arguments. If any stage fails, the others are cancelled and the error is
+    raised from `run`.
+    """
+
+    def __init__(self):
+        self._stages: dict[str, Stage] = {}
+
+    def add(
+        self, name: str, func: Callable[..., Awaitable[Any]], after: tuple[str, ...] = ()
+    ) -> None:
+        if name in self._stages:
+            raise ValueError(f"Stage {name!r} was added twice")
+        self._stages[name] = Stage(name, func, tuple(after))
+
+    def _check_graph(self) -> None:
+        visiting, visited = set(), set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name!r} depends on itself")
+            visiting.add(name)
+            for dependency in self._stages[name].after:
+                if dependency not in self._stages:
+                    raise ValueError(
+                        f"Stage {name!r} depends on unknown stage {dependency!r}"
+                    )
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self._stages:
+            visit(name)
+
+    async def run(self) -> dict[str, Any]:
+        """Runs every stage and returns their results by stage name."""
+        self._check_graph()
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage):
+            dependencies = {name: await tasks[name] for name in stage.after}
+            started = time.monotonic()
+            result = await stage.func(**dependencies)
+            logfire.info(
+                f"Stage {stage.name} took {(time.monotonic() - started) * 1000:.0f} ms"
+            )
+            return result
+
+        for stage in self._stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # Wait for the cancelled stages so none are left running
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+
+        return {name: task.result() for name, task in tasks.items()}
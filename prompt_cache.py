@@ -0,0 +1,112 @@
+import threading
+from dataclasses import dataclass
+
+import llm
+import logfire
+
+from config import prompt_cache_enabled
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def supports_prompt_cache(model: llm.Model) -> bool:
+    """Whether the model's plugin has a `cache` option, like llm-anthropic's."""
+    return "cache" in model.Options.model_fields
+
+
+def prompt_cache_options(
+    model: llm.Model, enabled: bool = prompt_cache_enabled
+) -> dict:
+    """
+    The options that turn on prompt caching for a prompt to `model`, if enabled
+    and supported. With `cache` on, the plugin only marks attachments as cache
+    breakpoints, so the model's requests are also given a breakpoint after the
+    system prompt, and one at the end of the previous turn, the newest part of
+    the history that the next turn will send again unchanged.
+    """
+    if not enabled or not supports_prompt_cache(model):
+        return {}
+    _add_breakpoints(model)
+    return {"cache": True}
+
+
+def _add_breakpoints(model: llm.Model) -> None:
+    build_kwargs = getattr(model, "build_kwargs", None)
+    if build_kwargs is None or getattr(build_kwargs, "adds_breakpoints", False):
+        return
+
+    def build_kwargs_with_breakpoints(prompt, conversation):
+        kwargs = build_kwargs(prompt, conversation)
+        if prompt.options.cache:
+            if prompt.system:
+                kwargs["system"] = _system_blocks(prompt)
+            _mark_previous_turn(prompt, kwargs.get("messages", []))
+        return kwargs
+
+    build_kwargs_with_breakpoints.adds_breakpoints = True
+    model.build_kwargs = build_kwargs_with_breakpoints
+
+
+def _system_blocks(prompt: llm.Prompt) -> list[dict]:
+    """
+    The system prompt as a cached block, followed by the system fragments, like
+    the conversation summary, which change from turn to turn and so would
+    otherwise invalidate the cached prefix every time.
+    """
+    blocks = []
+    system = (prompt._system or "").strip()
+    if system:
+        blocks.append({"type": "text", "text": system, "cache_control": CACHE_CONTROL})
+    fragments = [str(fragment).strip() for fragment in prompt.system_fragments]
+    fragments = [fragment for fragment in fragments if fragment]
+    if fragments:
+        blocks.append({"type": "text", "text": "\n\n".join(fragments)})
+    return blocks
+
+
+def _mark_previous_turn(prompt: llm.Prompt, messages: list[dict]) -> None:
+    history = messages[:-1] if getattr(prompt.options, "prefill", None) else messages
+    # Without a message of its own, the plugin already marks the last message
+    if not (prompt.prompt or prompt.attachments or prompt.tool_results):
+        return
+    history = history[:-1]
+    if history and isinstance(history[-1].get("content"), list):
+        history[-1]["content"][-1]["cache_control"] = CACHE_CONTROL
+
+
+@dataclass
+class PromptCacheStats:
+    """Running totals of prompt cache use, across every chat."""
+
+    hits: int = 0
+    misses: int = 0
+    read_tokens: int = 0
+    written_tokens: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+
+    def record(self, response: llm.Response) -> None:
+        """Counts a finished response as a hit if any input was read from the cache."""
+        details = response.token_details or {}
+        if "cache_read_input_tokens" not in details:
+            return
+
+        read_tokens = details.get("cache_read_input_tokens") or 0
+        written_tokens = details.get("cache_creation_input_tokens") or 0
+        with self._lock:
+            if read_tokens:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.read_tokens += read_tokens
+            self.written_tokens += written_tokens
+
+        logfire.info(
+            f"Prompt cache {'hit' if read_tokens else 'miss'}: "
+            f"{read_tokens} tokens read, {written_tokens} written "
+            f"({self.hits} hits, {self.misses} misses so far)"
+        )
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import time
+
+import logfire
+
+PRESETS_DIR = os.path.join(os.path.dirname(__file__), "system_prompts")
+PRESET_SUFFIX = ".md"
+
+# How often, at most, the presets directory is checked for changed files
+PRESET_CHECK_INTERVAL = 5
+
+
+class PromptPresets:
+    """
+    The pre-defined system prompts in `system_prompts/`, read once at startup
+    and answered from memory afterwards.
+
+    The directory is checked at most every `check_interval` seconds, and only
+    files whose modification time changed are read again, so edited, added and
+    deleted presets are picked up without a restart. `reload()` reads them all
+    again straight away. Preset texts are interned, and chats using a preset
+    store its name rather than their own copy of the text.
+    """
+
+    def __init__(
+        self,
+        directory: str = PRESETS_DIR,
+        check_interval: float = PRESET_CHECK_INTERVAL,
+    ):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # name -> (mtime_ns, text)
+        self._presets: dict[str, tuple[int, str]] = {}
+        self._checked_at = None
+        self.reload()
+
+    def _scan(self) -> None:
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(PRESET_SUFFIX) and entry.is_file()
+            ]
+        except FileNotFoundError:
+            entries = []
+
+        presets = {}
+        for entry in entries:
+            name = entry.name.removesuffix(PRESET_SUFFIX)
+            mtime_ns = entry.stat().st_mtime_ns
+            cached = self._presets.get(name)
+            if cached is not None and cached[0] == mtime_ns:
+                presets[name] = cached
+                continue
+            try:
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    text = f.read().strip()
+            except OSError as e:
+                logfire.error(f"Error loading pre-defined prompt '{name}': {e}")
+                continue
+            presets[name] = (mtime_ns, sys.intern(text))
+
+        self._presets = presets
+        self._checked_at = time.monotonic()
+
+    def reload(self) -> None:
+        with self._lock:
+            self._presets = {}
+            self._scan()
+        logfire.info(f"Loaded {len(self._presets)} system prompt presets")
+
+    def _scan_if_stale(self) -> None:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._scan()
+
+    def get(self, name: str) -> str | None:
+        """The text of a preset, or None if there is no preset by that name."""
+        self._scan_if_stale()
+        preset = self._presets.get(name)
+        return preset[1] if preset else None
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def names(self) -> list[str]:
+        self._scan_if_stale()
+        return sorted(self._presets)
+
+
+prompt_presets = PromptPresets()
+
+
+def get_system_prompt(chat_data: dict) -> str:
+    """The chat's system prompt, read from its preset if one was chosen."""
+    preset_name = chat_data.get("system_prompt_preset")
+    if preset_name is not None:
+        preset = prompt_presets.get(preset_name)
+        if preset is not None:
+            return preset
+    return chat_data.get("system_prompt", "")
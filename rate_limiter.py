@@ -0,0 +1,144 @@
+import asyncio
+import time
+from typing import Any
+
+import logfire
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Once this many chats have buckets, idle ones are pruned so the map doesn't grow forever
+MAX_IDLE_CHAT_BUCKETS = 1024
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average with bursts of up to `capacity`.
+    Waiters are served in the order they arrived, and the bucket can be paused
+    when Telegram asks to retry later.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return (
+            not self._lock.locked()
+            and self.tokens >= self.capacity
+            and self.paused_until <= now
+        )
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.paused_until > now:
+                    await asyncio.sleep(self.paused_until - now)
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class OutboundRateLimiter(BaseRateLimiter[None]):
+    """
+    Paces every request the bot makes to Telegram with a global token bucket and
+    one per chat, so bursts are queued instead of hitting flood limits. Group
+    chats get their own, slower rate. Requests to different chats go out in
+    parallel up to the global rate, and requests to one chat start in the order
+    they were made.
+
+    When Telegram still answers with RetryAfter, the chat (or everything, for
+    requests without a chat) is paused for the time asked and the request is
+    retried, up to `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        group_rate: float,
+        chat_burst: int,
+        max_retries: int,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chat_buckets: dict[Any, TokenBucket] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_IDLE_CHAT_BUCKETS:
+                self.chat_buckets = {
+                    key: value
+                    for key, value in self.chat_buckets.items()
+                    if not value.idle
+                }
+            # Groups have negative ids, or are referred to by @username
+            is_group = str(chat_id).startswith(("-", "@"))
+            bucket = TokenBucket(
+                self.group_rate if is_group else self.chat_rate, self.chat_burst
+            )
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def process_request(
+        self,
+        callback,
+        args,
+        kwargs,
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: None,
+    ):
+        chat_id = data.get("chat_id")
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        for attempt in range(self.max_retries + 1):
+            if chat_bucket is not None:
+                await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                retry_after = _seconds(e.retry_after)
+                logfire.warn(
+                    f"Telegram asked to retry {endpoint} to {chat_id} in {retry_after}s"
+                )
+                (chat_bucket or self.global_bucket).pause(retry_after)
+
+
+def _seconds(retry_after) -> float:
+    # Newer versions of python-telegram-bot give a timedelta
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
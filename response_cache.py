@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import llm
+import logfire
+import sqlite_utils
+
+from config import response_cache_max_entries, response_cache_ttl
+
+hits_counter = logfire.metric_counter(
+    "response_cache_hits", unit="1", description="Answers served from the cache"
+)
+misses_counter = logfire.metric_counter(
+    "response_cache_misses", unit="1", description="Answers not found in the cache"
+)
+
+
+def response_cache_key(model_id: str, system_prompt: str, prompt: str) -> str:
+    """The key of a stateless prompt, a hash of everything that determines it."""
+    return hashlib.sha256(
+        json.dumps([model_id, system_prompt, prompt]).encode("utf-8")
+    ).hexdigest()
+
+
+class ResponseCache:
+    """
+    An on-disk cache of answers to stateless prompts, like `/private` messages,
+    kept across restarts.
+
+    Answers are keyed by a hash of the model id, system prompt and prompt, and
+    expire after `ttl` seconds. Once there are more than `max_entries` answers,
+    the least recently used are evicted. Hits and misses are counted, both here
+    and as logfire metrics.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        max_entries: int = response_cache_max_entries,
+        ttl: float = response_cache_ttl,
+    ):
+        self.path = str(path or llm.user_dir() / "response_cache.db")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.db = sqlite_utils.Database(connection)
+        self.db.enable_wal()
+        self.db["responses"].create(
+            {
+                "key": str,
+                "model_id": str,
+                "response": str,
+                "created_at": float,
+                "accessed_at": float,
+            },
+            pk="key",
+            if_not_exists=True,
+        )
+        self.db["responses"].create_index(["accessed_at"], if_not_exists=True)
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            rows = list(
+                self.db.query(
+                    "select response, created_at from responses where key = ?", [key]
+                )
+            )
+            now = time.time()
+            with self.db.conn:
+                if rows and rows[0]["created_at"] + self.ttl <= now:
+                    self.db["responses"].delete(key)
+                    rows = []
+                if rows:
+                    self.db.execute(
+                        "update responses set accessed_at = ? where key = ?", [now, key]
+                    )
+
+            if rows:
+                self.hits += 1
+                hits_counter.add(1)
+            else:
+                self.misses += 1
+                misses_counter.add(1)
+        logfire.info(
+            f"Response cache {'hit' if rows else 'miss'} "
+            f"({self.hits} hits, {self.misses} misses so far)"
+        )
+        return rows[0]["response"] if rows else None
+
+    def set(self, key: str, model_id: str, response: str) -> None:
+        now = time.time()
+        with self._lock, self.db.conn:
+            self.db["responses"].upsert(
+                {
+                    "key": key,
+                    "model_id": model_id,
+                    "response": response,
+                    "created_at": now,
+                    "accessed_at": now,
+                },
+                pk="key",
+            )
+            self._evict(now)
+
+    def __len__(self) -> int:
+        return self.db["responses"].count
+
+    def _evict(self, now: float) -> None:
+        self.db.execute("delete from responses where created_at <= ?", [now - self.ttl])
+        self.db.execute(
+            """
+            delete from responses where key in (
+                select key from responses order by accessed_at desc limit -1 offset ?
+            )
+            """,
+            [self.max_entries],
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.conn.close()
@@ -0,0 +1,275 @@
+import asyncio
+import hashlib
+import re
+
+import llm
+import logfire
+import sqlite_utils
+
+from cache import TTLCache
+from config import retrieval_embedding_model_id, retrieval_min_score, retrieval_top_k
+from database import LogsDatabase
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only retrieval needs it
+    np = None
+
+# Conversations whose vectors are kept in memory between searches
+VECTOR_CACHE_SIZE = 256
+VECTOR_CACHE_TTL = 60 * 60
+
+# How many turns are sent to the embedding model at once
+EMBED_BATCH_SIZE = 32
+
+_WORD = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Embeds text offline by hashing its words into a fixed number of buckets, so
+    texts sharing words end up close together. Much weaker than a real embedding
+    model, but needs no network or API key.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.model_id = f"hashing-{dimensions}"
+
+    def _embed(self, text: str):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in _WORD.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode()).digest()[:8], "big")
+            # The lowest bit picks the sign so unrelated words tend to cancel out
+            vector[(digest >> 1) % self.dimensions] += 1 if digest & 1 else -1
+        return vector
+
+    def embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+
+def get_embedder(model_id: str):
+    """An llm embedding model, or the offline hashing embedder for "hashing"."""
+    if model_id.startswith("hashing"):
+        dimensions = model_id.removeprefix("hashing").lstrip("-")
+        return HashingEmbedder(int(dimensions) if dimensions else 256)
+    return llm.get_embedding_model(model_id)
+
+
+def get_response_embeddings_table(
+    db: sqlite_utils.Database,
+) -> sqlite_utils.db.Table:
+    """
+    A side table holding a vector for every logged prompt/response pair, per
+    embedding model, stored as float32 bytes.
+    """
+    embeddings = db.table("response_embeddings", pk=("response_id", "embedder"))
+    if not embeddings.exists():
+        embeddings.create(
+            {
+                "response_id": str,
+                "embedder": str,
+                "conversation_id": str,
+                "seq": int,
+                "vector": bytes,
+            },
+            pk=("response_id", "embedder"),
+            if_not_exists=True,
+        )
+        embeddings.create_index(
+            ["conversation_id", "embedder", "seq"], if_not_exists=True
+        )
+
+    return embeddings
+
+
+def _turn_text(prompt: str | None, response: str | None) -> str:
+    return f"User: {prompt or ''}\nAssistant: {response or ''}"
+
+
+def relevant_history_fragment(turns: list[dict]) -> str:
+    """Retrieved turns as a system fragment, sent ahead of the system prompt."""
+    return (
+        "<relevant_history>\n"
+        + "\n\n".join(_turn_text(turn["prompt"], turn["response"]) for turn in turns)
+        + "\n</relevant_history>"
+    )
+
+
+class TurnRetriever:
+    """
+    Finds the older turns of a conversation most relevant to a new message.
+
+    Every prompt/response pair is embedded once, in the background after a
+    reply, and its vector stored in the logs database. A search embeds the new
+    message and scores it against all of the conversation's vectors at once
+    with NumPy, returning the `top_k` turns with a cosine similarity of at least
+    `min_score`. Vectors are kept in memory per conversation between searches,
+    and only turns embedded since are read again.
+    """
+
+    def __init__(
+        self,
+        logs_db: LogsDatabase,
+        embedder=None,
+        top_k: int = retrieval_top_k,
+        min_score: float = retrieval_min_score,
+    ):
+        if np is None:
+            raise RuntimeError("Retrieval needs numpy: poetry install --extras retrieval")
+
+        self.logs_db = logs_db
+        self.embedder = embedder or get_embedder(retrieval_embedding_model_id)
+        self.top_k = top_k
+        self.min_score = min_score
+        # conversation_id -> (seqs, normalised vectors) of the turns embedded so far
+        self._vectors = TTLCache(max_size=VECTOR_CACHE_SIZE, ttl=VECTOR_CACHE_TTL)
+        self._tasks: dict[str, asyncio.Task] = {}
+        # Conversations with turns logged while they were being indexed
+        self._rerun: set[str] = set()
+
+        with logs_db.lock:
+            get_response_embeddings_table(logs_db.db)
+
+    def _embed(self, texts: list[str]):
+        vectors = np.asarray(list(self.embedder.embed_batch(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def index_conversation(self, conversation_id: str) -> int:
+        """Embeds the turns of a conversation that don't have a vector yet."""
+        with self.logs_db.lock:
+            rows = list(
+                self.logs_db.db.query(
+                    """
+                    select response_tokens.response_id, response_tokens.seq,
+                        responses.prompt, responses.response
+                    from response_tokens
+                    join responses on responses.id = response_tokens.response_id
+                    left join response_embeddings
+                        on response_embeddings.embedder = ?
+                        and response_embeddings.response_id = response_tokens.response_id
+                    where response_tokens.conversation_id = ?
+                    and response_embeddings.response_id is null
+                    order by response_tokens.seq
+                    """,
+                    [self.embedder.model_id, conversation_id],
+                )
+            )
+
+        for start in range(0, len(rows), EMBED_BATCH_SIZE):
+            batch = rows[start : start + EMBED_BATCH_SIZE]
+            vectors = self._embed(
+                [_turn_text(row["prompt"], row["response"]) for row in batch]
+            )
+            with self.logs_db.lock, self.logs_db.db.conn:
+                self.logs_db.db["response_embeddings"].insert_all(
+                    (
+                        {
+                            "response_id": row["response_id"],
+                            "embedder": self.embedder.model_id,
+                            "conversation_id": conversation_id,
+                            "seq": row["seq"],
+                            "vector": vector.tobytes(),
+                        }
+                        for row, vector in zip(batch, vectors)
+                    ),
+                    ignore=True,
+                )
+        return len(rows)
+
+    def _load_vectors(self, conversation_id: str):
+        seqs, vectors = self._vectors.get(
+            conversation_id,
+            (np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)),
+        )
+        last_seq = int(seqs[-1]) if len(seqs) else 0
+        with self.logs_db.lock:
+            rows = list(
+                self.logs_db.db.query(
+                    """
+                    select seq, vector from response_embeddings
+                    where conversation_id = ? and embedder = ? and seq > ?
+                    order by seq
+                    """,
+                    [conversation_id, self.embedder.model_id, last_seq],
+                )
+            )
+        if rows:
+            new_vectors = np.stack(
+                [np.frombuffer(row["vector"], dtype=np.float32) for row in rows]
+            )
+            seqs = np.concatenate([seqs, [row["seq"] for row in rows]])
+            vectors = np.vstack([vectors, new_vectors]) if len(vectors) else new_vectors
+            self._vectors.set(conversation_id, (seqs, vectors))
+        return seqs, vectors
+
+    def search(
+        self, conversation_id: str, query: str, exclude_ids: set[str] = frozenset()
+    ) -> list[dict]:
+        """
+        The turns most relevant to `query`, oldest first, leaving out the
+        responses in `exclude_ids`, like the ones already in the history window.
+        """
+        seqs, vectors = self._load_vectors(conversation_id)
+        if not len(seqs) or not query:
+            return []
+
+        scores = vectors @ self._embed([query])[0]
+        # Taking a few extra leaves room for excluded turns
+        candidates = min(len(scores), self.top_k + len(exclude_ids))
+        best = np.argpartition(-scores, candidates - 1)[:candidates]
+        best = best[np.argsort(-scores[best])]
+        best_seqs = [int(seqs[i]) for i in best if scores[i] >= self.min_score]
+        if not best_seqs:
+            return []
+
+        with self.logs_db.lock:
+            rows = list(
+                self.logs_db.db.query(
+                    f"""
+                    select response_tokens.seq, responses.id, responses.prompt,
+                        responses.response
+                    from response_tokens
+                    join responses on responses.id = response_tokens.response_id
+                    where response_tokens.conversation_id = ?
+                    and response_tokens.seq in ({", ".join("?" for _ in best_seqs)})
+                    """,
+                    [conversation_id, *best_seqs],
+                )
+            )
+        by_seq = {row["seq"]: row for row in rows if row["id"] not in exclude_ids}
+        chosen = [seq for seq in best_seqs if seq in by_seq][: self.top_k]
+        return [by_seq[seq] for seq in sorted(chosen)]
+
+    def schedule_indexing(self, conversation_id: str) -> None:
+        """
+        Starts embedding the conversation's new turns. If that's already underway,
+        it runs again once the current run finishes, to pick up the newest turn.
+        """
+        task = self._tasks.get(conversation_id)
+        if task is not None and not task.done():
+            self._rerun.add(conversation_id)
+            return
+
+        task = asyncio.create_task(
+            asyncio.to_thread(self.index_conversation, conversation_id)
+        )
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda task: self._finished(conversation_id, task))
+
+    def _finished(self, conversation_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(conversation_id) is task:
+            del self._tasks[conversation_id]
+        if not task.cancelled() and task.exception() is not None:
+            logfire.error(
+                f"Embedding conversation {conversation_id} failed: {task.exception()}"
+            )
+        if conversation_id in self._rerun:
+            self._rerun.discard(conversation_id)
+            self.schedule_indexing(conversation_id)
+
+    async def wait(self) -> None:
+        """Waits for the indexing currently running, e.g. before shutting down."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
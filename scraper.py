@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+
+import llm
+import logfire
+import sqlite_utils
+from firecrawl import FirecrawlApp
+
+from config import (
+    firecrawl_api_key,
+    scrape_cache_max_bytes,
+    scrape_cache_ttl,
+    scrape_concurrency,
+)
+
+firecrawl_app = FirecrawlApp(api_key=firecrawl_api_key)
+
+
+class ScrapeCache:
+    """
+    An on-disk cache of scraped pages, shared by every chat and kept across restarts.
+
+    Each (url, format) entry points at its content by SHA-256 hash, so pages that
+    scrape to the same markdown are only stored once. Entries expire after `ttl`
+    seconds, and once the stored content goes over `max_bytes` the least recently
+    used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        max_bytes: int = scrape_cache_max_bytes,
+        ttl: float = scrape_cache_ttl,
+    ):
+        self.path = str(path or llm.user_dir() / "scrape_cache.db")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.db = sqlite_utils.Database(connection)
+        self.db.enable_wal()
+        self._setup_tables()
+
+    def _setup_tables(self) -> None:
+        self.db["scrape_contents"].create(
+            {"hash": str, "content": str, "size": int},
+            pk="hash",
+            if_not_exists=True,
+        )
+        self.db["scrape_pages"].create(
+            {
+                "url": str,
+                "format": str,
+                "content_hash": str,
+                "created_at": float,
+                "accessed_at": float,
+            },
+            pk=("url", "format"),
+            if_not_exists=True,
+        )
+        self.db["scrape_pages"].create_index(["accessed_at"], if_not_exists=True)
+        self.db["scrape_pages"].create_index(["content_hash"], if_not_exists=True)
+
+    def get(self, url: str, format: str = "markdown") -> str | None:
+        with self._lock:
+            rows = list(
+                self.db.query(
+                    """
+                    select scrape_pages.created_at, scrape_contents.content
+                    from scrape_pages
+                    join scrape_contents on scrape_contents.hash = scrape_pages.content_hash
+                    where scrape_pages.url = ? and scrape_pages.format = ?
+                    """,
+                    [url, format],
+                )
+            )
+            if not rows:
+                return None
+
+            now = time.time()
+            with self.db.conn:
+                if rows[0]["created_at"] + self.ttl <= now:
+                    self.db["scrape_pages"].delete((url, format))
+                    self._delete_orphaned_contents()
+                    return None
+
+                self.db.execute(
+                    "update scrape_pages set accessed_at = ? where url = ? and format = ?",
+                    [now, url, format],
+                )
+            return rows[0]["content"]
+
+    def set(self, url: str, content: str, format: str = "markdown") -> None:
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock, self.db.conn:
+            self.db["scrape_contents"].insert(
+                {
+                    "hash": content_hash,
+                    "content": content,
+                    "size": len(content.encode("utf-8")),
+                },
+                ignore=True,
+            )
+            self.db["scrape_pages"].upsert(
+                {
+                    "url": url,
+                    "format": format,
+                    "content_hash": content_hash,
+                    "created_at": now,
+                    "accessed_at": now,
+                },
+                pk=("url", "format"),
+            )
+            self._delete_orphaned_contents()
+            self._evict()
+
+    def total_bytes(self) -> int:
+        return self.db.execute(
+            "select coalesce(sum(size), 0) from scrape_contents"
+        ).fetchone()[0]
+
+    def _delete_orphaned_contents(self) -> None:
+        self.db.execute(
+            """
+            delete from scrape_contents where hash not in (
+                select content_hash from scrape_pages
+            )
+            """
+        )
+
+    def _evict(self) -> None:
+        total_bytes = self.total_bytes()
+        while total_bytes > self.max_bytes:
+            oldest = self.db.execute(
+                "select url, format from scrape_pages order by accessed_at limit 1"
+            ).fetchone()
+            if oldest is None:
+                break
+            self.db["scrape_pages"].delete(oldest)
+            self._delete_orphaned_contents()
+            total_bytes = self.total_bytes()
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.conn.close()
+
+
+def _scrape(url: str, format: str) -> str:
+    scrape_result = firecrawl_app.scrape_url(url, params={"formats": [format]})
+    return scrape_result[format]
+
+
+async def scrape_urls(
+    urls: list[str],
+    cache: ScrapeCache,
+    format: str = "markdown",
+    concurrency: int = scrape_concurrency,
+) -> list[str]:
+    """
+    Scrapes the URLs concurrently, at most `concurrency` at a time, serving
+    pages from the cache where possible. Returns the contents in URL order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape(url: str) -> str:
+        content = await asyncio.to_thread(cache.get, url, format)
+        if content is not None:
+            logfire.info(f"Scrape cache hit for: {url}")
+            return content
+
+        async with semaphore:
+            content = await asyncio.to_thread(_scrape, url, format)
+        await asyncio.to_thread(cache.set, url, content, format)
+        return content
+
+    # The same link mentioned twice is only scraped once
+    unique_urls = list(dict.fromkeys(urls))
+    contents = await asyncio.gather(*(scrape(url) for url in unique_urls))
+    by_url = dict(zip(unique_urls, contents))
+    return [by_url[url] for url in urls]
@@ -0,0 +1,222 @@
+import asyncio
+import time
+from inspect import cleandoc
+
+import llm
+import logfire
+import sqlite_utils
+
+from config import history_summary_max_words
+from database import LogsDatabase
+from history import MAX_TOKEN_LIMIT
+from llm_executor import llm_executor
+
+# How many batches of turns one update summarises at most, so a long chat's
+# backlog is caught up on over several replies rather than all at once
+SUMMARY_BATCHES_PER_UPDATE = 1
+
+SUMMARY_PROMPT = cleandoc("""
+    You keep a running summary of a conversation between a user and an assistant,
+    covering the turns that no longer fit in the assistant's context.
+
+    The summary so far:
+    <summary>
+    {summary}
+    </summary>
+
+    The turns that follow it:
+    <turns>
+    {turns}
+    </turns>
+
+    Write an updated summary that folds the new turns into the summary so far. Keep
+    facts, decisions, preferences and open questions, and drop small talk. Write at
+    most {max_words} words and reply with the summary only.
+""")
+
+
+def get_conversation_summaries_table(
+    db: sqlite_utils.Database,
+) -> sqlite_utils.db.Table:
+    """
+    A side table holding a running summary of each conversation's older turns,
+    along with the `seq` of the newest response it covers.
+    """
+    summaries = db.table("conversation_summaries", pk="conversation_id")
+    if not summaries.exists():
+        summaries.create(
+            {
+                "conversation_id": str,
+                "summary": str,
+                "summarised_seq": int,
+                "updated_at": float,
+            },
+            pk="conversation_id",
+            if_not_exists=True,
+        )
+
+    return summaries
+
+
+def get_summary(db: sqlite_utils.Database, conversation_id: str) -> dict | None:
+    rows = list(
+        db.query(
+            "select summary, summarised_seq from conversation_summaries "
+            "where conversation_id = ?",
+            [conversation_id],
+        )
+    )
+    return rows[0] if rows else None
+
+
+def summary_fragment(summary: str) -> str:
+    """The summary as a system fragment, sent ahead of the system prompt."""
+    return f"<conversation_summary>\n{summary}\n</conversation_summary>"
+
+
+def _turns_to_summarise(
+    db: sqlite_utils.Database,
+    conversation_id: str,
+    after_seq: int,
+    token_limit: int,
+    batch_tokens: int,
+) -> list[dict]:
+    """
+    The oldest responses after `after_seq` that have fallen out of the newest
+    `token_limit` tokens of the conversation, up to `batch_tokens` of them (but
+    at least one).
+    """
+    rows = []
+    start_tokens = None
+    for row in db.query(
+        """
+        select response_tokens.seq, response_tokens.tokens,
+            response_tokens.cumulative_tokens, responses.prompt, responses.response
+        from response_tokens
+        join responses on responses.id = response_tokens.response_id
+        where response_tokens.conversation_id = :conversation_id
+        and response_tokens.seq > :after_seq
+        and response_tokens.cumulative_tokens - response_tokens.tokens < (
+            select max(cumulative_tokens) - :token_limit from response_tokens
+            where conversation_id = :conversation_id
+        )
+        order by response_tokens.seq
+        """,
+        {
+            "conversation_id": conversation_id,
+            "after_seq": after_seq,
+            "token_limit": token_limit,
+        },
+    ):
+        if start_tokens is None:
+            start_tokens = row["cumulative_tokens"] - row["tokens"]
+        elif row["cumulative_tokens"] - start_tokens > batch_tokens:
+            break
+        rows.append(row)
+    return rows
+
+
+def _format_turns(rows: list[dict]) -> str:
+    return "\n\n".join(
+        f"User: {row['prompt'] or ''}\nAssistant: {row['response'] or ''}"
+        for row in rows
+    )
+
+
+class HistorySummariser:
+    """
+    Rolls the turns of a conversation that no longer fit in the history window
+    into a running summary, so long chats keep their older context at a constant
+    prompt size.
+
+    Summaries are updated in the background after a reply has been sent, never
+    on the request path. Each update only reads the turns that fell out of the
+    window since the last one, at most `batch_tokens` at a time and at most
+    `max_batches` batches per update, and folds them into the stored summary.
+    """
+
+    def __init__(
+        self,
+        logs_db: LogsDatabase,
+        token_limit: int = MAX_TOKEN_LIMIT,
+        batch_tokens: int = MAX_TOKEN_LIMIT,
+        max_words: int = history_summary_max_words,
+        max_batches: int = SUMMARY_BATCHES_PER_UPDATE,
+    ):
+        self.logs_db = logs_db
+        self.token_limit = token_limit
+        self.batch_tokens = batch_tokens
+        self.max_words = max_words
+        self.max_batches = max_batches
+        self._tasks: dict[str, asyncio.Task] = {}
+
+        with logs_db.lock:
+            get_conversation_summaries_table(logs_db.db)
+
+    def schedule(self, conversation_id: str, model: llm.Model) -> None:
+        """Starts updating the conversation's summary, unless already underway."""
+        task = self._tasks.get(conversation_id)
+        if task is not None and not task.done():
+            return
+
+        task = asyncio.create_task(self.update(conversation_id, model))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda task: self._finished(conversation_id, task))
+
+    def _finished(self, conversation_id: str, task: asyncio.Task) -> None:
+        if self._tasks.get(conversation_id) is task:
+            del self._tasks[conversation_id]
+        if not task.cancelled() and task.exception() is not None:
+            logfire.error(
+                f"Summarising conversation {conversation_id} failed: {task.exception()}"
+            )
+
+    async def wait(self) -> None:
+        """Waits for the updates currently running, e.g. before shutting down."""
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def update(self, conversation_id: str, model: llm.Model) -> None:
+        for _ in range(self.max_batches):
+
+            def read():
+                with self.logs_db.lock:
+                    summary = get_summary(self.logs_db.db, conversation_id)
+                    after_seq = summary["summarised_seq"] if summary else 0
+                    rows = _turns_to_summarise(
+                        self.logs_db.db,
+                        conversation_id,
+                        after_seq,
+                        self.token_limit,
+                        self.batch_tokens,
+                    )
+                return summary, rows
+
+            summary, rows = await asyncio.to_thread(read)
+            if not rows:
+                return
+
+            prompt = SUMMARY_PROMPT.format(
+                summary=summary["summary"] if summary else "",
+                turns=_format_turns(rows),
+                max_words=self.max_words,
+            )
+            response = model.prompt(prompt)
+            new_summary = (await llm_executor.run(response.text)).strip()
+
+            def write():
+                with self.logs_db.lock, self.logs_db.db.conn:
+                    self.logs_db.db["conversation_summaries"].upsert(
+                        {
+                            "conversation_id": conversation_id,
+                            "summary": new_summary,
+                            "summarised_seq": rows[-1]["seq"],
+                            "updated_at": time.time(),
+                        },
+                        pk="conversation_id",
+                    )
+
+            await asyncio.to_thread(write)
+            logfire.info(
+                f"Summarised conversation {conversation_id} "
+                f"up to turn {rows[-1]['seq']}"
+            )
@@ -0,0 +1,275 @@
+import html
+import re
+
+# Rendered text is a flat list of tokens: ("text", str) for visible text, and
+# ("open", tag, attrs) / ("close", tag) around it. Keeping the tags separate
+# from the text lets long messages be split anywhere while every part stays
+# valid HTML, by closing the open tags at the split and reopening them after.
+
+_FENCE = re.compile(r"^\s*```\s*([\w+#.-]*)")
+# A closing run of #s needs a space before it, so "# C#" keeps its #
+_HEADING = re.compile(r"^#{1,6}\s+(.*?)(?:\s+#+)?\s*$")
+_BULLET = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+_QUOTE = re.compile(r"^\s*>\s?(.*)$")
+
+_INLINE = re.compile(
+    r"\\(?P<escaped>[^\w\s])"
+    r"|`(?P<code>[^`]+)`"
+    # Link targets may hold balanced parentheses, like Wikipedia URLs
+    r"|\[(?P<label>[^\]]+)\]\((?P<url>(?:[^()\s]|\([^()\s]*\))+)\)"
+    r"|\*\*\*(?P<bold_italic>\S(?:.*?\S)??)\*\*\*"
+    r"|\*\*(?P<bold>\S(?:.*?\S)??)\*\*"
+    r"|(?<!\w)__(?P<bold2>\S(?:.*?\S)??)__(?!\w)"
+    r"|~~(?P<strike>\S(?:.*?\S)??)~~"
+    r"|\|\|(?P<spoiler>\S(?:.*?\S)??)\|\|"
+    r"|\*(?P<italic>[^\s*](?:[^*]*?[^\s*])?)\*"
+    r"|(?<!\w)_(?P<italic2>[^\s_](?:[^_]*?[^\s_])?)_(?!\w)"
+)
+_INLINE_TAGS = {
+    "bold": "b",
+    "bold2": "b",
+    "strike": "s",
+    "spoiler": "tg-spoiler",
+    "italic": "i",
+    "italic2": "i",
+}
+_LINK_SCHEMES = ("http://", "https://", "tg://", "mailto:")
+
+
+def _wrap(tag: str, tokens: list, attrs: str = "") -> list:
+    return [("open", tag, attrs), *tokens, ("close", tag)]
+
+
+def _render_inline(text: str) -> list:
+    tokens = []
+    position = 0
+    for match in _INLINE.finditer(text):
+        if match.start() > position:
+            tokens.append(("text", text[position : match.start()]))
+        position = match.end()
+
+        kind = match.lastgroup
+        if kind == "escaped":
+            tokens.append(("text", match["escaped"]))
+        elif kind == "code":
+            tokens.extend(_wrap("code", [("text", match["code"])]))
+        elif kind == "bold_italic":
+            tokens.extend(_wrap("b", _wrap("i", _render_inline(match[kind]))))
+        elif kind == "url":
+            label = _render_inline(match["label"])
+            if match["url"].startswith(_LINK_SCHEMES):
+                href = html.escape(match["url"], quote=True)
+                tokens.extend(_wrap("a", label, f' href="{href}"'))
+            else:
+                tokens.append(("text", match.group(0)))
+        else:
+            tokens.extend(_wrap(_INLINE_TAGS[kind], _render_inline(match[kind])))
+
+    if position < len(text):
+        tokens.append(("text", text[position:]))
+    return tokens
+
+
+def _render_lines(lines: list[str]) -> list:
+    tokens = []
+    for i, line in enumerate(lines):
+        if i:
+            tokens.append(("text", "\n"))
+        tokens.extend(_render_inline(line))
+    return tokens
+
+
+def _render_blocks(text: str) -> list[list]:
+    """Renders the text as a list of blocks, each a list of tokens."""
+    blocks = []
+    lines = text.split("\n")
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        fence = _FENCE.match(line)
+        if fence:
+            end = i + 1
+            while end < len(lines) and not _FENCE.match(lines[end]):
+                end += 1
+            code = [("text", "\n".join(lines[i + 1 : end]))]
+            language = fence.group(1)
+            if language:
+                code = _wrap("code", code, f' class="language-{html.escape(language)}"')
+            blocks.append(_wrap("pre", code))
+            i = end + 1
+            continue
+
+        if _QUOTE.match(line):
+            end = i
+            while end < len(lines) and _QUOTE.match(lines[end]):
+                end += 1
+            quoted = [_QUOTE.match(quoted).group(1) for quoted in lines[i:end]]
+            blocks.append(_wrap("blockquote", _render_lines(quoted)))
+            i = end
+            continue
+
+        heading = _HEADING.match(line)
+        bullet = _BULLET.match(line)
+        if heading:
+            blocks.append(_wrap("b", _render_inline(heading.group(1))))
+        elif bullet:
+            indent, item = bullet.groups()
+            blocks.append([("text", f"{indent}• "), *_render_inline(item)])
+        else:
+            blocks.append(_render_inline(line))
+        i += 1
+
+    return blocks
+
+
+def _length(text: str) -> int:
+    # Telegram measures message length in UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _tokens_length(tokens: list) -> int:
+    return sum(_length(token[1]) for token in tokens if token[0] == "text")
+
+
+def _fitting_prefix(text: str, room: int) -> int:
+    """The number of characters of `text` that fit in `room` code units."""
+    if _length(text) == len(text):
+        return min(room, len(text))
+    used = 0
+    for index, char in enumerate(text):
+        used += _length(char)
+        if used > room:
+            return index
+    return len(text)
+
+
+def _split_block(block: list, max_length: int) -> list[list]:
+    """Splits one block that is too long, closing and reopening tags at each split."""
+    parts = []
+    part = []
+    length = 0
+    open_tags = []
+
+    for token in block:
+        if token[0] == "open":
+            open_tags.append(token)
+            part.append(token)
+            continue
+        if token[0] == "close":
+            open_tags.pop()
+            part.append(token)
+            continue
+
+        text = token[1]
+        while _length(text) > max_length - length:
+            fitting = _fitting_prefix(text, max_length - length)
+            # Prefer to split at a line break, then at a space
+            split = text.rfind("\n", 0, fitting + 1)
+            if split <= 0:
+                split = text.rfind(" ", 0, fitting + 1)
+            # The line break or space split at isn't carried into the next part
+            separator_length = 1 if split > 0 else 0
+            if split <= 0:
+                split = fitting
+
+            part.append(("text", text[:split]))
+            part.extend(("close", tag[1]) for tag in reversed(open_tags))
+            parts.append(part)
+            part = list(open_tags)
+            length = 0
+            text = text[split + separator_length :]
+
+        part.append(("text", text))
+        length += _length(text)
+
+    parts.append(part)
+    return parts
+
+
+def _drop_empty_tags(tokens: list) -> list:
+    result = []
+    for token in tokens:
+        if token[0] == "close" and result and result[-1][0] == "open":
+            result.pop()
+        elif token[0] != "text" or token[1]:
+            result.append(token)
+    return result
+
+
+def _to_html(tokens: list) -> str:
+    rendered = []
+    for token in _drop_empty_tags(tokens):
+        if token[0] == "text":
+            rendered.append(html.escape(token[1], quote=False))
+        elif token[0] == "open":
+            rendered.append(f"<{token[1]}{token[2]}>")
+        else:
+            rendered.append(f"</{token[1]}>")
+    return "".join(rendered).strip()
+
+
+def render_markdown(text: str) -> str:
+    """Renders model markdown as the HTML subset Telegram accepts."""
+    return render_markdown_parts(text, max_length=None)[0]
+
+
+def render_markdown_parts(text: str, max_length: int | None) -> list[str]:
+    """
+    Renders model markdown as Telegram HTML, split into messages whose visible
+    text is at most `max_length` long. Parts are split between blocks where
+    possible, and code blocks or formatting cut by a split are closed at the
+    end of one part and reopened at the start of the next, so every part
+    parses on its own.
+    """
+    blocks = _render_blocks(text)
+    if max_length is None:
+        return [_to_html(_join(blocks))]
+
+    parts = []
+    part = []
+    length = 0
+    for block in blocks:
+        separator = [("text", "\n")] if part else []
+        block_length = _tokens_length(block) + len(separator)
+        if length + block_length <= max_length:
+            part.extend(separator + block)
+            length += block_length
+            continue
+
+        if part:
+            parts.append(part)
+            part, length = [], 0
+        if _tokens_length(block) <= max_length:
+            part, length = block, _tokens_length(block)
+            continue
+
+        *full_parts, part = _split_block(block, max_length)
+        parts.extend(full_parts)
+        length = _tokens_length(part)
+
+    parts.append(part)
+    # Telegram rejects messages without visible text
+    return [_to_html(part) for part in parts if _visible_text(part).strip()] or [""]
+
+
+def _visible_text(tokens: list) -> str:
+    return "".join(token[1] for token in tokens if token[0] == "text")
+
+
+def open_code_fence(text: str) -> str | None:
+    """The opening line of the code block `text` ends inside of, if any."""
+    fence = None
+    for line in text.split("\n"):
+        if _FENCE.match(line):
+            fence = None if fence else line.strip()
+    return fence
+
+
+def _join(blocks: list[list]) -> list:
+    tokens = []
+    for i, block in enumerate(blocks):
+        if i:
+            tokens.append(("text", "\n"))
+        tokens.extend(block)
+    return tokens
@@ -1,10 +1,16 @@
+import re
+import time
 from functools import wraps
 
 import logfire
+from telegram.error import BadRequest
 
-from config import list_of_admins
+from config import list_of_admins, stream_edit_interval
+from telegram_markdown import open_code_fence, render_markdown, render_markdown_parts
 
 MAX_MESSAGE_LENGTH = 4096
+# Leaves room for the streamed text to grow before rolling over to a new message
+STREAM_ROLLOVER_MARGIN = 96
 SPECIAL_SYMBOLS = "[]()~>#+-=|{}.!''"
 FORMAT_SYMBOLS = "*_~"
 
@@ -23,13 +29,15 @@ def restricted(func):
     return wrapped
 
 
-# Taken from stackoverflow
+# Originally taken from stackoverflow
 # https://stackoverflow.com/questions/40626896/telegram-does-not-escape-some-markdown-characters
-# I'm not bothered to write this tedious code myself
+# and rewritten as a single pass that jumps between markers instead of visiting
+# every character, giving the same output.
 def escape_markdown_v2(input, add_closing_code_block=True):
     if add_closing_code_block and len(input.split("```")) % 2 == 0:
         input += "\n```"
 
+    closing_markers = _ClosingMarkers(input)
     inside_code_block = False
     inside_inline_code = False
 
@@ -38,124 +46,107 @@ def escape_markdown_v2(input, add_closing_code_block=True):
 
     i = 0
     while i < len(input):
-        if code_block_start_at(input, i):
-            inside_code_block = not inside_code_block
-            result.append("```")
-            i += 3
+        if inside_code_block or inside_inline_code:
+            # Only a backtick can end a code block or inline code
+            j = input.find("`", i)
+            end = j if j != -1 else len(input)
+            if inside_code_block:
+                result.append(input[i:end])
+            else:
+                result.append(_INLINE_CODE_ESCAPES.sub(r"\\\g<0>", input[i:end]))
+            if j == -1:
+                break
+
+            if code_block_start_at(input, j):
+                inside_code_block = not inside_code_block
+                result.append("```")
+                i = j + 3
+            elif inside_code_block:
+                result.append("\\`")
+                i = j + 1
+            else:
+                inside_inline_code = False
+                result.append("`")
+                i = j + 1
             continue
 
-        if inside_code_block:
-            i = handle_inside_code_block(input, result, i)
-            i += 1
-            continue
-
-        if inside_inline_code:
-            inside_inline_code = handle_inside_inline_code(input, result, i)
+        match = _OUTSIDE_MARKERS.search(input, i)
+        if match is None:
+            result.append(input[i:])
+            break
+        j = match.start()
+        result.append(input[i:j])
+        symbol = input[j]
+
+        if symbol == "`":
+            if code_block_start_at(input, j):
+                inside_code_block = True
+                result.append("```")
+                i = j + 3
+                continue
+            if closing_markers.has_closing(j, "`"):
+                inside_inline_code = True
+                result.append("`")
+            else:
+                result.append("\\`")
+            i = j + 1
+        elif symbol in "*_":
+            if input.startswith(symbol * 2, j):
+                symbol *= 2
+            if inside_blocks[symbol]:
+                inside_blocks[symbol] = False
+                result.append(symbol)
+            elif closing_markers.has_closing(j, symbol):
+                inside_blocks[symbol] = True
+                result.append(symbol)
+            else:
+                result.append("\\" + symbol)
+            i = j + len(symbol)
         else:
-            i, inside_inline_code, inside_blocks = handle_outside_inline_code(
-                input, result, i, inside_blocks
-            )
-
-        i += 1
+            result.append("\\" + symbol)
+            i = j + 1
 
     return "".join(result)
 
 
-def handle_inside_code_block(input, sb, index):
-    if special_symbol_at(input, index):
-        sb.append(input[index])
-    elif inline_code_at(input, index):
-        sb.append("\\`")
-    elif format_symbol_at(input, index):
-        sb.append(input[index])
-    elif code_block_start_at(input, index):
-        sb.append("\\`\\`\\`")
-        index += 2
-    else:
-        sb.append(input[index])
-    return index
-
-
-def handle_inside_inline_code(input, sb, index):
-    inside_inline_code = True
-    is_special = special_symbol_at(input, index)
-    is_format = format_symbol_at(input, index)
-    if is_special or is_format:
-        sb.append("\\")
-        sb.append(input[index])
-    elif code_block_start_at(input, index):
-        sb.append("\\`\\`\\`")
-        index += 2
-    elif inline_code_at(input, index):
-        inside_inline_code = False
-        sb.append("`")
-    else:
-        sb.append(input[index])
-    return inside_inline_code
-
-
-def handle_outside_inline_code(input, sb, index, inside_blocks):
-    inside_inline_code = False
-    if input[index : index + 2] == "**":
-        if inside_blocks["**"]:
-            sb.append("**")
-            inside_blocks["**"] = False
-            index += 1
-        elif inline_code_has_closing_in_line(input, index, "**"):
-            sb.append("**")
-            inside_blocks["**"] = True
-            index += 1
-        else:
-            sb.append("\\**")
-            index += 1
-    elif input[index : index + 2] == "__":
-        if inside_blocks["__"]:
-            sb.append("__")
-            inside_blocks["__"] = False
-            index += 1
-        elif inline_code_has_closing_in_line(input, index, "__"):
-            sb.append("__")
-            inside_blocks["__"] = True
-            index += 1
-        else:
-            sb.append("\\__")
-            index += 1
-    elif input[index] == "*":
-        if inside_blocks["*"]:
-            sb.append("*")
-            inside_blocks["*"] = False
-        elif inline_code_has_closing_in_line(input, index, "*"):
-            sb.append("*")
-            inside_blocks["*"] = True
-        else:
-            sb.append("\\*")
-    elif input[index] == "_":
-        if inside_blocks["_"]:
-            sb.append("_")
-            inside_blocks["_"] = False
-        elif inline_code_has_closing_in_line(input, index, "_"):
-            sb.append("_")
-            inside_blocks["_"] = True
-        else:
-            sb.append("\\_")
-    elif special_symbol_at(input, index):
-        sb.append("\\")
-        sb.append(input[index])
-    elif format_symbol_at(input, index):
-        sb.append("\\")
-        sb.append(input[index])
-    elif inline_code_at(input, index):
-        if inline_code_has_closing_in_line(input, index, "`"):
-            inside_inline_code = True
-            sb.append("`")
-        else:
-            sb.append("\\`")
-    elif code_block_start_at(input, index):
-        sb.append("\\`\\`\\`")
-        index += 2
-    else:
-        sb.append(input[index])
-    return index, inside_inline_code, inside_blocks
+_OUTSIDE_MARKERS = re.compile("[" + re.escape(SPECIAL_SYMBOLS + FORMAT_SYMBOLS + "`") + "]")
+_INLINE_CODE_ESCAPES = re.compile("[" + re.escape(SPECIAL_SYMBOLS + FORMAT_SYMBOLS) + "]")
+
+
+class _ClosingMarkers:
+    """
+    Answers `has_closing_symbol_in_line` for a whole text in linear time. The
+    positions of each marker and of the newlines are found once, and since the
+    text is escaped front to back, each lookup only moves a cursor forward.
+    """
+
+    def __init__(self, input):
+        self.input = input
+        self.positions = {}
+        self.cursors = {}
+
+    def _next(self, marker, start, symbol):
+        positions = self.positions.get(marker)
+        if positions is None:
+            pattern = "(?=" + re.escape(marker) + ")"
+            positions = [m.start() for m in re.finditer(pattern, self.input)]
+            self.positions[marker] = positions
+
+        # Each symbol searches from its own offset, so each gets its own cursors
+        key = (marker, symbol)
+        cursor = self.cursors.get(key, 0)
+        while cursor < len(positions) and positions[cursor] < start:
+            cursor += 1
+        self.cursors[key] = cursor
+        return positions[cursor] if cursor < len(positions) else -1
+
+    def has_closing(self, index, symbol):
+        search_start = index + len(symbol)
+        possible_closing_index = self._next(symbol, search_start, symbol)
+        if possible_closing_index == -1 or possible_closing_index == index + 1:
+            return False
+        end_of_line = self._next("\n", search_start, symbol)
+        return end_of_line == -1 or possible_closing_index <= end_of_line
 
 
 def code_block_start_at(input, index):
@@ -246,3 +237,121 @@ async def send_long_message(update, context, text: str, parse_mode=None):
             await first_message.reply_text(
                 f"(Part {i}/{len(parts)})\n\n{part}", parse_mode=parse_mode
             )
+
+
+async def send_markdown_message(update, text: str, placeholder=None):
+    """
+    Renders model markdown to Telegram HTML and sends it, split into as many
+    parts as needed. Each part is rendered to parse on its own, so it's sent
+    exactly once.
+
+    Args:
+        update: Telegram update object
+        text: The markdown to send
+        placeholder: A message to replace with the text if it fits in one part
+
+    Returns:
+        The first message sent
+    """
+    parts = render_markdown_parts(text, MAX_MESSAGE_LENGTH)
+    if len(parts) > 1:
+        # Leave room for the "(Part X/Y)" prefix
+        prefix_length = len(f"(Part {len(parts)}/{len(parts)})\n\n") + 1
+        parts = render_markdown_parts(text, MAX_MESSAGE_LENGTH - prefix_length)
+        parts = [
+            f"(Part {i}/{len(parts)})\n\n{part}" for i, part in enumerate(parts, 1)
+        ]
+
+    if placeholder is not None:
+        if len(parts) == 1:
+            return await placeholder.edit_text(parts[0], parse_mode="HTML")
+        await placeholder.delete()
+
+    # The first part replies to the original, the rest reply to the first part
+    first_message = await update.message.reply_text(parts[0], parse_mode="HTML")
+    for part in parts[1:]:
+        await first_message.reply_text(part, parse_mode="HTML")
+    return first_message
+
+
+async def _edit_streamed_message(message, text: str, final: bool = False) -> None:
+    if not text.strip():
+        return
+
+    # Partial markdown is shown as it is, and only the final edit is formatted
+    rendered = render_markdown(text) if final else ""
+    try:
+        if rendered:
+            await message.edit_text(rendered, parse_mode="HTML")
+        else:
+            await message.edit_text(text)
+    except BadRequest as e:
+        # Editing a message to its current text is rejected by Telegram
+        if "not modified" not in str(e):
+            raise
+
+
+async def stream_message(
+    update, placeholder, chunks, edit_interval: float = stream_edit_interval
+) -> str:
+    """
+    Streams text into `placeholder` by editing it in place as chunks arrive.
+    Edits are throttled to one per `edit_interval` seconds to stay clear of
+    Telegram's flood limits, and once the text nears the maximum message
+    length it rolls over into a new reply.
+
+    Args:
+        update: Telegram update object
+        placeholder: The message to edit, usually a "..." reply
+        chunks: An async iterable of text chunks
+        edit_interval: The minimum number of seconds between edits
+
+    Returns:
+        The full streamed text
+    """
+    message = placeholder
+    full_text = ""
+    current_text = ""
+    shown_text = ""
+    last_edit = time.monotonic()
+
+    async for chunk in chunks:
+        full_text += chunk
+        current_text += chunk
+
+        while len(current_text) > MAX_MESSAGE_LENGTH - STREAM_ROLLOVER_MARGIN:
+            split_index = current_text.rfind(
+                "\n", 0, MAX_MESSAGE_LENGTH - STREAM_ROLLOVER_MARGIN
+            )
+            if split_index <= 0:
+                split_index = MAX_MESSAGE_LENGTH - STREAM_ROLLOVER_MARGIN
+
+            await _edit_streamed_message(
+                message, current_text[:split_index], final=True
+            )
+            # A code block cut by the rollover carries on in the next message
+            fence = open_code_fence(current_text[:split_index])
+            if fence:
+                remainder = current_text[split_index:].lstrip("\n")
+                current_text = f"{fence}\n{remainder}"
+            else:
+                current_text = current_text[split_index:].lstrip()
+            message = await update.message.reply_text("...")
+            shown_text = ""
+            last_edit = time.monotonic()
+
+        if (
+            time.monotonic() - last_edit >= edit_interval
+            and current_text != shown_text
+        ):
+            await _edit_streamed_message(message, current_text)
+            shown_text = current_text
+            last_edit = time.monotonic()
+
+    if current_text.strip():
+        await _edit_streamed_message(message, current_text, final=True)
+    elif message is not placeholder or not full_text.strip():
+        # Nothing left for the last message to show
+        await message.delete()
+
+    return full_text
@@ -0,0 +1,59 @@
+import json
+from urllib.parse import parse_qsl
+
+from stub_server import StubHTTPServer
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Test", "username": "test_bot"}
+
+
+class FakeTelegramServer(StubHTTPServer):
+    """
+    A local stand-in for the Telegram Bot API, so the bot can be run end to end
+    offline. Point the bot at `base_url`; each API call is recorded in `calls`
+    as (method, params).
+    """
+
+    def __init__(self):
+        super().__init__(self._respond_to_api_call)
+        self.calls: list[tuple[str, dict]] = []
+        self._message_id = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/bot"
+
+    def calls_to(self, method: str) -> list[dict]:
+        return [params for name, params in self.calls if name == method]
+
+    def _respond_to_api_call(self, request):
+        method = request.path.rsplit("/", 1)[-1]
+        params = {
+            key: _decode(value)
+            for key, value in parse_qsl(request.body.decode("utf-8"))
+        }
+        self.calls.append((method, params))
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": 0,
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+
+        body = json.dumps({"ok": True, "result": result})
+        return 200, {"Content-Type": "application/json"}, body
+
+
+def _decode(value: str):
+    # Nested parameters like reply_markup are sent JSON encoded
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
@@ -0,0 +1,141 @@
+import json
+from typing import Optional
+
+import llm
+from llm.plugins import pm
+
+from history import record_response_tokens
+
+
+class EchoModel(llm.Model):
+    """A model that answers by echoing the prompt back, for tests that need real responses."""
+
+    model_id = "echo"
+    attachment_types = {"image/jpeg"}
+
+    def execute(self, prompt, stream, response, conversation):
+        yield f"echo: {prompt.prompt}"
+
+
+class DocumentEchoModel(EchoModel):
+    """An echo model that also takes PDF documents."""
+
+    model_id = "echo-documents"
+    attachment_types = {"image/jpeg", "application/pdf"}
+
+
+class CachingEchoModel(EchoModel):
+    """
+    An echo model that accounts for prompt caching the way Anthropic does. Its
+    request is built like llm-anthropic 0.17's for text prompts: messages hold
+    lists of text blocks, and the `cache` option only adds a breakpoint to the
+    last message when the prompt has no message of its own. The longest prefix
+    of the request seen before, up to its last breakpoint, is read from the
+    cache, each word counting as a token, and the prefixes up to every
+    breakpoint are written to it.
+    """
+
+    model_id = "caching-echo"
+
+    class Options(llm.Options):
+        cache: Optional[bool] = None
+
+    def __init__(self):
+        self.cached_prefixes = set()
+
+    def build_kwargs(self, prompt, conversation):
+        messages = []
+        for response in conversation.responses if conversation else []:
+            if response.prompt.prompt:
+                messages.append(_text_message("user", response.prompt.prompt))
+            if response.text_or_raise():
+                messages.append(_text_message("assistant", response.text_or_raise()))
+        if prompt.prompt:
+            messages.append(_text_message("user", prompt.prompt))
+        elif prompt.options.cache and messages:
+            messages[-1]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+
+        kwargs = {"messages": messages}
+        if prompt.system:
+            kwargs["system"] = prompt.system
+        return kwargs
+
+    def execute(self, prompt, stream, response, conversation):
+        kwargs = self.build_kwargs(prompt, conversation)
+        system = kwargs.get("system", [])
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        blocks = [
+            *system,
+            *(
+                dict(block, role=message["role"])
+                for message in kwargs["messages"]
+                for block in message["content"]
+            ),
+        ]
+
+        def key(end):
+            prefix = [dict(block, cache_control=None) for block in blocks[:end]]
+            return json.dumps(prefix, sort_keys=True)
+
+        def tokens(end):
+            return sum(len(block["text"].split()) for block in blocks[:end])
+
+        # Prefixes end after a block with a breakpoint, and only reach the last one
+        breakpoints = [
+            i + 1 for i, block in enumerate(blocks) if "cache_control" in block
+        ]
+        written = max(breakpoints, default=0)
+        read = max(
+            (end for end in range(1, written + 1) if key(end) in self.cached_prefixes),
+            default=0,
+        )
+        for end in breakpoints:
+            self.cached_prefixes.add(key(end))
+
+        yield f"echo: {prompt.prompt}"
+
+        details = None
+        if prompt.options.cache:
+            details = {
+                "cache_read_input_tokens": tokens(read),
+                "cache_creation_input_tokens": max(0, tokens(written) - tokens(read)),
+            }
+        response.set_usage(
+            input=tokens(len(blocks)) - tokens(read), output=1, details=details
+        )
+
+
+def _text_message(role: str, text: str) -> dict:
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+class _StubModelsPlugin:
+    @llm.hookimpl
+    def register_models(self, register):
+        register(EchoModel())
+        register(DocumentEchoModel())
+        register(CachingEchoModel())
+
+
+def register_stub_models() -> None:
+    """Registers the stub models with llm so `llm.get_model` can find them."""
+    if not pm.has_plugin("stub-models"):
+        pm.register(_StubModelsPlugin(), name="stub-models")
+
+
+def log_conversation(
+    db, model, prompts: list[str], attachments: dict | None = None
+) -> llm.Conversation:
+    """
+    Runs each prompt through `model` in one conversation and logs it to `db`.
+    `attachments` maps the index of a prompt to the attachments sent with it.
+    """
+    attachments = attachments or {}
+    conversation = model.conversation()
+    for i, prompt in enumerate(prompts):
+        response = conversation.prompt(prompt, attachments=attachments.get(i, []))
+        response.text()
+        response.log_to_db(db)
+        record_response_tokens(db, conversation.id, response)
+    return conversation
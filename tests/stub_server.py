@@ -0,0 +1,74 @@
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class StubRequest:
+    method: str
+    path: str
+    query: dict
+    headers: dict
+    body: bytes
+    client_port: int
+
+
+class StubHTTPServer:
+    """
+    A local HTTP/1.1 server for tests that talk to real HTTP clients.
+    `respond` is called with each StubRequest and returns (status, headers, body).
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests: list[StubRequest] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                parsed = urlparse(self.path)
+                request = StubRequest(
+                    method=self.command,
+                    path=parsed.path,
+                    query={k: v[0] for k, v in parse_qs(parsed.query).items()},
+                    headers=dict(self.headers),
+                    body=self.rfile.read(length) if length else b"",
+                    client_port=self.client_address[1],
+                )
+                stub.requests.append(request)
+                status, headers, body = stub.respond(request)
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import app
 
@@ -7,40 +7,100 @@ import app
 class TestApp(unittest.TestCase):
     """Tests for the main application module."""
 
+    @patch("app.HistorySummariser")
+    @patch("app.AttachmentStore")
+    @patch("app.OutboundRateLimiter")
+    @patch("app.SQLitePersistence")
+    @patch("app.ChatOrderedUpdateProcessor")
+    @patch("app.ScrapeCache")
+    @patch("app.LogsDatabase")
     @patch("app.ApplicationBuilder")
     @patch("app.CommandHandler")
     @patch("app.MessageHandler")
     @patch("app.filters")
     @patch("app.BOT_TOKEN", "test_token")
     def test_main_initializes_app(
-        self, mock_filters, mock_message_handler, mock_command_handler, mock_app_builder
+        self,
+        mock_filters,
+        mock_message_handler,
+        mock_command_handler,
+        mock_app_builder,
+        mock_logs_database,
+        mock_scrape_cache,
+        mock_chat_ordered_update_processor,
+        mock_sqlite_persistence,
+        mock_outbound_rate_limiter,
+        mock_attachment_store,
+        mock_history_summariser,
     ):
         """Test that the main function initializes the application correctly."""
         # Setup mock application
         mock_app = MagicMock()
-        mock_app_builder.return_value.token.return_value.build.return_value = mock_app
+        mock_builder = mock_app_builder.return_value.token.return_value
+        mock_rate_limiter = (
+            mock_builder.concurrent_updates.return_value.persistence.return_value.rate_limiter
+        )
+        mock_build = mock_rate_limiter.return_value.post_shutdown.return_value.build
+        mock_build.return_value = mock_app
 
         # Call the main function
         app.main()
 
         # Assert ApplicationBuilder was called with the correct token
         mock_app_builder.return_value.token.assert_called_once_with("test_token")
-        mock_app_builder.return_value.token.return_value.build.assert_called_once()
+        mock_build.assert_called_once()
+
+        # Assert outbound requests go through the rate limiter
+        mock_rate_limiter.assert_called_once_with(mock_outbound_rate_limiter.return_value)
+        mock_rate_limiter.return_value.post_shutdown.assert_called_once_with(
+            app.post_shutdown
+        )
+
+        # Assert updates are processed per chat in order, with a global cap
+        mock_builder.concurrent_updates.assert_called_once_with(
+            mock_chat_ordered_update_processor.return_value
+        )
+        mock_chat_ordered_update_processor.assert_called_once_with(
+            app.max_concurrent_updates, app.max_pending_updates
+        )
+
+        # Assert the logs database was opened once and shared with the handlers
+        mock_logs_database.assert_called_once_with()
+        mock_sqlite_persistence.assert_called_once_with(
+            mock_logs_database.return_value,
+            update_interval=app.persistence_update_interval,
+        )
+        mock_app.bot_data.__setitem__.assert_any_call(
+            "logs_db", mock_logs_database.return_value
+        )
+        mock_app.bot_data.__setitem__.assert_any_call(
+            "scrape_cache", mock_scrape_cache.return_value
+        )
+        mock_app.bot_data.__setitem__.assert_any_call(
+            "attachment_store", mock_attachment_store.return_value
+        )
+        mock_history_summariser.assert_called_once_with(mock_logs_database.return_value)
+        mock_app.bot_data.__setitem__.assert_any_call(
+            "history_summariser", mock_history_summariser.return_value
+        )
 
         # Assert that all command handlers were added
         self.assertEqual(
-            mock_app.add_handler.call_count, 11
-        )  # 10 commands + 1 message handler
+            mock_app.add_handler.call_count, 15
+        )  # 13 commands + 1 message handler
 
         # Verify specific handlers were added
         mock_command_handler.assert_any_call("_user_id", app.user_id)
         mock_command_handler.assert_any_call("_chat_id", app.chat_id)
+        mock_command_handler.assert_any_call("_conversation_id", app.conversation_id)
         mock_command_handler.assert_any_call("private", app.process_private_message)
         mock_command_handler.assert_any_call("system_prompt", app.system_prompt)
         mock_command_handler.assert_any_call("set_system_prompt", app.set_system_prompt)
         mock_command_handler.assert_any_call("models", app.list_models)
         mock_command_handler.assert_any_call("model", app.model)
         mock_command_handler.assert_any_call("set_model", app.set_model)
+        mock_command_handler.assert_any_call("aux_model", app.aux_model)
+        mock_command_handler.assert_any_call("set_aux_model", app.set_aux_model)
         mock_command_handler.assert_any_call("attachment_types", app.attachment_types)
         mock_command_handler.assert_any_call("help", app.help)
 
@@ -55,6 +115,82 @@ class TestApp(unittest.TestCase):
         # Verify app.run_polling was called
         mock_app.run_polling.assert_called_once()
 
+    @patch("app.HistorySummariser")
+    @patch("app.AttachmentStore")
+    @patch("app.SQLitePersistence")
+    @patch("app.ScrapeCache")
+    @patch("app.LogsDatabase")
+    @patch("app.ApplicationBuilder")
+    @patch("app.webhook_url", "https://bot.example.com")
+    @patch("app.BOT_TOKEN", "test_token")
+    def test_main_runs_webhook_when_url_set(
+        self,
+        mock_app_builder,
+        mock_logs_database,
+        mock_scrape_cache,
+        mock_sqlite_persistence,
+        mock_attachment_store,
+        mock_history_summariser,
+    ):
+        """Test that a webhook is served instead of polling when a URL is configured."""
+        mock_builder = mock_app_builder.return_value.token.return_value
+        mock_rate_limiter = (
+            mock_builder.concurrent_updates.return_value.persistence.return_value.rate_limiter
+        )
+        mock_build = mock_rate_limiter.return_value.post_shutdown.return_value.build
+        mock_app = mock_build.return_value
+
+        app.main()
+
+        mock_app.run_polling.assert_not_called()
+        mock_app.run_webhook.assert_called_once()
+        options = mock_app.run_webhook.call_args.kwargs
+        self.assertEqual(options["webhook_url"], "https://bot.example.com/telegram")
+        self.assertEqual(options["url_path"], "telegram")
+
+    def test_webhook_options(self):
+        """Test the webhook URL, path and secret token passed to the server."""
+        options = app.webhook_options(
+            url="https://bot.example.com/",
+            listen="127.0.0.1",
+            port=8443,
+            path="/hook/",
+            secret_token="secret",
+        )
+
+        self.assertEqual(options["listen"], "127.0.0.1")
+        self.assertEqual(options["port"], 8443)
+        self.assertEqual(options["url_path"], "hook")
+        self.assertEqual(options["webhook_url"], "https://bot.example.com/hook")
+        self.assertEqual(options["secret_token"], "secret")
+
+    def test_webhook_secret_token_is_generated(self):
+        """Test that a random secret token is used when none is configured."""
+        first = app.webhook_options(url="https://bot.example.com", secret_token=None)
+        second = app.webhook_options(url="https://bot.example.com", secret_token=None)
+
+        self.assertGreaterEqual(len(first["secret_token"]), 32)
+        self.assertNotEqual(first["secret_token"], second["secret_token"])
+
+
+class TestPostShutdown(unittest.IsolatedAsyncioTestCase):
+    """Tests for finishing background work on exit."""
+
+    @patch("app.llm_executor")
+    async def test_background_work_is_awaited(self, mock_llm_executor):
+        """Test that summaries and indexing finish before the workers stop."""
+        mock_app = MagicMock()
+        mock_app.bot_data = {
+            "history_summariser": MagicMock(wait=AsyncMock()),
+            "turn_retriever": MagicMock(wait=AsyncMock()),
+        }
+
+        await app.post_shutdown(mock_app)
+
+        mock_app.bot_data["history_summariser"].wait.assert_awaited_once()
+        mock_app.bot_data["turn_retriever"].wait.assert_awaited_once()
+        mock_llm_executor.shutdown.assert_called_once_with()
+
 
 if __name__ == "__main__":
     unittest.main()
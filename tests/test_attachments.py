@@ -0,0 +1,182 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+from attachments import AttachmentStore, AttachmentTooLarge
+from stub_server import StubHTTPServer
+
+
+def telegram_file(
+    file_path: str, file_size: int | None = None, unique_id: str = "unique"
+) -> MagicMock:
+    """A stand-in for a PhotoSize, Document, etc. whose file lives at `file_path`."""
+    attachment = MagicMock()
+    attachment.file_size = file_size
+    attachment.file_unique_id = unique_id
+    attachment.get_file = AsyncMock(return_value=MagicMock(file_path=file_path))
+    return attachment
+
+
+class TestAttachmentStore(unittest.IsolatedAsyncioTestCase):
+    """Tests for streaming attachment downloads."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp_dir.name)
+        self.body = os.urandom(200_000)
+        self.server = StubHTTPServer(lambda request: (200, {}, self.body))
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        self.tmp_dir.cleanup()
+
+    def stored_files(self) -> list[str]:
+        return sorted(path.name for path in self.directory.iterdir())
+
+    async def test_small_files_stay_in_memory(self):
+        """Test that files up to the spool size are passed as content."""
+        store = AttachmentStore(self.directory, spool_bytes=len(self.body))
+
+        attachment = await store.download(
+            telegram_file(f"{self.server.url}/photo.jpg"), "image/jpeg"
+        )
+
+        self.assertEqual(attachment.content, self.body)
+        self.assertIsNone(attachment.path)
+        self.assertEqual(attachment.type, "image/jpeg")
+        self.assertEqual(attachment.id(), hashlib.sha256(self.body).hexdigest())
+        self.assertEqual(self.stored_files(), [])
+
+    async def test_large_files_are_streamed_to_disk(self):
+        """Test that larger files are written to a file named by their hash."""
+        store = AttachmentStore(self.directory, spool_bytes=50_000)
+
+        attachment = await store.download(
+            telegram_file(f"{self.server.url}/document.pdf"), "application/pdf"
+        )
+
+        digest = hashlib.sha256(self.body).hexdigest()
+        self.assertIsNone(attachment.content)
+        self.assertEqual(attachment.path, str(self.directory / f"{digest}.pdf"))
+        self.assertEqual(Path(attachment.path).read_bytes(), self.body)
+        self.assertEqual(attachment.id(), digest)
+        self.assertEqual(self.stored_files(), [f"{digest}.pdf"])
+
+    async def test_reported_size_is_checked_before_downloading(self):
+        """Test that files Telegram reports as too large are never fetched."""
+        store = AttachmentStore(self.directory, max_bytes=1000)
+        attachment = telegram_file(f"{self.server.url}/video.mp4", file_size=1001)
+
+        self.assertTrue(store.is_too_large(1001))
+        self.assertFalse(store.is_too_large(None))
+        with self.assertRaises(AttachmentTooLarge):
+            await store.download(attachment, "video/mp4")
+        attachment.get_file.assert_not_called()
+
+    async def test_oversized_downloads_are_aborted(self):
+        """Test that a download growing past the limit is stopped and cleaned up."""
+        store = AttachmentStore(self.directory, max_bytes=100_000, spool_bytes=10_000)
+
+        with self.assertRaises(AttachmentTooLarge):
+            attachment = telegram_file(f"{self.server.url}/a.mp3")
+            await store.download(attachment, "audio/mpeg")
+        self.assertEqual(self.stored_files(), [])
+
+    async def test_local_files_are_used_in_place(self):
+        """Test that files from a local Bot API server are not copied."""
+        store = AttachmentStore(self.directory)
+        path = self.directory / "voice.ogg"
+        path.write_bytes(self.body)
+
+        attachment = await store.download(telegram_file(str(path)), "audio/ogg")
+
+        self.assertEqual(attachment.path, str(path))
+        self.assertEqual(attachment.id(), hashlib.sha256(self.body).hexdigest())
+        self.assertEqual(self.server.requests, [])
+
+    async def test_files_sent_again_are_not_downloaded(self):
+        """Test that a cached file_unique_id skips Telegram entirely."""
+        store = AttachmentStore(self.directory, spool_bytes=50_000)
+        first = await store.download(
+            telegram_file(f"{self.server.url}/a.pdf"), "application/pdf"
+        )
+
+        again = telegram_file(f"{self.server.url}/a.pdf")
+        self.assertIs(await store.download(again, "application/pdf"), first)
+        again.get_file.assert_not_called()
+        self.assertEqual(len(self.server.requests), 1)
+
+    async def test_identical_content_is_shared(self):
+        """Test that different files with the same content share one attachment."""
+        store = AttachmentStore(self.directory, spool_bytes=50_000)
+        first = await store.download(
+            telegram_file(f"{self.server.url}/a.pdf", unique_id="a"), "application/pdf"
+        )
+        second = await store.download(
+            telegram_file(f"{self.server.url}/b.pdf", unique_id="b"), "application/pdf"
+        )
+
+        self.assertIs(second, first)
+        self.assertEqual(store.cached_bytes, len(self.body))
+        self.assertEqual(len(self.stored_files()), 1)
+
+    async def test_least_recently_used_files_are_evicted(self):
+        """Test that the byte budget evicts the oldest files but keeps them on disk."""
+        store = AttachmentStore(
+            self.directory, spool_bytes=50_000, cache_max_bytes=2 * len(self.body)
+        )
+        bodies = {name: os.urandom(len(self.body)) for name in "abc"}
+        self.server.respond = lambda request: (200, {}, bodies[request.path[1]])
+
+        async def download(name):
+            attachment = telegram_file(f"{self.server.url}/{name}", unique_id=name)
+            return await store.download(attachment, "image/jpeg")
+
+        a = await download("a")
+        await download("b")
+        # Using "a" again makes "b" the least recently used
+        self.assertIs(store.get("a"), a)
+        await download("c")
+
+        self.assertIsNotNone(store.get("a"))
+        self.assertIsNone(store.get("b"))
+        self.assertIsNotNone(store.get("c"))
+        self.assertEqual(store.cached_bytes, 2 * len(self.body))
+        # logs.db still points at the evicted file
+        self.assertEqual(len(self.stored_files()), 3)
+
+    async def test_removed_files_are_downloaded_again(self):
+        """Test that a cached attachment whose file is gone isn't returned."""
+        store = AttachmentStore(self.directory, spool_bytes=50_000)
+        first = await store.download(
+            telegram_file(f"{self.server.url}/a.pdf"), "application/pdf"
+        )
+        os.unlink(first.path)
+
+        again = await store.download(
+            telegram_file(f"{self.server.url}/a.pdf"), "application/pdf"
+        )
+
+        self.assertEqual(Path(again.path).read_bytes(), self.body)
+        self.assertEqual(store.cached_bytes, len(self.body))
+        self.assertEqual(len(self.server.requests), 2)
+
+    async def test_files_from_previous_runs_are_kept(self):
+        """Test that logged files survive a restart and partial downloads don't."""
+        store = AttachmentStore(self.directory, spool_bytes=50_000)
+        attachment = await store.download(
+            telegram_file(f"{self.server.url}/a.pdf"), "application/pdf"
+        )
+        (self.directory / "tmp1234.part").write_bytes(b"partial")
+
+        AttachmentStore(self.directory)
+
+        self.assertEqual(self.stored_files(), [Path(attachment.path).name])
+        self.assertEqual(attachment.content_bytes(), self.body)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import patch
+
+import llm
+
+from aux_model import get_aux_model, query_rewrite_cache, rewrite_search_query
+from stub_models import register_stub_models
+
+
+class TestGetAuxModel(unittest.TestCase):
+    """Tests for choosing the auxiliary model of a chat."""
+
+    def setUp(self):
+        register_stub_models()
+        self.fallback = llm.get_model("echo")
+
+    def test_chat_override(self):
+        """Test that a chat's own auxiliary model is used."""
+        self.assertEqual(
+            get_aux_model({"aux_model_id": "echo"}, self.fallback).model_id, "echo"
+        )
+
+    def test_falls_back_when_not_installed(self):
+        """Test that the chat's main model is used if the auxiliary one isn't installed."""
+        model = get_aux_model({"aux_model_id": "not-installed"}, self.fallback)
+        self.assertIs(model, self.fallback)
+
+
+class TestRewriteSearchQuery(unittest.IsolatedAsyncioTestCase):
+    """Tests for the memoised search query rewriting."""
+
+    def setUp(self):
+        register_stub_models()
+        query_rewrite_cache.clear()
+        self.model = llm.get_model("echo")
+
+    async def test_rewrites_with_model(self):
+        """Test that the query comes from the model's answer."""
+        query = await rewrite_search_query(self.model, "latest python release")
+        self.assertTrue(query.startswith("echo: Based on this message: 'latest python release'"))
+
+    async def test_memoises_equivalent_messages(self):
+        """Test that the model is only asked once for equivalent messages."""
+        with patch.object(self.model, "prompt", wraps=self.model.prompt) as prompt:
+            first = await rewrite_search_query(self.model, "Latest Python release?")
+            second = await rewrite_search_query(self.model, "latest  python release")
+
+        self.assertEqual(first, second)
+        prompt.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+
+from cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    """Tests for the LRU cache with expiring entries."""
+
+    def test_get_and_set(self):
+        """Test that stored values are returned and missing keys give the default."""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("b", 2), 2)
+        self.assertIn("a", cache)
+
+    def test_evicts_least_recently_used(self):
+        """Test that the least recently used entry is evicted when full."""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(len(cache), 2)
+
+    @patch("cache.time.monotonic")
+    def test_entries_expire(self, mock_monotonic):
+        """Test that entries are dropped once their TTL has passed."""
+        mock_monotonic.return_value = 100
+        cache = TTLCache(max_size=2, ttl=10)
+        cache.set("a", 1)
+
+        mock_monotonic.return_value = 109
+        self.assertEqual(cache.get("a"), 1)
+
+        mock_monotonic.return_value = 111
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from llm.migrations import migrate
+
+from database import LogsDatabase, get_chat_conversation_id, set_chat_conversation_id
+
+
+class TestLogsDatabase(unittest.TestCase):
+    """Tests for the shared logs database service."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "logs.db"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_opening_migrates_and_creates_tables(self):
+        """Test that opening the database migrates it and creates the bot's tables."""
+        logs_db = LogsDatabase(self.path)
+
+        table_names = logs_db.db.table_names()
+        self.assertIn("responses", table_names)
+        self.assertIn("chat_conversations", table_names)
+        logs_db.close()
+
+    @patch("database.migrate", wraps=migrate)
+    def test_migrate_runs_once(self, mock_migrate):
+        """Test that migrations run once when opening, not on every lookup."""
+        logs_db = LogsDatabase(self.path)
+
+        for chat_id in range(5):
+            get_chat_conversation_id(logs_db.chat_conversations, chat_id)
+
+        mock_migrate.assert_called_once_with(logs_db.db)
+        logs_db.close()
+
+    def test_chat_conversation_id_round_trip(self):
+        """Test that a chat's conversation id can be stored and read back."""
+        logs_db = LogsDatabase(self.path)
+
+        self.assertIsNone(get_chat_conversation_id(logs_db.chat_conversations, 123))
+        set_chat_conversation_id(logs_db.chat_conversations, "conv123", 123)
+
+        self.assertEqual(
+            get_chat_conversation_id(logs_db.chat_conversations, 123), "conv123"
+        )
+        logs_db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
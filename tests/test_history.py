@@ -0,0 +1,249 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import llm
+
+from database import LogsDatabase
+from history import (
+    backfill_response_attachment_types,
+    backfill_response_tokens,
+    estimate_tokens_from_text,
+    executed_responses,
+    load_conversation_tail,
+    record_response_tokens,
+)
+from stub_models import log_conversation, register_stub_models
+
+
+class TestEstimateTokens(unittest.TestCase):
+    """Tests for the token estimate heuristic."""
+
+    def test_estimate_tokens_from_text(self):
+        """Test that tokens are estimated with the token counter."""
+        self.assertEqual(estimate_tokens_from_text(""), 0)
+        self.assertEqual(estimate_tokens_from_text("one two three four"), 4)
+
+
+class TestExecutedResponses(unittest.TestCase):
+    """Tests for reading the responses a prompt or chain has executed."""
+
+    def setUp(self):
+        register_stub_models()
+        self.model = llm.get_model("echo")
+
+    def test_chains_are_not_run_again(self):
+        """Test that a finished chain's responses are returned without re-running it."""
+        chain = self.model.conversation().chain("Hi")
+        chain.text()
+
+        with patch.object(self.model, "execute") as mock_execute:
+            responses = executed_responses(chain)
+
+        mock_execute.assert_not_called()
+        self.assertEqual([r.text() for r in responses], ["echo: Hi"])
+
+    def test_single_responses(self):
+        """Test that a plain response is returned on its own."""
+        response = self.model.prompt("Hi")
+
+        self.assertEqual(executed_responses(response), [response])
+
+
+class TestLoadConversationTail(unittest.TestCase):
+    """Tests for loading only the newest responses of a conversation."""
+
+    def setUp(self):
+        register_stub_models()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logs_db = LogsDatabase(Path(self.tmp_dir.name) / "logs.db")
+        self.model = llm.get_model("echo")
+        self.pair_tokens = estimate_tokens_from_text(
+            "message number 0 here"
+        ) + estimate_tokens_from_text("echo: message number 0 here")
+        self.conversation = log_conversation(
+            self.logs_db.db,
+            self.model,
+            [f"message number {i} here" for i in range(100)],
+        )
+
+    def tearDown(self):
+        self.logs_db.close()
+        self.tmp_dir.cleanup()
+
+    def test_loads_newest_responses_in_chronological_order(self):
+        """Test that the newest responses are returned oldest first."""
+        conversation = load_conversation_tail(
+            self.logs_db.db, self.conversation.id, self.model, token_limit=self.pair_tokens * 5
+        )
+
+        self.assertEqual(conversation.id, self.conversation.id)
+        self.assertIs(conversation.model, self.model)
+        self.assertEqual(
+            [response.prompt.prompt for response in conversation.responses],
+            [f"message number {i} here" for i in range(95, 100)],
+        )
+
+    def test_max_messages_limits_responses(self):
+        """Test that only the last `max_messages` responses are considered."""
+        conversation = load_conversation_tail(
+            self.logs_db.db, self.conversation.id, self.model, max_messages=3
+        )
+
+        self.assertEqual(
+            [response.prompt.prompt for response in conversation.responses],
+            [f"message number {i} here" for i in range(97, 100)],
+        )
+
+    def test_max_messages_zero_loads_nothing(self):
+        """Test that `@last0` clears the history."""
+        conversation = load_conversation_tail(
+            self.logs_db.db, self.conversation.id, self.model, max_messages=0
+        )
+
+        self.assertEqual(conversation.responses, [])
+
+    def test_only_responses_in_the_window_are_read(self):
+        """Test that responses outside the token budget aren't inflated at all."""
+        with patch("history.llm.Response.from_row", wraps=llm.Response.from_row) as (
+            mock_from_row
+        ):
+            load_conversation_tail(
+                self.logs_db.db, self.conversation.id, self.model, token_limit=self.pair_tokens * 5
+            )
+
+        self.assertEqual(mock_from_row.call_count, 5)
+
+    def test_budget_stops_at_first_response_that_does_not_fit(self):
+        """Test that a partial budget doesn't pull in part of an older response."""
+        conversation = load_conversation_tail(
+            self.logs_db.db, self.conversation.id, self.model, token_limit=self.pair_tokens * 3 - 1
+        )
+
+        self.assertEqual(len(conversation.responses), 2)
+
+    def log_document_conversation(self) -> llm.Conversation:
+        """Logs a conversation whose 98th message came with a PDF."""
+        pdf = llm.Attachment(type="application/pdf", content=b"%PDF-1.4")
+        return log_conversation(
+            self.logs_db.db,
+            llm.get_model("echo-documents"),
+            [f"message number {i} here" for i in range(100)],
+            attachments={98: [pdf]},
+        )
+
+    def test_incompatible_responses_free_up_budget(self):
+        """Test that skipped responses let older ones into the window."""
+        document_conversation = self.log_document_conversation()
+
+        conversation = load_conversation_tail(
+            self.logs_db.db, document_conversation.id, self.model, token_limit=self.pair_tokens * 3
+        )
+
+        self.assertEqual(
+            [response.prompt.prompt for response in conversation.responses],
+            [f"message number {i} here" for i in (96, 97, 99)],
+        )
+
+    def test_incompatible_responses_are_not_read(self):
+        """Test that responses with unsupported attachments are never inflated."""
+        document_conversation = self.log_document_conversation()
+
+        with patch("history.llm.Response.from_row", wraps=llm.Response.from_row) as (
+            mock_from_row
+        ):
+            conversation = load_conversation_tail(
+                self.logs_db.db,
+                document_conversation.id,
+                self.model,
+                token_limit=self.pair_tokens * 3,
+            )
+
+        self.assertEqual(mock_from_row.call_count, 3)
+        self.assertEqual(len(conversation.responses), 3)
+
+    def test_compatible_attachments_are_kept(self):
+        """Test that a model taking the attachment type keeps the response."""
+        document_conversation = self.log_document_conversation()
+
+        conversation = load_conversation_tail(
+            self.logs_db.db,
+            document_conversation.id,
+            llm.get_model("echo-documents"),
+            token_limit=self.pair_tokens * 3,
+        )
+
+        self.assertEqual(
+            [response.prompt.prompt for response in conversation.responses],
+            [f"message number {i} here" for i in (97, 98, 99)],
+        )
+
+    def test_backfill_response_attachment_types(self):
+        """Test that attachment types are copied from llm's own tables."""
+        document_conversation = self.log_document_conversation()
+        self.logs_db.response_attachment_types.delete_where()
+
+        backfill_response_attachment_types(self.logs_db.db)
+
+        rows = list(self.logs_db.response_attachment_types.rows)
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "response_id": document_conversation.responses[98].id,
+                    "mime_type": "application/pdf",
+                }
+            ],
+        )
+
+    def test_running_token_totals_are_recorded(self):
+        """Test that each logged response gets its position and running total."""
+        rows = list(
+            self.logs_db.response_tokens.rows_where(
+                "conversation_id = ?", [self.conversation.id], order_by="seq"
+            )
+        )
+
+        self.assertEqual(len(rows), 100)
+        self.assertEqual([row["seq"] for row in rows[:3]], [1, 2, 3])
+        self.assertEqual(
+            [row["cumulative_tokens"] for row in rows[:3]],
+            [self.pair_tokens, self.pair_tokens * 2, self.pair_tokens * 3],
+        )
+
+    def test_backfill_response_tokens(self):
+        """Test that responses logged before the side table existed get estimates."""
+        self.logs_db.db["response_tokens"].delete_where()
+
+        backfill_response_tokens(self.logs_db.db)
+
+        conversation = load_conversation_tail(
+            self.logs_db.db, self.conversation.id, self.model, token_limit=self.pair_tokens * 5
+        )
+        self.assertEqual(len(conversation.responses), 5)
+        self.assertEqual(
+            conversation.responses[-1].prompt.prompt, "message number 99 here"
+        )
+
+    def test_backfilled_estimates_include_fragments(self):
+        """Test that backfilled prompts are counted with their fragments, like live ones."""
+        page = " ".join(f"scraped word {i}" for i in range(500))
+        response = self.model.conversation().prompt(
+            "Summarise this page", fragments=[page, "<search>results</search>"]
+        )
+        response.text()
+        response.log_to_db(self.logs_db.db)
+        record_response_tokens(self.logs_db.db, "live", response)
+        live_tokens = self.logs_db.db["response_tokens"].get(response.id)["tokens"]
+        self.logs_db.db["response_tokens"].delete_where()
+
+        backfill_response_tokens(self.logs_db.db)
+
+        backfilled = self.logs_db.db["response_tokens"].get(response.id)
+        self.assertEqual(backfilled["tokens"], live_tokens)
+        self.assertGreater(backfilled["tokens"], estimate_tokens_from_text(page))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import unittest
+
+from llm_executor import LLMCallTimeout, LLMExecutor, LLMExecutorBusy
+
+
+class TestLLMExecutor(unittest.IsolatedAsyncioTestCase):
+    """Tests for the bounded executor that runs blocking LLM calls."""
+
+    async def test_run_returns_result(self):
+        """Test that the result of the blocking call is returned."""
+        executor = LLMExecutor(max_workers=2, max_queue_depth=2, timeout=5)
+
+        result = await executor.run(lambda x: x * 2, 21)
+
+        self.assertEqual(result, 42)
+        self.assertEqual(executor.pending, 0)
+
+    async def test_run_does_not_block_event_loop(self):
+        """Test that other coroutines keep running while a call is blocked."""
+        executor = LLMExecutor(max_workers=1, max_queue_depth=0, timeout=5)
+        release = threading.Event()
+
+        call = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+
+        # The event loop is still free to run this while the call is blocked
+        self.assertFalse(call.done())
+        release.set()
+        self.assertTrue(await call)
+
+    async def test_run_rejects_when_queue_is_full(self):
+        """Test that calls beyond the workers and queue depth are rejected."""
+        executor = LLMExecutor(max_workers=1, max_queue_depth=1, timeout=5)
+        release = threading.Event()
+
+        running = asyncio.create_task(executor.run(release.wait))
+        queued = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0.01)
+
+        with self.assertRaises(LLMExecutorBusy):
+            await executor.run(release.wait)
+
+        release.set()
+        await asyncio.gather(running, queued)
+        self.assertEqual(executor.pending, 0)
+
+    async def test_run_times_out(self):
+        """Test that a slow call raises LLMCallTimeout and frees its slot once done."""
+        executor = LLMExecutor(max_workers=1, max_queue_depth=0, timeout=0.05)
+        release = threading.Event()
+
+        with self.assertRaises(LLMCallTimeout):
+            await executor.run(release.wait)
+
+        # The worker is still busy until the blocking call returns
+        self.assertEqual(executor.pending, 1)
+        release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(executor.pending, 0)
+
+    async def test_run_propagates_exceptions(self):
+        """Test that exceptions raised by the call are re-raised to the caller."""
+        executor = LLMExecutor(max_workers=1, max_queue_depth=0, timeout=5)
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            await executor.run(fail)
+        self.assertEqual(executor.pending, 0)
+
+    async def test_stream_yields_items_in_order(self):
+        """Test that a blocking iterable is streamed back item by item."""
+        executor = LLMExecutor(max_workers=1, max_queue_depth=0, timeout=5)
+
+        chunks = [chunk async for chunk in executor.stream(iter(["a", "b", "c"]))]
+
+        self.assertEqual(chunks, ["a", "b", "c"])
+        await asyncio.sleep(0.01)
+        self.assertEqual(executor.pending, 0)
+
+    async def test_stream_propagates_exceptions(self):
+        """Test that an exception raised mid-stream reaches the consumer."""
+        executor = LLMExecutor(max_workers=1, max_queue_depth=0, timeout=5)
+
+        def chunks():
+            yield "a"
+            raise ValueError("boom")
+
+        received = []
+        with self.assertRaises(ValueError):
+            async for chunk in executor.stream(chunks()):
+                received.append(chunk)
+        self.assertEqual(received, ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from attachments import AttachmentStore
+from database import LogsDatabase, get_chat_conversation_id
+from handlers import process_message, process_private_message
+from response_cache import ResponseCache, response_cache_key
+from stub_models import register_stub_models
+
+USER_ID = 42
+CHAT_ID = 4242
+
+
+def make_message(text: str) -> MagicMock:
+    """A Telegram message with text only, whose replies can be edited and deleted."""
+    message = MagicMock()
+    message.text = text
+    message.caption = None
+    message.photo = []
+    message.document = None
+    message.video = None
+    message.audio = None
+    message.voice = None
+    message.replies = []
+
+    async def reply_text(*args, **kwargs):
+        reply = MagicMock()
+        reply.edit_text = AsyncMock()
+        reply.delete = AsyncMock()
+        reply.reply_text = AsyncMock()
+        message.replies.append(reply)
+        return reply
+
+    message.reply_text = AsyncMock(side_effect=reply_text)
+    return message
+
+
+class HandlerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Runs handlers against the echo model and a temporary logs database."""
+
+    def setUp(self):
+        register_stub_models()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        directory = Path(self.tmp_dir.name)
+        self.logs_db = LogsDatabase(directory / "logs.db")
+        self.response_cache = ResponseCache(directory / "response_cache.db")
+
+        self.context = MagicMock()
+        self.context.args = []
+        self.context.user_data = {"model_id": "echo"}
+        self.context.chat_data = {"system_prompt": "Be brief."}
+        self.context.bot_data = {
+            "logs_db": self.logs_db,
+            "scrape_cache": MagicMock(),
+            "attachment_store": AttachmentStore(directory / "attachments"),
+            "history_summariser": MagicMock(),
+            "turn_retriever": MagicMock(),
+            "response_cache": self.response_cache,
+        }
+
+        patcher = patch("telegram_utils.list_of_admins", [str(USER_ID)])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.response_cache.close()
+        self.logs_db.close()
+        self.tmp_dir.cleanup()
+
+    def make_update(self, text: str) -> MagicMock:
+        update = MagicMock()
+        update.effective_user.id = USER_ID
+        update.effective_chat.id = CHAT_ID
+        update.message = make_message(text)
+        return update
+
+
+class TestProcessMessage(HandlerTestCase):
+    """Tests for answering messages in a chat's conversation."""
+
+    @patch("handlers.stream_responses", False)
+    async def test_reply_is_sent_and_logged(self):
+        """Test that the answer replaces the placeholder and the turn is logged."""
+        update = self.make_update("Hello there")
+
+        await process_message(update, self.context)
+
+        placeholder = update.message.replies[0]
+        placeholder.delete.assert_awaited_once()
+        update.message.reply_text.assert_awaited_with(
+            "echo: Hello there", parse_mode="HTML"
+        )
+
+        conversation_id = get_chat_conversation_id(
+            self.logs_db.chat_conversations, CHAT_ID
+        )
+        self.assertIsNotNone(conversation_id)
+        [row] = self.logs_db.db.query(
+            "select responses.prompt, responses.system, response_tokens.tokens "
+            "from responses join response_tokens "
+            "on response_tokens.response_id = responses.id "
+            "where responses.conversation_id = ?",
+            [conversation_id],
+        )
+        self.assertEqual(row["prompt"], "Hello there")
+        self.assertEqual(row["system"], "Be brief.")
+        self.assertGreater(row["tokens"], 0)
+
+    @patch("handlers.stream_responses", False)
+    async def test_replies_continue_the_chat_conversation(self):
+        """Test that a second message is answered in the same conversation."""
+        await process_message(self.make_update("First"), self.context)
+        await process_message(self.make_update("Second"), self.context)
+
+        conversation_id = get_chat_conversation_id(
+            self.logs_db.chat_conversations, CHAT_ID
+        )
+        prompts = [
+            row["prompt"]
+            for row in self.logs_db.db.query(
+                "select prompt from responses where conversation_id = ? "
+                "order by datetime_utc",
+                [conversation_id],
+            )
+        ]
+        self.assertEqual(prompts, ["First", "Second"])
+
+    @patch("handlers.stream_responses", True)
+    async def test_streamed_reply_is_edited_into_the_placeholder(self):
+        """Test that a streamed answer ends up in the "..." placeholder."""
+        update = self.make_update("Hello there")
+
+        await process_message(update, self.context)
+
+        [placeholder] = update.message.replies
+        self.assertEqual(placeholder.edit_text.call_args.args[0], "echo: Hello there")
+        self.assertIsNotNone(
+            get_chat_conversation_id(self.logs_db.chat_conversations, CHAT_ID)
+        )
+
+
+@patch("handlers.stream_responses", False)
+@patch("handlers.response_cache_enabled", True)
+class TestProcessPrivateMessage(HandlerTestCase):
+    """Tests for answering `/private` messages outside the conversation."""
+
+    async def test_reply_is_cached(self):
+        """Test that the answer is sent without logging it, and then cached."""
+        self.context.args = ["Hello", "there"]
+        update = self.make_update("/private Hello there")
+
+        await process_private_message(update, self.context)
+
+        [placeholder] = update.message.replies
+        self.assertEqual(placeholder.edit_text.call_args.args[0], "echo: Hello there")
+        self.assertEqual(self.logs_db.db["responses"].count, 0)
+        key = response_cache_key("echo", "Be brief.", "Hello there")
+        self.assertEqual(self.response_cache.get(key), "echo: Hello there")
+
+    async def test_cache_hit_skips_the_model(self):
+        """Test that a repeated message is answered from the cache."""
+        key = response_cache_key("echo", "Be brief.", "Hello there")
+        self.response_cache.set(key, "echo", "From the cache")
+        self.context.args = ["Hello", "there"]
+        update = self.make_update("/private Hello there")
+
+        with patch("handlers.model_catalog.get_model") as mock_get_model:
+            await process_private_message(update, self.context)
+
+        mock_get_model.assert_not_called()
+        update.message.reply_text.assert_awaited_once_with(
+            "From the cache", parse_mode="HTML"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+
+import llm
+from llm.plugins import pm
+
+from model_catalog import ModelCatalog, PrefixTrie
+from stub_models import register_stub_models
+
+
+class TestPrefixTrie(unittest.TestCase):
+    """Tests for longest prefix lookups."""
+
+    def test_most_specific_prefix_wins(self):
+        """Test that the longest matching prefix is used."""
+        trie = PrefixTrie({"gpt-4": "Dec 23", "gpt-4o": "Oct 23"})
+
+        self.assertEqual(trie.longest_prefix_value("gpt-4o-mini"), "Oct 23")
+        self.assertEqual(trie.longest_prefix_value("gpt-4-turbo"), "Dec 23")
+        self.assertEqual(trie.longest_prefix_value("gpt-4"), "Dec 23")
+
+    def test_unmatched_keys_get_the_default(self):
+        """Test that keys without a matching prefix return the default."""
+        trie = PrefixTrie({"gpt-4": "Dec 23"})
+
+        self.assertIsNone(trie.longest_prefix_value("gpt-3.5-turbo"))
+        self.assertEqual(trie.longest_prefix_value("o1", "Unknown"), "Unknown")
+
+
+class _ExtraModelsPlugin:
+    @llm.hookimpl
+    def register_models(self, register):
+        register(ExtraModel())
+
+
+class ExtraModel(llm.Model):
+    model_id = "extra"
+
+    def execute(self, prompt, stream, response, conversation):
+        yield "extra"
+
+
+class TestModelCatalog(unittest.TestCase):
+    """Tests for the cached catalog of installed models."""
+
+    def setUp(self):
+        register_stub_models()
+        self.catalog = ModelCatalog(cutoffs={"echo": "Jan 25"})
+
+    def tearDown(self):
+        if pm.has_plugin("extra-models"):
+            pm.unregister(name="extra-models")
+
+    def test_models_are_resolved_once(self):
+        """Test that the same model object is returned without asking llm again."""
+        model = self.catalog.get_model("echo")
+
+        with patch("model_catalog.llm.get_models_with_aliases") as mock_get_models:
+            self.assertIs(self.catalog.get_model("echo"), model)
+        mock_get_models.assert_not_called()
+        self.assertIn("echo", self.catalog)
+
+    def test_unknown_models_raise(self):
+        """Test that unknown ids raise the same error as llm.get_model."""
+        self.assertNotIn("no-such-model", self.catalog)
+        with self.assertRaises(llm.UnknownModelError):
+            self.catalog.get_model("no-such-model")
+
+    def test_models_text_is_cached(self):
+        """Test that the /models list is rendered once, with cutoff dates."""
+        text = self.catalog.models_text()
+
+        self.assertIn("• `echo` (knowledge cutoff: Jan 25)", text)
+        self.assertIn("• `echo-documents` (knowledge cutoff: Jan 25)", text)
+        with patch.object(self.catalog, "cutoff") as mock_cutoff:
+            self.assertIs(self.catalog.models_text(), text)
+        mock_cutoff.assert_not_called()
+
+    def test_new_plugins_are_picked_up(self):
+        """Test that the catalog is read again when plugins change."""
+        self.assertNotIn("extra", self.catalog)
+
+        pm.register(_ExtraModelsPlugin(), name="extra-models")
+
+        self.assertIn("extra", self.catalog)
+        self.assertIn("`extra`", self.catalog.models_text())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from database import LogsDatabase
+from persistence import SQLitePersistence
+
+
+class TestSQLitePersistence(unittest.IsolatedAsyncioTestCase):
+    """Tests for persisting user and chat data in the logs database."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logs_db = LogsDatabase(Path(self.tmp_dir.name) / "logs.db")
+
+    def tearDown(self):
+        self.logs_db.close()
+        self.tmp_dir.cleanup()
+
+    async def test_data_survives_restart(self):
+        """Test that saved user and chat data is loaded by a new instance."""
+        persistence = SQLitePersistence(self.logs_db)
+        await persistence.update_user_data(1, {"model_id": "echo"})
+        await persistence.update_chat_data(-100, {"system_prompt": "Be brief"})
+        await persistence.flush()
+
+        restarted = SQLitePersistence(self.logs_db)
+        self.assertEqual(await restarted.get_user_data(), {1: {"model_id": "echo"}})
+        self.assertEqual(
+            await restarted.get_chat_data(), {-100: {"system_prompt": "Be brief"}}
+        )
+
+    async def test_updates_are_batched_in_one_transaction(self):
+        """Test that entries staged together are written in a single write."""
+        persistence = SQLitePersistence(self.logs_db)
+
+        with patch.object(persistence, "_write", wraps=persistence._write) as write:
+            await asyncio.gather(
+                *(persistence.update_user_data(i, {"model_id": "echo"}) for i in range(5)),
+                persistence.update_chat_data(1, {"system_prompt": ""}),
+            )
+            await persistence.flush()
+
+        write.assert_called_once()
+        self.assertEqual(len(write.call_args.args[0]), 6)
+
+    async def test_unchanged_data_is_not_written(self):
+        """Test that entries equal to what's stored aren't written again."""
+        persistence = SQLitePersistence(self.logs_db)
+        await persistence.update_user_data(1, {"model_id": "echo"})
+        await persistence.flush()
+
+        with patch.object(persistence, "_write") as write:
+            await persistence.update_user_data(1, {"model_id": "echo"})
+            await persistence.flush()
+
+        write.assert_not_called()
+
+    async def test_dropped_data_is_deleted(self):
+        """Test that dropping a chat's data removes it from the database."""
+        persistence = SQLitePersistence(self.logs_db)
+        await persistence.update_chat_data(1, {"system_prompt": "Be brief"})
+        await persistence.flush()
+
+        await persistence.drop_chat_data(1)
+        await persistence.flush()
+
+        self.assertEqual(await SQLitePersistence(self.logs_db).get_chat_data(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+
+from pipeline import Pipeline
+
+
+class TestPipeline(unittest.IsolatedAsyncioTestCase):
+    """Tests for the pre-processing stage graph."""
+
+    async def test_independent_stages_run_concurrently(self):
+        """Test that stages without dependencies overlap instead of running in turn."""
+        running = 0
+        peak = 0
+
+        async def stage():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return True
+
+        pipeline = Pipeline()
+        for name in ("scrape", "web_search", "attachments"):
+            pipeline.add(name, stage)
+
+        results = await pipeline.run()
+
+        self.assertEqual(peak, 3)
+        self.assertEqual(
+            results, {"scrape": True, "web_search": True, "attachments": True}
+        )
+
+    async def test_dependency_results_are_passed(self):
+        """Test that a stage waits for its dependencies and receives their results."""
+        order = []
+
+        async def conversation():
+            await asyncio.sleep(0.01)
+            order.append("conversation")
+            return "history"
+
+        async def think(conversation):
+            order.append("think")
+            return f"thought about {conversation}"
+
+        pipeline = Pipeline()
+        pipeline.add("think", think, after=("conversation",))
+        pipeline.add("conversation", conversation)
+
+        results = await pipeline.run()
+
+        self.assertEqual(order, ["conversation", "think"])
+        self.assertEqual(results["think"], "thought about history")
+
+    async def test_failure_cancels_other_stages(self):
+        """Test that a failing stage cancels the rest and its error is raised."""
+        cancelled = asyncio.Event()
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def fail():
+            raise RuntimeError("scrape failed")
+
+        pipeline = Pipeline()
+        pipeline.add("slow", slow)
+        pipeline.add("fail", fail)
+
+        with self.assertRaisesRegex(RuntimeError, "scrape failed"):
+            await pipeline.run()
+        self.assertTrue(cancelled.is_set())
+
+    async def test_invalid_graphs_are_rejected(self):
+        """Test that unknown and cyclic dependencies raise before anything runs."""
+
+        async def stage(**kwargs):
+            return None
+
+        unknown = Pipeline()
+        unknown.add("think", stage, after=("conversation",))
+        with self.assertRaisesRegex(ValueError, "unknown stage"):
+            await unknown.run()
+
+        cyclic = Pipeline()
+        cyclic.add("a", stage, after=("b",))
+        cyclic.add("b", stage, after=("a",))
+        with self.assertRaisesRegex(ValueError, "depends on itself"):
+            await cyclic.run()
+
+        duplicate = Pipeline()
+        duplicate.add("a", stage)
+        with self.assertRaises(ValueError):
+            duplicate.add("a", stage)
+
+
+if __name__ == "__main__":
+    unittest.main()
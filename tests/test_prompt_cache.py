@@ -0,0 +1,187 @@
+import unittest
+
+import llm
+
+from history import executed_responses
+from prompt_cache import PromptCacheStats, prompt_cache_options
+from stub_models import CachingEchoModel, register_stub_models
+
+SYSTEM_PROMPT = "You are a helpful assistant who answers in a few words."
+
+
+class TestPromptCacheOptions(unittest.TestCase):
+    """Tests for turning on prompt caching per model."""
+
+    def setUp(self):
+        register_stub_models()
+
+    def test_disabled_or_unsupported_models_get_no_options(self):
+        """Test that caching is only asked for when enabled and supported."""
+        self.assertEqual(prompt_cache_options(CachingEchoModel(), enabled=False), {})
+        self.assertEqual(prompt_cache_options(llm.get_model("echo"), enabled=True), {})
+        self.assertEqual(
+            prompt_cache_options(CachingEchoModel(), enabled=True), {"cache": True}
+        )
+
+    def test_system_prompt_gets_a_breakpoint(self):
+        """Test that the system prompt is sent as a cacheable block."""
+        model = CachingEchoModel()
+        options = prompt_cache_options(model, enabled=True)
+        # Asking again doesn't wrap the request builder twice
+        build_kwargs = model.build_kwargs
+        prompt_cache_options(model, enabled=True)
+        self.assertIs(model.build_kwargs, build_kwargs)
+
+        prompt = model.prompt("Hi", system=SYSTEM_PROMPT, **options).prompt
+        kwargs = model.build_kwargs(prompt, None)
+
+        self.assertEqual(
+            kwargs["system"],
+            [
+                {
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+        )
+        self.assertNotIn("cache_control", kwargs["messages"][-1]["content"][-1])
+
+    def test_previous_turn_gets_a_breakpoint(self):
+        """Test that the history is marked up to the end of the previous turn."""
+        model = CachingEchoModel()
+        options = prompt_cache_options(model, enabled=True)
+        conversation = model.conversation()
+        conversation.prompt("What is the capital of France?", **options).text()
+
+        prompt = model.prompt("And of Germany?", **options).prompt
+        messages = model.build_kwargs(prompt, conversation)["messages"]
+
+        self.assertEqual([message["role"] for message in messages], ["user", "assistant", "user"])
+        self.assertEqual(
+            messages[1]["content"][-1]["cache_control"], {"type": "ephemeral"}
+        )
+        self.assertNotIn("cache_control", messages[0]["content"][-1])
+        self.assertNotIn("cache_control", messages[2]["content"][-1])
+
+    def test_system_fragments_follow_the_breakpoint(self):
+        """Test that per-turn system fragments are left out of the cached prefix."""
+        model = CachingEchoModel()
+        options = prompt_cache_options(model, enabled=True)
+
+        prompt = model.prompt(
+            "Hi",
+            system=SYSTEM_PROMPT,
+            system_fragments=["<conversation_summary>\nEarlier turns\n</conversation_summary>"],
+            **options,
+        ).prompt
+        system = model.build_kwargs(prompt, None)["system"]
+
+        self.assertEqual(
+            system,
+            [
+                {
+                    "type": "text",
+                    "text": SYSTEM_PROMPT,
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {
+                    "type": "text",
+                    "text": "<conversation_summary>\nEarlier turns\n</conversation_summary>",
+                },
+            ],
+        )
+
+
+class TestPromptCacheAccounting(unittest.TestCase):
+    """Tests for caching conversations against a model that simulates the cache."""
+
+    def setUp(self):
+        self.model = CachingEchoModel()
+        self.stats = PromptCacheStats()
+
+    def chat(self, conversation, prompt, enabled=True):
+        response = conversation.chain(
+            prompt,
+            system=SYSTEM_PROMPT,
+            options=prompt_cache_options(self.model, enabled=enabled),
+        )
+        response.text()
+        responses = executed_responses(response)
+        for r in responses:
+            self.stats.record(r)
+        return responses[-1]
+
+    def test_history_is_read_from_the_cache(self):
+        """Test that each turn reads the history up to the previous turn from the cache."""
+        conversation = self.model.conversation()
+
+        first = self.chat(conversation, "What is the capital of France?")
+        second = self.chat(conversation, "And of Germany?")
+        third = self.chat(conversation, "And of Spain?")
+
+        self.assertEqual(first.token_details["cache_read_input_tokens"], 0)
+        # Only the system prompt is cached by the first turn
+        self.assertEqual(
+            first.token_details["cache_creation_input_tokens"],
+            len(SYSTEM_PROMPT.split()),
+        )
+        self.assertEqual(
+            second.token_details["cache_read_input_tokens"],
+            len(SYSTEM_PROMPT.split()),
+        )
+        # The second turn wrote the system prompt and the first turn, which the
+        # third reads back
+        self.assertGreater(second.token_details["cache_creation_input_tokens"], 0)
+        self.assertEqual(
+            third.token_details["cache_read_input_tokens"],
+            len(SYSTEM_PROMPT.split())
+            + second.token_details["cache_creation_input_tokens"],
+        )
+        self.assertEqual((self.stats.hits, self.stats.misses), (2, 1))
+        self.assertEqual(
+            self.stats.read_tokens,
+            second.token_details["cache_read_input_tokens"]
+            + third.token_details["cache_read_input_tokens"],
+        )
+
+    def test_summary_changes_keep_the_system_prompt_cached(self):
+        """Test that a new system fragment every turn doesn't break the cache."""
+        conversation = self.model.conversation()
+        options = prompt_cache_options(self.model, enabled=True)
+
+        for summary in ["The user likes maps.", "The user likes maps and rivers."]:
+            response = conversation.prompt(
+                "Tell me more",
+                system=SYSTEM_PROMPT,
+                system_fragments=[summary],
+                **options,
+            )
+            response.text()
+
+        self.assertEqual(
+            response.token_details["cache_read_input_tokens"],
+            len(SYSTEM_PROMPT.split()),
+        )
+
+    def test_system_prompt_is_cached_when_history_changes(self):
+        """Test that another history still reads the system prompt from the cache."""
+        self.chat(self.model.conversation(), "What is the capital of France?")
+
+        response = self.chat(self.model.conversation(), "Something else entirely")
+
+        self.assertEqual(
+            response.token_details["cache_read_input_tokens"],
+            len(SYSTEM_PROMPT.split()),
+        )
+
+    def test_nothing_is_recorded_without_caching(self):
+        """Test that responses without cache accounting aren't counted."""
+        response = self.chat(self.model.conversation(), "Hi", enabled=False)
+
+        self.assertIsNone(response.token_details)
+        self.assertEqual((self.stats.hits, self.stats.misses), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from prompt_presets import PromptPresets, get_system_prompt
+
+
+class TestPromptPresets(unittest.TestCase):
+    """Tests for the system prompt preset registry."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmp_dir.name)
+        self.write("study_mode", "  Help the user study.\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name: str, text: str, mtime: int | None = None) -> None:
+        path = self.directory / f"{name}.md"
+        path.write_text(text, encoding="utf-8")
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+
+    def test_presets_are_loaded_at_startup(self):
+        """Test that every preset is read once and looked up from memory."""
+        (self.directory / "notes.txt").write_text("Not a preset")
+        presets = PromptPresets(self.directory)
+
+        with patch("builtins.open") as mock_open:
+            self.assertEqual(presets.get("study_mode"), "Help the user study.")
+            self.assertIsNone(presets.get("missing"))
+            self.assertEqual(presets.names(), ["study_mode"])
+        mock_open.assert_not_called()
+
+    def test_changed_files_are_read_again(self):
+        """Test that edited, added and deleted presets are picked up."""
+        presets = PromptPresets(self.directory, check_interval=0)
+
+        self.write("study_mode", "Quiz the user.", mtime=1_000_000_000)
+        self.write("brief", "Be brief.")
+        self.assertEqual(presets.get("study_mode"), "Quiz the user.")
+        self.assertEqual(presets.names(), ["brief", "study_mode"])
+
+        (self.directory / "brief.md").unlink()
+        self.assertNotIn("brief", presets)
+
+    def test_files_are_checked_at_most_once_per_interval(self):
+        """Test that the directory isn't scanned again within the interval."""
+        presets = PromptPresets(self.directory, check_interval=60)
+        self.write("brief", "Be brief.")
+
+        self.assertNotIn("brief", presets)
+
+        presets.reload()
+        self.assertIn("brief", presets)
+
+    def test_preset_text_is_shared(self):
+        """Test that lookups return the same interned text object."""
+        presets = PromptPresets(self.directory, check_interval=0)
+        other = PromptPresets(self.directory)
+
+        self.assertIs(presets.get("study_mode"), presets.get("study_mode"))
+        self.assertIs(presets.get("study_mode"), other.get("study_mode"))
+
+    def test_missing_directory_has_no_presets(self):
+        """Test that a missing directory is treated as empty."""
+        presets = PromptPresets(self.directory / "missing")
+
+        self.assertEqual(presets.names(), [])
+
+
+class TestGetSystemPrompt(unittest.TestCase):
+    """Tests for reading a chat's system prompt."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        directory = Path(self.tmp_dir.name)
+        (directory / "brief.md").write_text("Be brief.")
+        self.presets = PromptPresets(directory)
+        patcher = patch("prompt_presets.prompt_presets", self.presets)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_presets_are_read_by_name(self):
+        """Test that chats using a preset get its text from the registry."""
+        chat_data = {"system_prompt_preset": "brief"}
+
+        self.assertIs(get_system_prompt(chat_data), self.presets.get("brief"))
+
+    def test_custom_prompts_are_read_from_chat_data(self):
+        """Test that custom and missing prompts fall back to the chat's own."""
+        self.assertEqual(get_system_prompt({"system_prompt": "Be kind."}), "Be kind.")
+        self.assertEqual(get_system_prompt({"system_prompt_preset": "gone"}), "")
+        self.assertEqual(get_system_prompt({}), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock
+
+from telegram.error import RetryAfter
+
+from rate_limiter import OutboundRateLimiter, TokenBucket
+
+
+def _limiter(**overrides) -> OutboundRateLimiter:
+    options = {
+        "global_rate": 1000,
+        "chat_rate": 20,
+        "group_rate": 10,
+        "chat_burst": 1,
+        "max_retries": 2,
+    }
+    options.update(overrides)
+    return OutboundRateLimiter(**options)
+
+
+async def _send(limiter, callback, chat_id=1):
+    return await limiter.process_request(
+        callback, (), {}, "sendMessage", {"chat_id": chat_id}, None
+    )
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    """Tests for the token bucket."""
+
+    async def test_burst_then_rate(self):
+        """Test that a full bucket allows a burst and then paces at its rate."""
+        bucket = TokenBucket(rate=50, capacity=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        self.assertLess(time.monotonic() - started, 0.01)
+
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 5 / 50 - 0.01)
+
+    async def test_pause(self):
+        """Test that a paused bucket waits out the pause."""
+        bucket = TokenBucket(rate=1000, capacity=10)
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+
+
+class TestOutboundRateLimiter(unittest.IsolatedAsyncioTestCase):
+    """Tests for pacing requests to Telegram."""
+
+    async def test_chats_are_paced_independently(self):
+        """Test that a busy chat is paced while other chats aren't held up."""
+        limiter = _limiter()
+        callback = AsyncMock(return_value=True)
+
+        started = time.monotonic()
+        await asyncio.gather(*(_send(limiter, callback, chat_id=1) for _ in range(3)))
+        busy_chat = time.monotonic() - started
+
+        started = time.monotonic()
+        await asyncio.gather(
+            *(_send(limiter, callback, chat_id=chat_id) for chat_id in range(10, 20))
+        )
+        many_chats = time.monotonic() - started
+
+        self.assertGreaterEqual(busy_chat, 2 / 20 - 0.01)
+        self.assertLess(many_chats, 0.05)
+        self.assertEqual(callback.await_count, 13)
+
+    async def test_groups_use_group_rate(self):
+        """Test that group chats are paced with the slower group rate."""
+        limiter = _limiter()
+        self.assertEqual(limiter._chat_bucket(-100).rate, 10)
+        self.assertEqual(limiter._chat_bucket("@channel").rate, 10)
+        self.assertEqual(limiter._chat_bucket(100).rate, 20)
+
+    async def test_retry_after_is_honoured(self):
+        """Test that RetryAfter pauses the chat and the request is retried."""
+        limiter = _limiter()
+        callback = AsyncMock(side_effect=[RetryAfter(0), {"message_id": 1}])
+        bucket = limiter._chat_bucket(1)
+
+        result = await _send(limiter, callback)
+
+        self.assertEqual(result, {"message_id": 1})
+        self.assertEqual(callback.await_count, 2)
+        self.assertGreater(bucket.paused_until, 0)
+
+    async def test_gives_up_after_max_retries(self):
+        """Test that RetryAfter is raised once the retries are used up."""
+        limiter = _limiter(max_retries=1)
+        callback = AsyncMock(side_effect=RetryAfter(0))
+
+        with self.assertRaises(RetryAfter):
+            await _send(limiter, callback)
+        self.assertEqual(callback.await_count, 2)
+
+    async def test_requests_without_chat_use_global_bucket(self):
+        """Test that requests without a chat are only paced globally."""
+        limiter = _limiter()
+        callback = AsyncMock(return_value=True)
+
+        await limiter.process_request(callback, (), {}, "getMe", {}, None)
+
+        callback.assert_awaited_once()
+        self.assertEqual(limiter.chat_buckets, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from response_cache import ResponseCache, response_cache_key
+
+
+class TestResponseCacheKey(unittest.TestCase):
+    """Tests for keying stateless prompts."""
+
+    def test_every_part_of_the_prompt_is_in_the_key(self):
+        """Test that the model, system prompt and prompt all change the key."""
+        key = response_cache_key("gpt-4o", "Be brief.", "Hi")
+
+        self.assertEqual(key, response_cache_key("gpt-4o", "Be brief.", "Hi"))
+        self.assertNotEqual(key, response_cache_key("o1", "Be brief.", "Hi"))
+        self.assertNotEqual(key, response_cache_key("gpt-4o", "", "Hi"))
+        self.assertNotEqual(key, response_cache_key("gpt-4o", "Be brief.", "Hello"))
+
+
+class TestResponseCache(unittest.TestCase):
+    """Tests for the on-disk response cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "response_cache.db"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_hits_and_misses_are_counted(self):
+        """Test that answers are returned by key and lookups are counted."""
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get("key"))
+
+        cache.set("key", "gpt-4o", "The answer")
+
+        self.assertEqual(cache.get("key"), "The answer")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.close()
+
+    def test_survives_restarts(self):
+        """Test that answers are still there after reopening the cache."""
+        cache = ResponseCache(self.path)
+        cache.set("key", "gpt-4o", "The answer")
+        cache.close()
+
+        reopened = ResponseCache(self.path)
+        self.assertEqual(reopened.get("key"), "The answer")
+        reopened.close()
+
+    @patch("response_cache.time.time")
+    def test_entries_expire(self, mock_time):
+        """Test that answers older than the TTL are dropped."""
+        mock_time.return_value = 1000
+        cache = ResponseCache(self.path, ttl=60)
+        cache.set("key", "gpt-4o", "The answer")
+
+        mock_time.return_value = 1061
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    @patch("response_cache.time.time")
+    def test_least_recently_used_entries_are_evicted(self, mock_time):
+        """Test that going over `max_entries` evicts the least recently used."""
+        cache = ResponseCache(self.path, max_entries=2)
+        mock_time.return_value = 1
+        cache.set("a", "gpt-4o", "A")
+        mock_time.return_value = 2
+        cache.set("b", "gpt-4o", "B")
+        mock_time.return_value = 3
+        cache.get("a")
+        mock_time.return_value = 4
+        cache.set("c", "gpt-4o", "C")
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), "A")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "C")
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
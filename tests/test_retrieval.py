@@ -0,0 +1,155 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import llm
+
+from database import LogsDatabase
+from history import record_response_tokens
+from retrieval import (
+    HashingEmbedder,
+    TurnRetriever,
+    get_embedder,
+    np,
+    relevant_history_fragment,
+)
+from stub_models import log_conversation, register_stub_models
+
+FACTS = {
+    10: "my cat is called Biscuit",
+    40: "I live in Lisbon near the river",
+    70: "my favourite dessert is pastel de nata",
+}
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestHashingEmbedder(unittest.TestCase):
+    """Tests for the offline hashing embedder."""
+
+    def test_shared_words_are_similar(self):
+        """Test that texts sharing words score higher than unrelated ones."""
+        embedder = HashingEmbedder()
+        cat, cat_again, other = embedder.embed_batch(
+            ["my cat Biscuit", "what is my cat called", "the weather in Paris"]
+        )
+
+        self.assertGreater(float(cat @ cat_again), float(cat @ other))
+        self.assertEqual(len(cat), 256)
+
+    def test_get_embedder(self):
+        """Test that "hashing" ids pick the offline embedder and its size."""
+        self.assertEqual(get_embedder("hashing").model_id, "hashing-256")
+        self.assertEqual(get_embedder("hashing-64").dimensions, 64)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestTurnRetriever(unittest.TestCase):
+    """Tests for finding relevant older turns in the logs database."""
+
+    def setUp(self):
+        register_stub_models()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logs_db = LogsDatabase(Path(self.tmp_dir.name) / "logs.db")
+        self.conversation = log_conversation(
+            self.logs_db.db,
+            llm.get_model("echo"),
+            [FACTS.get(i, f"small talk number {i}") for i in range(100)],
+        )
+        self.retriever = TurnRetriever(
+            self.logs_db, embedder=HashingEmbedder(), top_k=2, min_score=0.2
+        )
+
+    def tearDown(self):
+        self.logs_db.close()
+        self.tmp_dir.cleanup()
+
+    def test_turns_are_embedded_once(self):
+        """Test that indexing only embeds turns without a vector."""
+        self.assertEqual(self.retriever.index_conversation(self.conversation.id), 100)
+        self.assertEqual(self.retriever.index_conversation(self.conversation.id), 0)
+        self.assertEqual(self.logs_db.db["response_embeddings"].count, 100)
+
+    def test_relevant_turns_are_found(self):
+        """Test that a fact from long ago is recalled by a related question."""
+        self.retriever.index_conversation(self.conversation.id)
+
+        turns = self.retriever.search(self.conversation.id, "what is my cat called?")
+
+        self.assertEqual(turns[0]["prompt"], FACTS[10])
+        self.assertLessEqual(len(turns), 2)
+
+    def test_results_are_in_chronological_order(self):
+        """Test that several matching turns come back oldest first."""
+        self.retriever.index_conversation(self.conversation.id)
+
+        turns = self.retriever.search(
+            self.conversation.id, "my dessert in Lisbon near the river"
+        )
+
+        self.assertEqual([turn["prompt"] for turn in turns], [FACTS[40], FACTS[70]])
+
+    def test_excluded_turns_are_left_out(self):
+        """Test that turns already in the history window aren't returned again."""
+        self.retriever.index_conversation(self.conversation.id)
+        excluded = {self.conversation.responses[10].id}
+
+        turns = self.retriever.search(
+            self.conversation.id, "what is my cat called?", excluded
+        )
+
+        self.assertNotIn(FACTS[10], [turn["prompt"] for turn in turns])
+
+    def test_new_turns_are_searched_after_indexing(self):
+        """Test that vectors kept in memory pick up newly embedded turns."""
+        self.retriever.index_conversation(self.conversation.id)
+        self.retriever.search(self.conversation.id, "anything")
+
+        response = self.conversation.prompt("my dog is called Rex")
+        response.text()
+        response.log_to_db(self.logs_db.db)
+        record_response_tokens(self.logs_db.db, self.conversation.id, response)
+        self.retriever.index_conversation(self.conversation.id)
+
+        turns = self.retriever.search(self.conversation.id, "what is my dog called?")
+        self.assertIn("my dog is called Rex", [turn["prompt"] for turn in turns])
+
+    def test_relevant_history_fragment(self):
+        """Test that retrieved turns are wrapped for the system prompt."""
+        self.assertEqual(
+            relevant_history_fragment([{"prompt": "Hi", "response": "Hello"}]),
+            "<relevant_history>\nUser: Hi\nAssistant: Hello\n</relevant_history>",
+        )
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestTurnIndexing(unittest.IsolatedAsyncioTestCase):
+    """Tests for embedding new turns in the background."""
+
+    async def test_turns_logged_during_indexing_are_indexed_after(self):
+        """Test that scheduling while indexing runs it again once, afterwards."""
+        with patch("retrieval.get_response_embeddings_table"):
+            retriever = TurnRetriever(MagicMock(), embedder=HashingEmbedder())
+        release = threading.Event()
+        calls = []
+
+        def index_conversation(conversation_id):
+            calls.append(conversation_id)
+            release.wait(5)
+            return 0
+
+        with patch.object(
+            retriever, "index_conversation", side_effect=index_conversation
+        ):
+            retriever.schedule_indexing("conversation")
+            retriever.schedule_indexing("conversation")
+            retriever.schedule_indexing("conversation")
+            release.set()
+            await retriever.wait()
+
+        self.assertEqual(calls, ["conversation", "conversation"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from scraper import ScrapeCache, scrape_urls
+
+
+class TestScrapeCache(unittest.TestCase):
+    """Tests for the on-disk scrape cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / "scrape_cache.db"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_and_set(self):
+        """Test that cached pages are returned by URL and format."""
+        cache = ScrapeCache(self.path)
+        cache.set("https://example.com", "# Example")
+
+        self.assertEqual(cache.get("https://example.com"), "# Example")
+        self.assertIsNone(cache.get("https://example.com", format="html"))
+        self.assertIsNone(cache.get("https://example.org"))
+        cache.close()
+
+    def test_survives_restarts(self):
+        """Test that cached pages are still there after reopening the cache."""
+        cache = ScrapeCache(self.path)
+        cache.set("https://example.com", "# Example")
+        cache.close()
+
+        reopened = ScrapeCache(self.path)
+        self.assertEqual(reopened.get("https://example.com"), "# Example")
+        reopened.close()
+
+    def test_identical_content_is_stored_once(self):
+        """Test that pages with the same content share one stored copy."""
+        cache = ScrapeCache(self.path)
+        cache.set("https://example.com/a", "same content")
+        cache.set("https://example.com/b", "same content")
+
+        self.assertEqual(cache.total_bytes(), len("same content"))
+        cache.close()
+
+    @patch("scraper.time.time")
+    def test_entries_expire(self, mock_time):
+        """Test that pages older than the TTL are dropped."""
+        mock_time.return_value = 1000
+        cache = ScrapeCache(self.path, ttl=60)
+        cache.set("https://example.com", "# Example")
+
+        mock_time.return_value = 1061
+        self.assertIsNone(cache.get("https://example.com"))
+        self.assertEqual(cache.total_bytes(), 0)
+        cache.close()
+
+    @patch("scraper.time.time")
+    def test_evicts_least_recently_used(self, mock_time):
+        """Test that the least recently used pages are evicted over the byte budget."""
+        cache = ScrapeCache(self.path, max_bytes=20)
+        mock_time.return_value = 1
+        cache.set("https://example.com/a", "a" * 10)
+        mock_time.return_value = 2
+        cache.set("https://example.com/b", "b" * 10)
+        mock_time.return_value = 3
+        cache.get("https://example.com/a")
+        mock_time.return_value = 4
+        cache.set("https://example.com/c", "c" * 10)
+
+        self.assertIsNotNone(cache.get("https://example.com/a"))
+        self.assertIsNone(cache.get("https://example.com/b"))
+        self.assertIsNotNone(cache.get("https://example.com/c"))
+        self.assertLessEqual(cache.total_bytes(), 20)
+        cache.close()
+
+
+class TestScrapeUrls(unittest.IsolatedAsyncioTestCase):
+    """Tests for scraping the links of a message."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ScrapeCache(Path(self.tmp_dir.name) / "scrape_cache.db")
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    @patch("scraper.firecrawl_app")
+    async def test_scrapes_concurrently_up_to_the_cap(self, mock_firecrawl):
+        """Test that links are scraped at once, but no more than the cap."""
+        running = 0
+        max_running = 0
+        lock = threading.Lock()
+
+        def scrape_url(url, params):
+            nonlocal running, max_running
+            with lock:
+                running += 1
+                max_running = max(max_running, running)
+            time.sleep(0.05)
+            with lock:
+                running -= 1
+            return {"markdown": f"content of {url}"}
+
+        mock_firecrawl.scrape_url.side_effect = scrape_url
+        urls = [f"https://example.com/{i}" for i in range(4)]
+
+        contents = await scrape_urls(urls, self.cache, concurrency=2)
+
+        self.assertEqual(contents, [f"content of {url}" for url in urls])
+        self.assertEqual(max_running, 2)
+
+    @patch("scraper.firecrawl_app")
+    async def test_cached_and_repeated_links_are_not_rescraped(self, mock_firecrawl):
+        """Test that cached pages and duplicate links skip the scrape."""
+        mock_firecrawl.scrape_url.return_value = {"markdown": "fresh"}
+        self.cache.set("https://example.com/cached", "cached")
+
+        contents = await scrape_urls(
+            [
+                "https://example.com/cached",
+                "https://example.com/new",
+                "https://example.com/new",
+            ],
+            self.cache,
+        )
+
+        self.assertEqual(contents, ["cached", "fresh", "fresh"])
+        mock_firecrawl.scrape_url.assert_called_once_with(
+            "https://example.com/new", params={"formats": ["markdown"]}
+        )
+        self.assertEqual(self.cache.get("https://example.com/new"), "fresh")
+
+
+if __name__ == "__main__":
+    unittest.main()
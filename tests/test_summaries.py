@@ -0,0 +1,127 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import llm
+
+from database import LogsDatabase
+from history import estimate_tokens_from_text, record_response_tokens
+from stub_models import log_conversation, register_stub_models
+from summaries import HistorySummariser, get_summary, summary_fragment
+
+
+class TestHistorySummariser(unittest.IsolatedAsyncioTestCase):
+    """Tests for rolling old turns into a running summary."""
+
+    def setUp(self):
+        register_stub_models()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logs_db = LogsDatabase(Path(self.tmp_dir.name) / "logs.db")
+        self.model = llm.get_model("echo")
+        self.pair_tokens = estimate_tokens_from_text(
+            "message number 0 here"
+        ) + estimate_tokens_from_text("echo: message number 0 here")
+        self.conversation = log_conversation(
+            self.logs_db.db,
+            self.model,
+            [f"message number {i} here" for i in range(100)],
+        )
+        # Keeps the newest 5 turns in the window, and summarises 40 turns at a time
+        self.summariser = HistorySummariser(
+            self.logs_db,
+            token_limit=self.pair_tokens * 5,
+            batch_tokens=self.pair_tokens * 40,
+            max_batches=3,
+        )
+
+    def tearDown(self):
+        self.logs_db.close()
+        self.tmp_dir.cleanup()
+
+    def summary(self):
+        return get_summary(self.logs_db.db, self.conversation.id)
+
+    async def test_turns_outside_the_window_are_summarised(self):
+        """Test that every turn older than the window is folded in, in batches."""
+        with patch.object(self.model, "prompt", wraps=self.model.prompt) as mock_prompt:
+            await self.summariser.update(self.conversation.id, self.model)
+
+        self.assertEqual(self.summary()["summarised_seq"], 95)
+        self.assertEqual(mock_prompt.call_count, 3)
+        last_prompt = mock_prompt.call_args.args[0]
+        self.assertIn("User: message number 94 here", last_prompt)
+        self.assertNotIn("message number 95 here", last_prompt)
+
+    async def test_backlogs_are_summarised_over_several_updates(self):
+        """Test that an update summarises at most `max_batches` batches."""
+        summariser = HistorySummariser(
+            self.logs_db,
+            token_limit=self.pair_tokens * 5,
+            batch_tokens=self.pair_tokens * 40,
+        )
+
+        with patch.object(self.model, "prompt", wraps=self.model.prompt) as mock_prompt:
+            await summariser.update(self.conversation.id, self.model)
+            self.assertEqual(self.summary()["summarised_seq"], 40)
+            await summariser.update(self.conversation.id, self.model)
+
+        self.assertEqual(mock_prompt.call_count, 2)
+        self.assertEqual(self.summary()["summarised_seq"], 80)
+
+    async def test_summaries_are_updated_incrementally(self):
+        """Test that later updates only read the turns since the last one."""
+        await self.summariser.update(self.conversation.id, self.model)
+        previous_summary = self.summary()["summary"]
+
+        for i in range(100, 103):
+            response = self.conversation.prompt(f"message number {i} here")
+            response.text()
+            response.log_to_db(self.logs_db.db)
+            record_response_tokens(self.logs_db.db, self.conversation.id, response)
+
+        with patch.object(self.model, "prompt", wraps=self.model.prompt) as mock_prompt:
+            await self.summariser.update(self.conversation.id, self.model)
+
+        self.assertEqual(mock_prompt.call_count, 1)
+        prompt = mock_prompt.call_args.args[0]
+        self.assertIn(previous_summary, prompt)
+        self.assertIn("User: message number 95 here", prompt)
+        self.assertNotIn("message number 94 here", prompt.replace(previous_summary, ""))
+        self.assertEqual(self.summary()["summarised_seq"], 98)
+
+    async def test_short_conversations_are_not_summarised(self):
+        """Test that nothing happens while the whole chat fits in the window."""
+        summariser = HistorySummariser(self.logs_db, token_limit=self.pair_tokens * 100)
+
+        with patch.object(self.model, "prompt") as mock_prompt:
+            await summariser.update(self.conversation.id, self.model)
+
+        mock_prompt.assert_not_called()
+        self.assertIsNone(self.summary())
+
+    async def test_updates_run_in_the_background_once_per_conversation(self):
+        """Test that scheduling again while an update runs doesn't start another."""
+        async def slow_update(conversation_id, model):
+            await asyncio.sleep(0.01)
+
+        with patch.object(
+            self.summariser, "update", side_effect=slow_update
+        ) as mock_update:
+            self.summariser.schedule(self.conversation.id, self.model)
+            self.summariser.schedule(self.conversation.id, self.model)
+            await self.summariser.wait()
+
+        mock_update.assert_called_once()
+
+    def test_summary_fragment(self):
+        """Test that the summary is wrapped for the system prompt."""
+        self.assertEqual(
+            summary_fragment("Talked about cats."),
+            "<conversation_summary>\nTalked about cats.\n</conversation_summary>",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+
+from telegram_markdown import open_code_fence, render_markdown, render_markdown_parts
+
+
+class TestRenderMarkdown(unittest.TestCase):
+    """Tests for rendering model markdown as Telegram HTML."""
+
+    def test_inline_formatting(self):
+        """Test bold, italic, strikethrough, spoilers, code and links."""
+        self.assertEqual(
+            render_markdown(
+                "**bold _and italic_** ~~gone~~ ||spoiler|| `a<b>` "
+                "[link](https://example.com?a=1&b=2)"
+            ),
+            "<b>bold <i>and italic</i></b> <s>gone</s> <tg-spoiler>spoiler</tg-spoiler> "
+            '<code>a&lt;b&gt;</code> <a href="https://example.com?a=1&amp;b=2">link</a>',
+        )
+
+    def test_links_with_parentheses(self):
+        """Test that balanced parentheses stay part of a link's URL."""
+        self.assertEqual(
+            render_markdown("[link](https://ex.com/a_(b)) tail"),
+            '<a href="https://ex.com/a_(b)">link</a> tail',
+        )
+        self.assertEqual(
+            render_markdown("([Paris](https://en.wikipedia.org/wiki/Paris_(France)))"),
+            '(<a href="https://en.wikipedia.org/wiki/Paris_(France)">Paris</a>)',
+        )
+
+    def test_bold_italic(self):
+        """Test that triple asterisks are both bold and italic."""
+        self.assertEqual(
+            render_markdown("***bold italic*** and ***b***"),
+            "<b><i>bold italic</i></b> and <b><i>b</i></b>",
+        )
+
+    def test_single_character_formatting(self):
+        """Test that one-character spans don't run on to the next marker."""
+        self.assertEqual(
+            render_markdown("**a** and **b**, ~~c~~ and ~~d~~"),
+            "<b>a</b> and <b>b</b>, <s>c</s> and <s>d</s>",
+        )
+
+    def test_text_is_escaped(self):
+        """Test that HTML in the text and unmatched markers are left as text."""
+        self.assertEqual(
+            render_markdown("<script> & snake_case_name 2 * 3 [x](javascript:alert)"),
+            "&lt;script&gt; &amp; snake_case_name 2 * 3 [x](javascript:alert)",
+        )
+
+    def test_blocks(self):
+        """Test headings, bullets, quotes and code blocks."""
+        self.assertEqual(
+            render_markdown(
+                "# Title\n- item *one*\n> quoted\n> lines\n```python\nif a < b:\n    pass\n```"
+            ),
+            "<b>Title</b>\n• item <i>one</i>\n<blockquote>quoted\nlines</blockquote>\n"
+            '<pre><code class="language-python">if a &lt; b:\n    pass</code></pre>',
+        )
+
+    def test_heading_closing_hashes(self):
+        """Test that closing #s are dropped, but a # ending a word is kept."""
+        self.assertEqual(render_markdown("# C#"), "<b>C#</b>")
+        self.assertEqual(render_markdown("## Title ##"), "<b>Title</b>")
+
+    def test_unclosed_code_block(self):
+        """Test that a code block without a closing fence runs to the end."""
+        self.assertEqual(render_markdown("```\n**not bold**"), "<pre>**not bold**</pre>")
+
+
+class TestRenderMarkdownParts(unittest.TestCase):
+    """Tests for splitting rendered markdown into messages."""
+
+    def test_short_text_is_one_part(self):
+        """Test that text within the limit isn't split."""
+        self.assertEqual(render_markdown_parts("Hello **world**", 100), ["Hello <b>world</b>"])
+
+    def test_splits_between_blocks(self):
+        """Test that parts are split at line breaks between blocks."""
+        parts = render_markdown_parts("first line\nsecond line\nthird", 25)
+        self.assertEqual(parts, ["first line\nsecond line", "third"])
+
+    def test_long_code_block_is_closed_and_reopened(self):
+        """Test that a code block split across parts is valid in each part."""
+        code = "\n".join(f"line {i}" for i in range(20))
+        parts = render_markdown_parts(f"```python\n{code}\n```", 40)
+
+        self.assertGreater(len(parts), 1)
+        for part in parts:
+            self.assertTrue(part.startswith('<pre><code class="language-python">'))
+            self.assertTrue(part.endswith("</code></pre>"))
+        self.assertEqual(
+            "\n".join(
+                part.removeprefix('<pre><code class="language-python">').removesuffix(
+                    "</code></pre>"
+                )
+                for part in parts
+            ),
+            code,
+        )
+
+    def test_formatting_is_reopened_after_split(self):
+        """Test that formatting cut by a split continues in the next part."""
+        parts = render_markdown_parts("**" + "word " * 20 + "end**", 50)
+
+        for part in parts:
+            self.assertTrue(part.startswith("<b>"))
+            self.assertTrue(part.endswith("</b>"))
+
+    def test_parts_respect_utf16_length(self):
+        """Test that the limit is measured in UTF-16 code units like Telegram does."""
+        parts = render_markdown_parts("😀" * 30, 20)
+
+        self.assertEqual(parts, ["😀" * 10, "😀" * 10, "😀" * 10])
+
+    def test_empty_text(self):
+        """Test that empty text renders to a single empty part."""
+        self.assertEqual(render_markdown_parts("\n\n", 100), [""])
+
+
+class TestOpenCodeFence(unittest.TestCase):
+    """Tests for finding an unclosed code block."""
+
+    def test_open_code_fence(self):
+        """Test that only a code block left open is reported."""
+        self.assertEqual(open_code_fence("text\n```python\ncode"), "```python")
+        self.assertIsNone(open_code_fence("text\n```python\ncode\n```"))
+        self.assertIsNone(open_code_fence("no code"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,7 +13,9 @@ from telegram_utils import (
     inline_code_has_closing_in_line,
     restricted,
     send_long_message,
+    send_markdown_message,
     special_symbol_at,
+    stream_message,
 )
 
 
@@ -106,6 +108,25 @@ class TestMarkdownEscaping(unittest.TestCase):
         # Should add closing code block
         self.assertTrue(result.endswith("\n```"))
 
+    def test_escape_markdown_v2_markers_without_closing(self):
+        """Test that format markers are only kept when closed on the same line."""
+        self.assertEqual(
+            escape_markdown_v2("**bold** and *it* but 2 * 3\nsnake_case_name __under__"),
+            "**bold** and *it* but 2 \\* 3\nsnake_case_name __under__",
+        )
+        self.assertEqual(escape_markdown_v2("*a\nb* _c_d_"), "\\*a\nb\\* _c_d\\_")
+
+    def test_escape_markdown_v2_backticks(self):
+        """Test inline code, stray backticks and backticks inside code blocks."""
+        self.assertEqual(
+            escape_markdown_v2("``x` and `a.b(c)` then `unclosed\n`"),
+            "\\``x` and `a\\.b\\(c\\)` then \\`unclosed\n\\`",
+        )
+        self.assertEqual(
+            escape_markdown_v2("text ```py\nx = `y`\nno end"),
+            "text ```py\nx = \\`y\\`\nno end\n```",
+        )
+
     def test_code_block_start_at(self):
         """Test detection of code block start."""
         text = "Some text ```code block```"
@@ -198,5 +219,139 @@ class TestSendLongMessage(unittest.TestCase):
         self.assertGreater(mock_update.message.reply_text.call_count, 1)
 
 
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class TestStreamMessage(unittest.IsolatedAsyncioTestCase):
+    """Tests for the stream_message function."""
+
+    async def test_stream_message_edits_placeholder(self):
+        """Test that the streamed text ends up in the placeholder message."""
+        mock_update = MagicMock()
+        mock_update.message.reply_text = AsyncMock()
+        placeholder = MagicMock()
+        placeholder.edit_text = AsyncMock()
+
+        result = await stream_message(
+            mock_update, placeholder, _chunks("Hello", " world"), edit_interval=0
+        )
+
+        self.assertEqual(result, "Hello world")
+        placeholder.edit_text.assert_any_call("Hello")
+        placeholder.edit_text.assert_called_with("Hello world", parse_mode="HTML")
+        mock_update.message.reply_text.assert_not_called()
+
+    async def test_stream_message_throttles_edits(self):
+        """Test that intermediate edits are skipped within the edit interval."""
+        mock_update = MagicMock()
+        placeholder = MagicMock()
+        placeholder.edit_text = AsyncMock()
+
+        await stream_message(
+            mock_update, placeholder, _chunks("a", "b", "c"), edit_interval=60
+        )
+
+        # Only the final edit is made
+        placeholder.edit_text.assert_called_once_with("abc", parse_mode="HTML")
+
+    async def test_stream_message_rolls_over_long_text(self):
+        """Test that text beyond the maximum length continues in a new message."""
+        from telegram_utils import MAX_MESSAGE_LENGTH
+
+        mock_update = MagicMock()
+        next_message = MagicMock()
+        next_message.edit_text = AsyncMock()
+        mock_update.message.reply_text = AsyncMock(return_value=next_message)
+        placeholder = MagicMock()
+        placeholder.edit_text = AsyncMock()
+
+        first_part = "A" * (MAX_MESSAGE_LENGTH - 200)
+        await stream_message(
+            mock_update,
+            placeholder,
+            _chunks(first_part, "\n", "B" * 500),
+            edit_interval=60,
+        )
+
+        placeholder.edit_text.assert_called_once_with(first_part, parse_mode="HTML")
+        mock_update.message.reply_text.assert_called_once_with("...")
+        next_message.edit_text.assert_called_once_with("B" * 500, parse_mode="HTML")
+
+    async def test_stream_message_carries_code_block_over(self):
+        """Test that a code block cut by a rollover is reopened in the next message."""
+        from telegram_utils import MAX_MESSAGE_LENGTH
+
+        mock_update = MagicMock()
+        next_message = MagicMock()
+        next_message.edit_text = AsyncMock()
+        mock_update.message.reply_text = AsyncMock(return_value=next_message)
+        placeholder = MagicMock()
+        placeholder.edit_text = AsyncMock()
+
+        code = "x = 1\n" * ((MAX_MESSAGE_LENGTH - 200) // 6)
+        await stream_message(
+            mock_update,
+            placeholder,
+            _chunks("```python\n", code, "y = 2\n" * 100, "```"),
+            edit_interval=60,
+        )
+
+        first = placeholder.edit_text.call_args.args[0]
+        second = next_message.edit_text.call_args.args[0]
+        self.assertTrue(first.endswith("</code></pre>"))
+        self.assertTrue(second.startswith('<pre><code class="language-python">'))
+        self.assertTrue(second.endswith("y = 2</code></pre>"))
+
+
+class TestSendMarkdownMessage(unittest.IsolatedAsyncioTestCase):
+    """Tests for the send_markdown_message function."""
+
+    async def test_sends_html_once(self):
+        """Test that a short answer is sent once as HTML."""
+        mock_update = MagicMock()
+        mock_update.message.reply_text = AsyncMock()
+
+        await send_markdown_message(mock_update, "Hello **world** <3")
+
+        mock_update.message.reply_text.assert_called_once_with(
+            "Hello <b>world</b> &lt;3", parse_mode="HTML"
+        )
+
+    async def test_edits_placeholder(self):
+        """Test that the placeholder is edited when the answer fits in one part."""
+        mock_update = MagicMock()
+        mock_update.message.reply_text = AsyncMock()
+        placeholder = MagicMock()
+        placeholder.edit_text = AsyncMock()
+
+        await send_markdown_message(mock_update, "Hello", placeholder=placeholder)
+
+        placeholder.edit_text.assert_called_once_with("Hello", parse_mode="HTML")
+        mock_update.message.reply_text.assert_not_called()
+
+    async def test_long_answer_is_split_into_parts(self):
+        """Test that long answers are sent as numbered parts replying to the first."""
+        from telegram_utils import MAX_MESSAGE_LENGTH
+
+        mock_update = MagicMock()
+        first_message = MagicMock()
+        first_message.reply_text = AsyncMock()
+        mock_update.message.reply_text = AsyncMock(return_value=first_message)
+        placeholder = MagicMock()
+        placeholder.delete = AsyncMock()
+
+        text = "\n".join(["word " * 100] * 20)
+        await send_markdown_message(mock_update, text, placeholder=placeholder)
+
+        placeholder.delete.assert_called_once()
+        first_part = mock_update.message.reply_text.call_args.args[0]
+        self.assertTrue(first_part.startswith("(Part 1/3)\n\n"))
+        self.assertEqual(first_message.reply_text.call_count, 2)
+        for call in first_message.reply_text.call_args_list:
+            self.assertLessEqual(len(call.args[0]), MAX_MESSAGE_LENGTH)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+from unittest.mock import patch
+
+from token_counter import HeuristicTokenizer, TokenCounter
+
+
+class TestHeuristicTokenizer(unittest.TestCase):
+    """Tests for the offline token estimate."""
+
+    def setUp(self):
+        self.tokenizer = HeuristicTokenizer()
+
+    def test_counts_words(self):
+        """Test that short words count as a token each."""
+        self.assertEqual(self.tokenizer.count("the quick brown fox"), 4)
+
+    def test_counts_code_symbols(self):
+        """Test that code counts far more tokens than its words."""
+        code = "def square(x): return x**2 + 1"
+        self.assertGreater(self.tokenizer.count(code), len(code.split()) * 1.5)
+
+    def test_counts_cjk_characters(self):
+        """Test that each CJK character counts as a token."""
+        self.assertEqual(self.tokenizer.count("这是一个测试"), 6)
+
+    def test_splits_long_words_and_numbers(self):
+        """Test that long words and numbers span several tokens."""
+        self.assertEqual(self.tokenizer.count("internationalization"), 4)
+        self.assertEqual(self.tokenizer.count("1234567"), 3)
+
+
+class TestTokenCounter(unittest.TestCase):
+    """Tests for the cached, per-model token counter."""
+
+    def test_empty_text_has_no_tokens(self):
+        """Test that empty and missing text count as zero tokens."""
+        counter = TokenCounter()
+        self.assertEqual(counter.count(""), 0)
+        self.assertEqual(counter.count(None), 0)
+
+    def test_repeated_text_is_served_from_cache(self):
+        """Test that text seen before isn't tokenised again."""
+        counter = TokenCounter()
+        tokenizer = counter.tokenizer_for("anthropic/claude-3-7-sonnet-latest")
+
+        with patch.object(tokenizer, "count", wraps=tokenizer.count) as mock_count:
+            first = counter.count("hello world", "anthropic/claude-3-7-sonnet-latest")
+            second = counter.count("hello world", "anthropic/claude-3-7-sonnet-latest")
+
+        self.assertEqual(first, second)
+        mock_count.assert_called_once_with("hello world")
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test that the cache stays within its size."""
+        counter = TokenCounter(cache_size=2)
+
+        counter.count("one")
+        counter.count("two")
+        counter.count("one")
+        counter.count("three")
+
+        tokenizer = counter.tokenizer_for(None)
+        with patch.object(tokenizer, "count", wraps=tokenizer.count) as mock_count:
+            counter.count("one")
+            counter.count("two")
+
+        # "one" was used recently so it stayed, "two" was evicted
+        mock_count.assert_called_once_with("two")
+
+    @patch("token_counter.tiktoken")
+    def test_uses_tiktoken_for_openai_models(self, mock_tiktoken):
+        """Test that OpenAI models are counted with their tiktoken encoding."""
+        mock_tiktoken.get_encoding.return_value.encode.return_value = [1, 2, 3]
+        counter = TokenCounter()
+
+        self.assertEqual(counter.count("hello world", "gpt-4o-mini"), 3)
+        mock_tiktoken.get_encoding.assert_called_once_with("o200k_base")
+
+    @patch("token_counter.tiktoken")
+    def test_falls_back_to_heuristic_offline(self, mock_tiktoken):
+        """Test that a failed encoding download falls back to the heuristic."""
+        mock_tiktoken.get_encoding.side_effect = OSError("offline")
+        counter = TokenCounter()
+
+        self.assertIsInstance(counter.tokenizer_for("gpt-4"), HeuristicTokenizer)
+        self.assertEqual(counter.count("the quick brown fox", "gpt-4"), 4)
+
+    @patch("token_counter.tiktoken", None)
+    def test_other_models_use_heuristic(self):
+        """Test that models without a known tokenizer use the heuristic."""
+        counter = TokenCounter()
+        self.assertIsInstance(
+            counter.tokenizer_for("gemini-2.0-flash"), HeuristicTokenizer
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
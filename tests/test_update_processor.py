@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+
+from telegram import Chat, Message, Update
+
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def _update(update_id: int, chat_id: int) -> Update:
+    chat = Chat(id=chat_id, type=Chat.PRIVATE)
+    return Update(
+        update_id, message=Message(update_id, date=None, chat=chat, text="hi")
+    )
+
+
+class TestChatOrderedUpdateProcessor(unittest.IsolatedAsyncioTestCase):
+    """Tests for the per-chat ordered update processor."""
+
+    async def asyncSetUp(self):
+        self.log = []
+        self.running = 0
+        self.peak = 0
+
+    async def _handle(self, name: str, delay: float):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.log.append(f"start {name}")
+        await asyncio.sleep(delay)
+        self.log.append(f"end {name}")
+        self.running -= 1
+
+    async def _process(self, processor, updates):
+        # Updates are scheduled as tasks in arrival order, like the Application does
+        await asyncio.gather(
+            *(
+                asyncio.create_task(
+                    processor.process_update(update, self._handle(name, delay))
+                )
+                for update, name, delay in updates
+            )
+        )
+
+    async def test_same_chat_stays_in_order(self):
+        """Test that updates of one chat run one after another in arrival order."""
+        processor = ChatOrderedUpdateProcessor(4, 16)
+        await self._process(
+            processor,
+            [(_update(i, 1), f"m{i}", 0.03 - i * 0.01) for i in range(3)],
+        )
+
+        self.assertEqual(
+            self.log,
+            ["start m0", "end m0", "start m1", "end m1", "start m2", "end m2"],
+        )
+        self.assertEqual(processor._chat_locks, {})
+
+    async def test_other_chats_run_concurrently(self):
+        """Test that a busy chat doesn't block updates of other chats."""
+        processor = ChatOrderedUpdateProcessor(4, 16)
+        await self._process(
+            processor,
+            [
+                (_update(1, 1), "busy1", 0.05),
+                (_update(2, 1), "busy2", 0.05),
+                (_update(3, 2), "other", 0.01),
+            ],
+        )
+
+        self.assertLess(self.log.index("end other"), self.log.index("end busy1"))
+        self.assertEqual(self.peak, 2)
+
+    async def test_global_cap(self):
+        """Test that no more than the cap run at once, even across chats."""
+        processor = ChatOrderedUpdateProcessor(2, 16)
+        await self._process(
+            processor, [(_update(i, i), f"m{i}", 0.02) for i in range(5)]
+        )
+
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(len(self.log), 10)
+
+    async def test_waiting_updates_dont_take_running_slots(self):
+        """Test that updates queued behind their own chat leave slots for other chats."""
+        processor = ChatOrderedUpdateProcessor(2, 16)
+        await self._process(
+            processor,
+            [
+                *[(_update(i, 1), f"busy{i}", 0.02) for i in range(4)],
+                (_update(10, 2), "other", 0.0),
+            ],
+        )
+
+        self.assertEqual(self.log[:3], ["start busy0", "start other", "end other"])
+
+    def test_pending_must_cover_concurrent(self):
+        """Test that the pending limit can't be lower than the concurrency cap."""
+        with self.assertRaises(ValueError):
+            ChatOrderedUpdateProcessor(8, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
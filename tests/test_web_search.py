@@ -0,0 +1,110 @@
+import json
+import time
+import unittest
+
+from stub_server import StubHTTPServer
+from web_search import BraveSearchClient, format_search_results, normalise_query
+
+SEARCH_RESULTS = {
+    "web": {
+        "results": [
+            {
+                "title": "Python",
+                "url": "https://python.org",
+                "description": "The Python language",
+            }
+        ]
+    }
+}
+
+
+def _respond_with_results(request):
+    return 200, {"Content-Type": "application/json"}, json.dumps(SEARCH_RESULTS)
+
+
+class TestFormatting(unittest.TestCase):
+    """Tests for query normalisation and result formatting."""
+
+    def test_normalise_query(self):
+        """Test that equivalent queries normalise to the same key."""
+        self.assertEqual(normalise_query('  "Python   Release"? '), "python release")
+        self.assertEqual(normalise_query("python release"), "python release")
+
+    def test_format_search_results(self):
+        """Test that results are formatted as markdown links."""
+        formatted = format_search_results(SEARCH_RESULTS)
+        self.assertIn("**[Python](https://python.org)**\nThe Python language", formatted)
+
+    def test_format_no_results(self):
+        """Test the message returned when there are no results."""
+        self.assertEqual(format_search_results({}), "No search results found.")
+
+
+class TestBraveSearchClient(unittest.IsolatedAsyncioTestCase):
+    """Tests for the async search client against a local stub server."""
+
+    async def test_search_sends_query_and_api_key(self):
+        """Test that the query and subscription token are sent to the API."""
+        with StubHTTPServer(_respond_with_results) as server:
+            client = BraveSearchClient("test-key", url=f"{server.url}/search")
+            result = await client.search("python release")
+            await client.aclose()
+
+        self.assertIn("[Python](https://python.org)", result)
+        self.assertEqual(server.requests[0].query, {"q": "python release", "count": "10"})
+        self.assertEqual(server.requests[0].headers["X-Subscription-Token"], "test-key")
+
+    async def test_similar_queries_are_cached(self):
+        """Test that repeated and similar queries don't hit the API again."""
+        with StubHTTPServer(_respond_with_results) as server:
+            client = BraveSearchClient("test-key", url=f"{server.url}/search")
+            first = await client.search("Python release")
+            second = await client.search("  python   release? ")
+            await client.aclose()
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(server.requests), 1)
+
+    async def test_connection_is_reused(self):
+        """Test that searches share a keep-alive connection."""
+        with StubHTTPServer(_respond_with_results) as server:
+            client = BraveSearchClient("test-key", url=f"{server.url}/search")
+            await client.search("first query")
+            await client.search("second query")
+            await client.aclose()
+
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.requests[0].client_port, server.requests[1].client_port)
+
+    async def test_errors_are_reported_and_not_cached(self):
+        """Test that failed searches return an error message and aren't cached."""
+        with StubHTTPServer(lambda request: (500, {}, "")) as server:
+            client = BraveSearchClient("test-key", url=f"{server.url}/search")
+            result = await client.search("python")
+            await client.search("python")
+            await client.aclose()
+
+        self.assertTrue(result.startswith("Error performing web search"))
+        self.assertEqual(len(server.requests), 2)
+
+    async def test_search_times_out(self):
+        """Test that a slow API is cut off by the timeout."""
+
+        def respond_slowly(request):
+            time.sleep(1)
+            return _respond_with_results(request)
+
+        with StubHTTPServer(respond_slowly) as server:
+            client = BraveSearchClient(
+                "test-key", url=f"{server.url}/search", timeout=0.1
+            )
+            started = time.monotonic()
+            result = await client.search("python")
+            await client.aclose()
+
+        self.assertTrue(result.startswith("Error performing web search"))
+        self.assertLess(time.monotonic() - started, 0.9)
+
+
+if __name__ == "__main__":
+    unittest.main()
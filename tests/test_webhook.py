@@ -0,0 +1,114 @@
+import asyncio
+import importlib.util
+import json
+import socket
+import unittest
+
+import httpx
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from app import webhook_options
+from fake_telegram import FakeTelegramServer
+from update_processor import ChatOrderedUpdateProcessor
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 10,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "User"},
+        "text": "hello",
+    },
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _echo(update: Update, context) -> None:
+    await update.message.reply_text(f"echo: {update.message.text}")
+
+
+@unittest.skipUnless(
+    importlib.util.find_spec("tornado"), "needs python-telegram-bot[webhooks]"
+)
+class TestWebhook(unittest.IsolatedAsyncioTestCase):
+    """Runs the bot in webhook mode against a fake Telegram server."""
+
+    async def asyncSetUp(self):
+        self.telegram = self.enterContext(FakeTelegramServer())
+        self.port = _free_port()
+        self.options = webhook_options(
+            url="https://bot.example.com",
+            listen="127.0.0.1",
+            port=self.port,
+            path="telegram",
+            secret_token="secret",
+        )
+
+        self.app = (
+            ApplicationBuilder()
+            .token("123:abc")
+            .base_url(self.telegram.base_url)
+            .concurrent_updates(ChatOrderedUpdateProcessor(4, 16))
+            .build()
+        )
+        self.app.add_handler(MessageHandler(filters.TEXT, _echo))
+
+        await self.app.initialize()
+        await self.app.updater.start_webhook(**self.options)
+        await self.app.start()
+
+    async def asyncTearDown(self):
+        await self.app.updater.stop()
+        await self.app.stop()
+        await self.app.shutdown()
+
+    async def _post_update(self, secret_token: str) -> httpx.Response:
+        async with httpx.AsyncClient() as client:
+            return await client.post(
+                f"http://127.0.0.1:{self.port}/telegram",
+                content=json.dumps(UPDATE),
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Telegram-Bot-Api-Secret-Token": secret_token,
+                },
+            )
+
+    async def _wait_for_reply(self) -> list[dict]:
+        for _ in range(100):
+            if self.telegram.calls_to("sendMessage"):
+                break
+            await asyncio.sleep(0.01)
+        return self.telegram.calls_to("sendMessage")
+
+    async def test_registers_webhook_with_secret(self):
+        """Test that the webhook URL and secret token are registered with Telegram."""
+        [params] = self.telegram.calls_to("setWebhook")
+        self.assertEqual(params["url"], "https://bot.example.com/telegram")
+        self.assertEqual(params["secret_token"], "secret")
+
+    async def test_update_is_handled(self):
+        """Test that an update posted to the webhook reaches the handlers."""
+        response = await self._post_update("secret")
+        self.assertEqual(response.status_code, 200)
+
+        [reply] = await self._wait_for_reply()
+        self.assertEqual(reply["chat_id"], 42)
+        self.assertEqual(reply["text"], "echo: hello")
+
+    async def test_wrong_secret_is_rejected(self):
+        """Test that requests without the secret token are refused."""
+        response = await self._post_update("wrong")
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.telegram.calls_to("sendMessage"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import logfire
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, the heuristic works offline
+    tiktoken = None
+
+# Number of token counts kept in memory, keyed by tokenizer and text hash
+TOKEN_COUNT_CACHE_SIZE = 8192
+
+# Splits text into the pieces BPE tokenizers tend to produce a token for:
+# CJK characters, runs of letters, up to three digits, or a single symbol
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_PIECE_PATTERN = re.compile(
+    rf"[{_CJK}]|[^\W\d_{_CJK}]+|\d{{1,3}}|[^\w\s]|_"
+)
+# Long words get split into several tokens, roughly one per this many letters
+_LETTERS_PER_TOKEN = 6
+
+# Tiktoken encodings for the model families that use them, most specific first
+_TIKTOKEN_ENCODINGS = (
+    ("gpt-4o", "o200k_base"),
+    ("chatgpt-4o", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("o3", "o200k_base"),
+    ("o4", "o200k_base"),
+    ("gpt-4.1", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+)
+
+
+class HeuristicTokenizer:
+    """
+    Estimates tokens without any vocabulary, so it works offline for every model.
+    Unlike counting words it accounts for code symbols, numbers and CJK text,
+    which all use far more tokens than their word count suggests.
+    """
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        tokens = 0
+        for piece in _PIECE_PATTERN.findall(text):
+            if len(piece) > _LETTERS_PER_TOKEN:
+                tokens += -(-len(piece) // _LETTERS_PER_TOKEN)
+            else:
+                tokens += 1
+        return tokens
+
+
+class TiktokenTokenizer:
+    """Counts tokens exactly with one of OpenAI's tiktoken encodings."""
+
+    def __init__(self, encoding_name: str):
+        self.name = f"tiktoken:{encoding_name}"
+        self._encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+class TokenCounter:
+    """
+    Picks a tokenizer for each model family and caches counts by a hash of the
+    text, so counting history that has been seen before costs almost nothing.
+    """
+
+    def __init__(self, cache_size: int = TOKEN_COUNT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._heuristic = HeuristicTokenizer()
+        self._tokenizers = {}
+        self._encodings = {}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tiktoken_tokenizer(self, encoding_name: str):
+        if encoding_name not in self._encodings:
+            try:
+                self._encodings[encoding_name] = TiktokenTokenizer(encoding_name)
+            except Exception as e:
+                # The encoding is downloaded on first use, which fails offline
+                logfire.warn(f"Falling back to heuristic token counts: {e}")
+                self._encodings[encoding_name] = self._heuristic
+        return self._encodings[encoding_name]
+
+    def tokenizer_for(self, model_id: str | None):
+        if model_id not in self._tokenizers:
+            tokenizer = self._heuristic
+            if tiktoken is not None and model_id:
+                # Strip a provider prefix like "openai/"
+                family = model_id.rsplit("/", 1)[-1]
+                for prefix, encoding_name in _TIKTOKEN_ENCODINGS:
+                    if family.startswith(prefix):
+                        tokenizer = self._tiktoken_tokenizer(encoding_name)
+                        break
+            self._tokenizers[model_id] = tokenizer
+        return self._tokenizers[model_id]
+
+    def count(self, text: str | None, model_id: str | None = None) -> int:
+        if not text:
+            return 0
+
+        tokenizer = self.tokenizer_for(model_id)
+        key = (
+            tokenizer.name,
+            hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(),
+        )
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        tokens = tokenizer.count(text)
+
+        with self._lock:
+            self._cache[key] = tokens
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates from different chats concurrently while keeping the updates
+    of each chat in the order they arrived.
+
+    At most `max_concurrent_updates` handlers run at once. Updates waiting behind
+    an earlier message of their own chat don't take one of those slots, so a busy
+    chat can't hold up everyone else. `max_pending_updates` bounds how many
+    updates may be in flight in total, waiting or running.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int):
+        if max_pending_updates < max_concurrent_updates:
+            raise ValueError(
+                "`max_pending_updates` must be at least `max_concurrent_updates`"
+            )
+        super().__init__(max_pending_updates)
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: dict[int, asyncio.Lock] = {}
+        self._chat_waiters: dict[int, int] = {}
+
+    @staticmethod
+    def _chat_key(update: object) -> int | None:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        async with self._running:
+            await coroutine
+
+    async def do_process_update(
+        self, update: object, coroutine: Awaitable[Any]
+    ) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            return await self._run(coroutine)
+
+        # asyncio locks wake their waiters in FIFO order, and updates are handed
+        # to the processor in the order they arrive, so each chat stays in order
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._chat_waiters[key] -= 1
+            if not self._chat_waiters[key]:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,90 @@
+import re
+
+import httpx
+import logfire
+
+from cache import TTLCache
+from config import (
+    brave_search_api_key,
+    web_search_cache_size,
+    web_search_cache_ttl,
+    web_search_timeout,
+)
+
+BRAVE_SEARCH_URL = "https://api.search.brave.com/res/v1/web/search"
+
+
+def normalise_query(query: str) -> str:
+    """Lowercases a query and collapses whitespace and surrounding punctuation/quotes."""
+    return re.sub(r"\s+", " ", query).strip().strip("\"'.?!").strip().lower()
+
+
+def format_search_results(results: dict) -> str:
+    # Format the results as markdown
+    if "web" in results and "results" in results["web"]:
+        formatted_results = "### Web Search Results\n\n"
+        for result in results["web"]["results"]:
+            title = result.get("title", "No title")
+            url = result.get("url", "")
+            description = result.get("description", "No description available")
+            formatted_results += f"**[{title}]({url})**\n{description}\n\n"
+        return formatted_results
+    else:
+        return "No search results found."
+
+
+class BraveSearchClient:
+    """
+    An async client for the Brave Search API that keeps a pooled keep-alive
+    connection open and caches formatted results by normalised query.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None,
+        url: str = BRAVE_SEARCH_URL,
+        timeout: float = web_search_timeout,
+        cache_size: int = web_search_cache_size,
+        cache_ttl: float = web_search_cache_ttl,
+    ):
+        self.url = url
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self._client = httpx.AsyncClient(
+            headers={
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip",
+                "X-Subscription-Token": api_key or "",
+            },
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        )
+
+    async def search(self, query: str) -> str:
+        """Perform a web search using the Brave Search API and return the formatted results."""
+        cache_key = normalise_query(query)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logfire.info(f"Web search cache hit for: {cache_key}")
+            return cached
+
+        params = {
+            "q": query,
+            "count": 10,  # Number of results to return
+        }
+
+        try:
+            response = await self._client.get(self.url, params=params)
+            response.raise_for_status()
+            formatted_results = format_search_results(response.json())
+        except Exception as e:
+            logfire.error(f"Error performing web search: {e!r}")
+            return f"Error performing web search: {str(e) or type(e).__name__}"
+
+        self.cache.set(cache_key, formatted_results)
+        return formatted_results
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+web_search_client = BraveSearchClient(brave_search_api_key)